@@ -1,37 +1,38 @@
 import os
 import json
+import asyncio
+import hashlib
 from dotenv import load_dotenv
 from loguru import logger
-from yandex_cloud_ml_sdk import YCloudML
+from app.ai.sdk import get_sdk
+from app.ai.concurrency import run_limited, run_background, ai_slot
+from app.ai.call_policy import thread_calls, thread_writes, assistant_runs, assistant_breaker, AI_RUN_DEADLINE
+from app.ai.thread_history import thread_history
+from app.metrics import span
+from app.inventory.retrieval import inventory_context
 
 # Загрузка переменных окружения из файла .env
 load_dotenv()
 
-# Получение идентификаторов папки и API ключа из переменных окружения
-FOLDER_ID = os.getenv('YC_FOLDER_ID')
-API_KEY = os.getenv('YC_API_KEY')
+# Интервал опроса статуса запуска ассистента в секундах
+AI_POLL_INTERVAL = float(os.getenv('AI_POLL_INTERVAL', '0.5'))
+# Файл, в котором хранится идентификатор созданного ассистента между перезапусками
+ASSISTANT_STATE_PATH = os.getenv('ASSISTANT_STATE_PATH', 'data/assistant.json')
+# Файл с идентификатором поискового индекса, его пишет create_rag_index.py.
+# Лежит в data/, чтобы переживать пересборку контейнера; прежний index_id.json в рабочем каталоге
+# читается, пока нового файла еще нет
+INDEX_ID_PATH = os.getenv('INDEX_ID_PATH', 'data/index_id.json')
+LEGACY_INDEX_ID_PATH = 'index_id.json'
 
-# Инициализация SDK Yandex Cloud с использованием полученных идентификаторов
-sdk = YCloudML(folder_id=FOLDER_ID, auth=API_KEY)
+# Фоновые удаления ненужных потоков; ссылки держим, чтобы задачи не собрал сборщик мусора
+_discarding = set()
 
-def create_assistant():
-    """Создает ассистента с заданными параметрами."""
-    # Открываем файл index_id.json для получения идентификатора индекса
-    with open('index_id.json', 'r') as file:
-        data = json.load(file)
-        index_id = data.get('index_id')  # Извлекаем index_id из данных
-        
-    # Получаем индекс поиска по его идентификатору
-    search_index = sdk.search_indexes.get(index_id)
-    # Создаем инструмент поиска с максимальным количеством результатов 5
-    search_tool = sdk.tools.search_index(search_index, max_num_results=5)
-    
-    # Создаем ассистента с заданными параметрами
-    return sdk.assistants.create(
-        name="support-bot",  # Имя ассистента
-        model='yandexgpt',  # Модель, которую будет использовать ассистент
-        temperature=0.4,  # Параметр, определяющий креативность ответов
-        instruction="""
+# Параметры ассистента: при изменении любого из них ассистент создается заново
+ASSISTANT_NAME = "support-bot"
+ASSISTANT_MODEL = 'yandexgpt'
+ASSISTANT_TEMPERATURE = 0.4
+SEARCH_MAX_RESULTS = 5
+ASSISTANT_INSTRUCTION = """
             Ты кладовщица, добрая, милая и шутница.
 
             Важно:
@@ -72,32 +73,225 @@ def create_assistant():
             
             
 
-        """,  # Инструкция для ассистента
+        """
+
+def read_index_id() -> str:
+    """Читает идентификатор поискового индекса из index_id.json."""
+    path = INDEX_ID_PATH if os.path.exists(INDEX_ID_PATH) else LEGACY_INDEX_ID_PATH
+    with open(path, 'r') as file:
+        data = json.load(file)
+    return data.get('index_id')  # Извлекаем index_id из данных
+
+def assistant_fingerprint(index_id: str) -> str:
+    """Возвращает отпечаток настроек ассистента и индекса."""
+    settings = [ASSISTANT_MODEL, ASSISTANT_TEMPERATURE, ASSISTANT_INSTRUCTION, SEARCH_MAX_RESULTS, index_id]
+    return hashlib.sha256(json.dumps(settings, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _load_state() -> dict:
+    """Загружает сохраненные идентификатор и отпечаток ассистента."""
+    try:
+        with open(ASSISTANT_STATE_PATH, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(assistant_id: str, fingerprint: str):
+    """Сохраняет идентификатор и отпечаток ассистента."""
+    os.makedirs(os.path.dirname(ASSISTANT_STATE_PATH) or '.', exist_ok=True)
+    with open(ASSISTANT_STATE_PATH, 'w') as file:
+        json.dump({'assistant_id': assistant_id, 'fingerprint': fingerprint}, file, indent=4)
+
+async def create_assistant(index_id: str):
+    """Создает ассистента с заданными параметрами."""
+    sdk = get_sdk()
+    # Получаем индекс поиска по его идентификатору
+    search_index = await sdk.search_indexes.get(index_id)
+    # Создаем инструмент поиска с максимальным количеством результатов 5
+    search_tool = sdk.tools.search_index(search_index, max_num_results=SEARCH_MAX_RESULTS)
+    
+    # Создаем ассистента с заданными параметрами
+    return await sdk.assistants.create(
+        name=ASSISTANT_NAME,  # Имя ассистента
+        model=ASSISTANT_MODEL,  # Модель, которую будет использовать ассистент
+        temperature=ASSISTANT_TEMPERATURE,  # Параметр, определяющий креативность ответов
+        instruction=ASSISTANT_INSTRUCTION,  # Инструкция для ассистента
         tools=[search_tool],  # Инструменты, которые будет использовать ассистент
         ttl_days=30,  # Время жизни ассистента в днях
         expiration_policy="SINCE_LAST_ACTIVE"  # Политика истечения
     )
 
-# Создаем ассистента и сохраняем его в переменной
-assistant = create_assistant()
+async def delete_assistant(assistant_id: str):
+    """Удаляет ассистента, ошибки только пишутся в лог."""
+    try:
+        assistant = await get_sdk().assistants.get(assistant_id)
+        await assistant.delete()
+        logger.info(f"Удален устаревший ассистент: {assistant_id}")
+    except Exception as e:
+        logger.debug(f"Не удалось удалить устаревший ассистент {assistant_id}: {e}")
 
-async def ai_assistant(message: str, thread_id: str):
-    """Отправляет сообщение в указанный поток и получает ответ ассистента."""
-    # Получаем поток по его идентификатору
-    thread = sdk.threads.get(thread_id)
-    # Записываем сообщение в поток
-    thread.write(message)
-    
-    # Запускаем ассистента и ждем ответа
-    response = assistant.run(thread.id).wait()
-    return response.message.parts[0]  # Возвращаем первый элемент ответа
+async def load_or_create_assistant(index_id: str = None, delete_old: bool = True):
+    """Возвращает сохраненного ассистента или создает нового, если изменились настройки или индекс.
+
+    При delete_old=False ассистент со старыми настройками не удаляется: по нему могут еще идти запуски.
+    """
+    sdk = get_sdk()
+    index_id = index_id or read_index_id()
+    fingerprint = assistant_fingerprint(index_id)
+    state = _load_state()
+    old_assistant_id = state.get('assistant_id')
+
+    if old_assistant_id and state.get('fingerprint') == fingerprint:
+        try:
+            assistant = await sdk.assistants.get(old_assistant_id)
+            logger.info(f"Используется сохраненный ассистент: {assistant.id}")
+            return assistant
+        except Exception as e:
+            logger.warning(f"Сохраненный ассистент {old_assistant_id} недоступен: {e}")
+
+    assistant = await create_assistant(index_id)
+    _save_state(assistant.id, fingerprint)
+    logger.info(f"Создан ассистент: {assistant.id}")
+
+    # Удаляем ассистента со старыми настройками, чтобы они не копились до истечения TTL
+    if delete_old and old_assistant_id and old_assistant_id != assistant.id:
+        await delete_assistant(old_assistant_id)
+    return assistant
 
-async def ai_assistant_new_thread(chat_id: str) -> str:
-    """Создает новый поток для чата."""
+# Ассистент создается при первом обращении, а не при импорте модуля
+_assistant = None
+_assistant_lock = asyncio.Lock()
+
+async def get_assistant():
+    """Возвращает ассистента, создавая его при первом обращении."""
+    global _assistant
+    if _assistant is None:
+        async with _assistant_lock:
+            if _assistant is None:
+                _assistant = await load_or_create_assistant()
+    return _assistant
+
+def swap_assistant(assistant):
+    """Переключает новые запросы на другого ассистента и возвращает прежнего.
+
+    Запуски, уже получившие прежнего ассистента, доработают на нем.
+    """
+    global _assistant
+    previous, _assistant = _assistant, assistant
+    return previous
+
+async def prepare_assistant():
+    """Заранее готовит ассистента в фоне, чтобы первый запрос пользователя не ждал его создания."""
+    try:
+        await get_assistant()
+    except Exception as e:
+        logger.error(f"Не удалось подготовить ассистента: {e}")
+
+def with_inventory_context(message: str) -> str:
+    """Добавляет к вопросу подходящие позиции склада, чтобы ассистенту не нужно было искать их инструментом."""
+    with span('retrieval'):
+        context = inventory_context(message)
+    return f"{message}\n\n{context}" if context else message
+
+async def ai_assistant(message: str, thread_id: str, prompt: str = None):
+    """Отправляет сообщение в указанный поток и получает ответ ассистента.
+
+    prompt - уже собранный with_inventory_context(message), если вызывающему он тоже нужен.
+    """
+    sdk = get_sdk()
+    prompt = prompt or with_inventory_context(message)
+
+    async def _ask():
+        # Получаем поток по его идентификатору
+        with span('thread_fetch'):
+            thread = await thread_calls.call(lambda: sdk.threads.get(thread_id))
+        # Записываем сообщение в поток
+        with span('thread_write'):
+            await thread_writes.call(lambda: thread.write(prompt))
+
+        # Запускаем ассистента и ждем ответа не дольше AI_RUN_DEADLINE.
+        # Отменить запуск SDK не позволяет: зависший запуск просто перестаем ждать
+        assistant = await get_assistant()
+
+        async def _run():
+            run = await assistant.run(thread)
+            return await run.wait(poll_interval=AI_POLL_INTERVAL)
+
+        with span('assistant_run'):
+            return await assistant_runs.call(_run)
+
+    response = await run_limited(_ask())
+    answer = response.message.parts[0]  # Первый элемент ответа
+
+    # Ассистент уже записал вопрос и ответ в поток, обновляем только локальную копию
+    await thread_history.record(thread_id, 'user', message)
+    await thread_history.record(thread_id, 'assistant', answer)
+    return answer
+
+async def ai_assistant_stream(message: str, thread_id: str, prompt: str = None):
+    """Отправляет сообщение в поток и по мере генерации отдает накопленный текст ответа."""
+    sdk = get_sdk()
+    prompt = prompt or with_inventory_context(message)
+    async with ai_slot() as deadline:
+        async with asyncio.timeout_at(deadline):
+            with span('thread_fetch'):
+                thread = await thread_calls.call(lambda: sdk.threads.get(thread_id))
+            with span('thread_write'):
+                await thread_writes.call(lambda: thread.write(prompt))
+            assistant = await get_assistant()
+
+        # Потоковый ответ нельзя повторить, поэтому только учитываем его в предохранителе.
+        # Каждое событие ждем не дольше AI_RUN_DEADLINE и не позже общего срока: зависший ответ
+        # завершается TimeoutError внутри генератора, а не отменой того, кто читает ответ
+        loop = asyncio.get_running_loop()
+        with assistant_breaker.guard():
+            async with asyncio.timeout_at(deadline):
+                with span('assistant_run'):
+                    run = await assistant.run_stream(thread)
+            text = ''
+            events = aiter(run)
+            while True:
+                try:
+                    async with asyncio.timeout_at(min(deadline, loop.time() + AI_RUN_DEADLINE)):
+                        event = await anext(events)
+                except StopAsyncIteration:
+                    break
+                if event.is_failed:
+                    raise RuntimeError(f"Ошибка генерации ответа: {event.error}")
+                if not (event.is_running or event.is_succeeded):
+                    continue
+                part = event.text
+                # Частичные сообщения приходят накопленными, но на случай приращений склеиваем их
+                text = part if part.startswith(text) or event.is_succeeded else text + part
+                yield text
+                if event.is_succeeded:
+                    break
+
+    await thread_history.record(thread_id, 'user', message)
+    await thread_history.record(thread_id, 'assistant', text)
+
+async def ai_assistant_new_thread(chat_id: str, background: bool = False) -> str:
+    """Создает новый поток для чата; background - по бюджету фоновых вызовов, а не ответов пользователям."""
+    run = run_background if background else run_limited
     # Создаем новый поток с заданным именем и временем жизни 7 дней
-    thread = sdk.threads.create(
-        name=f'thread-{chat_id}',  # Имя потока, основанное на идентификаторе чата
-        ttl_days=7,  # Время жизни потока в днях
-        expiration_policy="SINCE_LAST_ACTIVE"  # Политика истечения
-    )
-    return thread.id  # Возвращаем идентификатор нового потока
\ No newline at end of file
+    with span('thread_create'):
+        thread = await run(thread_writes.call(lambda: get_sdk().threads.create(
+            name=f'thread-{chat_id}',  # Имя потока, основанное на идентификаторе чата
+            ttl_days=7,  # Время жизни потока в днях
+            expiration_policy="SINCE_LAST_ACTIVE"  # Политика истечения
+        )))
+    thread_history.mark_new(thread.id)
+    return thread.id  # Возвращаем идентификатор нового потока
+
+async def _delete_thread(thread_id: str):
+    try:
+        thread = await run_background(get_sdk().threads.get(thread_id))
+        await run_background(thread.delete())
+        logger.debug(f"Ненужный поток {thread_id} удален")
+    except Exception as e:
+        logger.warning(f"Не удалось удалить ненужный поток {thread_id}: {e}")
+
+def ai_assistant_discard_thread(thread_id: str):
+    """Удаляет в фоне поток, который не понадобился, не задерживая ответ."""
+    task = asyncio.create_task(_delete_thread(thread_id))
+    _discarding.add(task)
+    task.add_done_callback(_discarding.discard)
@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+from typing import Optional
+import dotenv
+from loguru import logger
+from app.cache import LRUCache
+from app.metrics import CACHE_REQUESTS
+from app.inventory.normalize import tokenize
+from app.inventory.units import parse_constraints
+from app.inventory.search import INVENTORY_PATH, INVENTORY_STORE_PATH
+from app.ai.ai_assistants import INDEX_ID_PATH
+from app.db_wrappers.state import SHARED_STATE, get_cached_answer, save_cached_answer, delete_stale_answers
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Максимальное количество ответов в памяти
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+# Время жизни ответа в секундах
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+# Сохранять ли ответы в хранилище состояния, чтобы кэш переживал перезапуск и был общим для реплик
+# (по умолчанию включено при общем хранилище, иначе у каждой реплики был бы свой кэш)
+ANSWER_CACHE_PERSIST = os.getenv('ANSWER_CACHE_PERSIST', str(SHARED_STATE)) == 'True'
+
+# Файлы базы знаний: при их изменении все ответы считаются устаревшими
+KNOWLEDGE_FILES = (INDEX_ID_PATH, INVENTORY_PATH, INVENTORY_STORE_PATH)
+# Как часто проверять изменение файлов базы знаний, в секундах
+FINGERPRINT_CHECK_INTERVAL = 5.0
+
+# Слова, которые не меняют смысл вопроса
+FILLER_WORDS = {
+    'ну', 'же', 'а', 'пожалуйста', 'плиз', 'привет', 'здравствуйте',
+    'подскажи', 'подскажите', 'скажи', 'скажите',
+}
+
+def normalize_query(text: str) -> str:
+    """Приводит вопрос к каноническому виду для ключа кэша.
+
+    Регистр и пробелы схлопываются, похожие кириллические и латинские буквы в кодах
+    приводятся к одному виду, а величины записываются единообразно: "2 ампера", "2А", "2 А" и "2a" дают "2A".
+    Отдельно стоящая строчная "a" считается словом, а не единицей: "предохранитель 2 a" не меняется.
+    """
+    constraints, rest = parse_constraints(text)
+    words = [token for token in tokenize(rest) if token not in FILLER_WORDS]
+    quantities = sorted(
+        f"{q.lo:g}{q.unit}" if q.lo == q.hi else f"{q.lo:g}-{q.hi:g}{q.unit}"
+        for q in constraints
+    )
+    return ' '.join(words + quantities)
+
+def knowledge_fingerprint() -> str:
+    """Возвращает отпечаток файлов базы знаний по времени изменения и размеру."""
+    parts = []
+    for path in KNOWLEDGE_FILES:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        except OSError:
+            parts.append(f"{path}:-")
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:16]
+
+class AnswerCache:
+    """Кэш ответов ассистента по нормализованному вопросу с TTL, LRU и необязательной записью в хранилище состояния."""
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 persist: bool = ANSWER_CACHE_PERSIST):
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        # Суммарное время генерации ответов, которые были выданы из кэша
+        self.saved_seconds = 0.0
+        self._memory = LRUCache(maxsize, ttl)
+        self._fingerprint = knowledge_fingerprint()
+        self._checked_at = time.monotonic()
+
+    async def _check_fingerprint(self):
+        """Сбрасывает кэш, если изменились index_id.json или файлы склада."""
+        now = time.monotonic()
+        if now - self._checked_at < FINGERPRINT_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        fingerprint = knowledge_fingerprint()
+        if fingerprint != self._fingerprint:
+            logger.info("База знаний изменилась, кэш ответов сброшен")
+            self._fingerprint = fingerprint
+            self._memory.clear()
+            if self.persist:
+                await delete_stale_answers(fingerprint, time.time() - self.ttl)
+
+    async def get(self, query: str, namespace: str = 'assistant', stale: bool = False) -> Optional[str]:
+        """Возвращает сохраненный ответ на вопрос или None.
+
+        При stale=True из хранилища берется и ответ старше TTL, если база знаний с тех пор не менялась:
+        когда ассистент недоступен, старый ответ лучше никакого.
+        """
+        await self._check_fingerprint()
+        key = f"{namespace}:{normalize_query(query)}"
+
+        item = self._memory.get(key)
+        if item is None and self.persist:
+            row = await get_cached_answer(key, self._fingerprint, 0.0 if stale else time.time() - self.ttl)
+            if row:
+                item = (row[0], row[1] or 0.0)
+                self._memory.set(key, item)
+
+        if item is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=namespace, result='miss')
+            return None
+
+        answer, duration = item
+        self.hits += 1
+        self.saved_seconds += duration
+        CACHE_REQUESTS.inc(cache=namespace, result='hit')
+        logger.debug(f"Ответ из кэша, сэкономлено {duration:.1f} с: {key}")
+        return answer
+
+    async def set(self, query: str, answer: str, duration: float = 0.0, namespace: str = 'assistant'):
+        """Сохраняет ответ на вопрос вместе со временем, которое ушло на его генерацию."""
+        normalized = normalize_query(query)
+        if not normalized or not answer:
+            return
+        key = f"{namespace}:{normalized}"
+        self._memory.set(key, (answer, duration))
+        if self.persist:
+            await save_cached_answer(key, answer, self._fingerprint, time.time(), duration)
+
+    async def invalidate(self):
+        """Полностью сбрасывает кэш."""
+        self._memory.clear()
+        self._fingerprint = knowledge_fingerprint()
+        if self.persist:
+            await delete_stale_answers(self._fingerprint, time.time())
+
+    def stats(self) -> dict:
+        """Возвращает статистику попаданий в кэш."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self._memory),
+            'saved_seconds': self.saved_seconds,
+        }
+
+# Общий кэш ответов для всего приложения
+answer_cache = AnswerCache()
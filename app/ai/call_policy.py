@@ -0,0 +1,275 @@
+import os
+import time
+import random
+import asyncio
+import contextlib
+from collections import deque
+from typing import Awaitable, Callable, Optional
+import dotenv
+import httpx
+from loguru import logger
+from app.metrics import RETRIES, HEDGES, CIRCUIT_OPEN
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Предельное время коротких вызовов Yandex Cloud (поток, запись в поток) и одной их попытки, в секундах
+AI_CALL_DEADLINE = float(os.getenv('AI_CALL_DEADLINE', '15'))
+AI_ATTEMPT_TIMEOUT = float(os.getenv('AI_ATTEMPT_TIMEOUT', '5'))
+# Предельное время запуска ассистента до готового ответа
+AI_RUN_DEADLINE = float(os.getenv('AI_RUN_DEADLINE', '60'))
+# Предельное время генеративного поиска (повторы при 429/5xx делает сам HTTP-клиент)
+SEARCHAPI_DEADLINE = float(os.getenv('SEARCHAPI_DEADLINE', '30'))
+# Повторы идемпотентных вызовов и базовая задержка между ними
+AI_CALL_RETRIES = int(os.getenv('AI_CALL_RETRIES', '2'))
+AI_RETRY_BACKOFF = float(os.getenv('AI_RETRY_BACKOFF', '0.5'))
+# Отправлять ли второй такой же запрос, если первый дольше обычного (p95)
+AI_HEDGING = os.getenv('AI_HEDGING', 'True') == 'True'
+# Предохранитель: после скольких ошибок подряд сервис считается недоступным и на сколько секунд
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', '30'))
+
+# Сколько последних длительностей помнить и сколько нужно, чтобы оценить p95
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+
+# Коды gRPC, после которых вызов имеет смысл повторить
+RETRY_CODES = {'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'RESOURCE_EXHAUSTED', 'ABORTED'}
+
+class CircuitOpen(Exception):
+    """Предохранитель разомкнут: сервис недавно не отвечал, вызов не выполняется."""
+
+def is_transient(error: Exception) -> bool:
+    """Временная ли ошибка: таймаут, ошибка сети, HTTP 429/5xx или gRPC-код недоступности."""
+    if isinstance(error, (TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    code = getattr(error, 'code', None)
+    if callable(code):
+        with contextlib.suppress(Exception):
+            return getattr(code(), 'name', None) in RETRY_CODES
+    return False
+
+class CircuitBreaker:
+    """Предохранитель сервиса.
+
+    После failures временных ошибок подряд вызовы сразу получают CircuitOpen, не дожидаясь таймаутов.
+    Постоянные ошибки отдельного запроса (истекший поток, неверный запрос) значат, что сервис ответил,
+    и учитываются как успех: иначе несколько чатов с устаревшими потоками разомкнули бы его для всех.
+    Через reset_timeout секунд пропускается один пробный вызов: успех замыкает предохранитель,
+    ошибка размыкает его снова.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probing = False
+        CIRCUIT_OPEN.set(0, target=name)
+
+    @property
+    def state(self) -> str:
+        """closed - вызовы идут, open - отклоняются, half_open - можно сделать пробный вызов."""
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self) -> bool:
+        """Проверяет, можно ли выполнить вызов; иначе бросает CircuitOpen. Возвращает True для пробного вызова."""
+        state = self.state
+        if state == 'closed':
+            return False
+        if state == 'half_open' and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        raise CircuitOpen(f"Сервис {self.name} недоступен, вызов не выполняется")
+
+    def record_success(self, probe: bool = False):
+        self.failures = 0
+        if probe:
+            self._probing = False
+        if self._opened_at is not None:
+            self._opened_at = None
+            CIRCUIT_OPEN.set(0, target=self.name)
+            logger.info(f"Сервис {self.name} снова отвечает")
+
+    def record_failure(self, probe: bool = False):
+        self.failures += 1
+        if probe or (self._opened_at is None and self.failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            self.trips += 1
+            CIRCUIT_OPEN.set(1, target=self.name)
+            logger.warning(f"Сервис {self.name} не отвечает ({self.failures} ошибок подряд), "
+                           f"вызовы отклоняются {self.reset_timeout:.0f} с")
+        if probe:
+            self._probing = False
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Учитывает результат блока; нужен там, где вызов нельзя передать в CallPolicy, например при потоковом ответе."""
+        probe = self.before_call()
+        try:
+            yield
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            if is_transient(e):
+                self.record_failure(probe)
+            else:
+                self.record_success(probe)
+            raise
+        else:
+            self.record_success(probe)
+        finally:
+            # Отмененный пробный вызов не говорит о состоянии сервиса; флаг пробы снимает только она сама,
+            # иначе завершившийся параллельно обычный вызов открыл бы дорогу второй пробе
+            if probe:
+                self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            'open': int(self.state == 'open'),
+            'failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected,
+        }
+
+class CallPolicy:
+    """Правила вызова внешнего сервиса: предельное время, повторы с задержкой, дублирующий запрос и предохранитель.
+
+    Вызов передается фабрикой корутин, потому что для повтора и дублирующего запроса нужна новая корутина.
+    Повторы и дублирование включаются только для идемпотентных вызовов.
+    """
+
+    def __init__(self, name: str, breaker: CircuitBreaker, deadline: float, retries: int = 0,
+                 attempt_timeout: Optional[float] = None, backoff: float = AI_RETRY_BACKOFF, hedge: bool = False):
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.retries = retries
+        self.attempt_timeout = attempt_timeout
+        self.backoff = backoff
+        self.hedge = hedge
+        self.calls = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.hedged = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Через сколько секунд отправлять дублирующий запрос или None, если дублирование выключено."""
+        if not self.hedge or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * HEDGE_PERCENTILE))]
+
+    async def call(self, factory: Callable[[], Awaitable], deadline: Optional[float] = None):
+        """Выполняет вызов по правилам. Бросает CircuitOpen, TimeoutError или последнюю ошибку вызова."""
+        deadline = self.deadline if deadline is None else deadline
+        loop = asyncio.get_running_loop()
+        until = loop.time() + deadline
+        self.calls += 1
+        try:
+            with self.breaker.guard():
+                return await self._call(factory, loop, until)
+        except CircuitOpen:
+            raise
+        except TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            logger.warning(f"Вызов {self.name} не уложился в {deadline:.0f} с")
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+    async def _call(self, factory, loop, until: float):
+        for attempt in range(self.retries + 1):
+            remaining = until - loop.time()
+            timeout = min(self.attempt_timeout or remaining, remaining)
+            started = loop.time()
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await self._attempt(factory)
+            except Exception as e:
+                remaining = until - loop.time()
+                if attempt == self.retries or remaining <= 0 or not is_transient(e):
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                if delay >= remaining:
+                    raise
+                self.retried += 1
+                RETRIES.inc(target=self.name)
+                logger.warning(f"Ошибка вызова {self.name}: {e!r}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+            else:
+                self._latencies.append(loop.time() - started)
+                return result
+
+    async def _attempt(self, factory):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await factory()
+
+        # Долгий запрос дублируется, берется первый успешный ответ, второй отменяется
+        first = asyncio.ensure_future(factory())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.hedged += 1
+                HEDGES.inc(target=self.name)
+                pending.add(asyncio.ensure_future(factory()))
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """Возвращает количество вызовов, ошибок, таймаутов, повторов и дублирующих запросов."""
+        return {
+            'calls': self.calls,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'retried': self.retried,
+            'hedged': self.hedged,
+            'hedge_delay': self.hedge_delay() or 0.0,
+        }
+
+# Все вызовы ассистента идут через один предохранитель: недоступность сервиса видна по любому из них
+assistant_breaker = CircuitBreaker('assistant')
+searchapi_breaker = CircuitBreaker('searchapi')
+
+# Получение потока идемпотентно: его можно повторять и дублировать
+thread_calls = CallPolicy('thread_calls', assistant_breaker, AI_CALL_DEADLINE, retries=AI_CALL_RETRIES,
+                          attempt_timeout=AI_ATTEMPT_TIMEOUT, hedge=AI_HEDGING)
+# Запись в поток и создание потока при повторе могут задвоиться, поэтому только ограничиваются по времени
+thread_writes = CallPolicy('thread_writes', assistant_breaker, AI_CALL_DEADLINE)
+# Запуск ассистента пишет ответ в поток, второй запуск на том же потоке недопустим
+assistant_runs = CallPolicy('assistant_runs', assistant_breaker, AI_RUN_DEADLINE)
+# Генеративный поиск без состояния, долгий запрос можно продублировать
+searchapi_calls = CallPolicy('searchapi', searchapi_breaker, SEARCHAPI_DEADLINE, hedge=AI_HEDGING)
+
+def policy_stats() -> dict:
+    """Статистика всех правил вызова и предохранителей для метрик."""
+    stats = {policy.name: policy.stats() for policy in (thread_calls, thread_writes, assistant_runs, searchapi_calls)}
+    stats.update({f"breaker_{breaker.name}": breaker.stats() for breaker in (assistant_breaker, searchapi_breaker)})
+    return stats
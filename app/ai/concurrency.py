@@ -0,0 +1,107 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Максимальное количество одновременных обращений к Yandex Cloud
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '8'))
+# Таймаут одного запроса пользователя к Yandex Cloud в секундах
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '90'))
+
+# Квота Yandex Cloud на ответы пользователям: запросов в секунду и допустимый всплеск
+AI_RATE_LIMIT = float(os.getenv('AI_RATE_LIMIT', '8'))
+AI_RATE_BURST = int(os.getenv('AI_RATE_BURST', '8'))
+# Отдельный, меньший бюджет фоновых вызовов (запись истории в потоки, сжатие потоков),
+# чтобы они не задерживали ответы; вместе с AI_RATE_LIMIT должен укладываться в квоту
+AI_BACKGROUND_RATE_LIMIT = float(os.getenv('AI_BACKGROUND_RATE_LIMIT', '2'))
+AI_BACKGROUND_CONCURRENCY = int(os.getenv('AI_BACKGROUND_CONCURRENCY', '2'))
+
+class TokenBucket:
+    """Ограничитель частоты: маркеры пополняются со скоростью rate, запас не больше capacity."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Забирает маркер, при необходимости дожидаясь его появления."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._updated is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                self._tokens = 1.0
+                self._updated = loop.time()
+            self._tokens -= 1
+
+# Семафор, ограничивающий количество параллельных запросов
+_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+# Общий ограничитель частоты запросов к Yandex Cloud
+_bucket = TokenBucket(AI_RATE_LIMIT, AI_RATE_BURST)
+# Слоты и ограничитель частоты фоновых вызовов
+_background_semaphore = asyncio.Semaphore(AI_BACKGROUND_CONCURRENCY)
+_background_bucket = TokenBucket(AI_BACKGROUND_RATE_LIMIT, max(1, int(AI_BACKGROUND_RATE_LIMIT)))
+
+async def run_limited(coro, timeout: float = None):
+    """Выполняет корутину с ограничением параллелизма, частоты и таймаутом.
+
+    Таймаут учитывает и ожидание свободного слота, и само выполнение.
+    """
+    return await _run_with(_semaphore, _bucket, coro, timeout)
+
+async def run_background(coro, timeout: float = None):
+    """Как run_limited, но по бюджету фоновых вызовов: они не занимают слоты и маркеры ответов пользователям."""
+    return await _run_with(_background_semaphore, _background_bucket, coro, timeout)
+
+async def _run_with(semaphore: asyncio.Semaphore, bucket: TokenBucket, coro, timeout: float = None):
+    timeout = AI_REQUEST_TIMEOUT if timeout is None else timeout
+    started = False
+
+    async def _run():
+        nonlocal started
+        async with semaphore:
+            await bucket.acquire()
+            started = True
+            return await coro
+
+    try:
+        return await asyncio.wait_for(_run(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Запрос к Yandex Cloud не уложился в {timeout} с")
+        raise
+    finally:
+        # Корутина могла так и не запуститься, если слот не освободился
+        if not started:
+            coro.close()
+
+@asynccontextmanager
+async def ai_slot(timeout: float = None):
+    """Занимает слот параллельных запросов на время блока и отдает срок его завершения (время цикла событий).
+
+    Нужен там, где результат отдается частями и корутину нельзя передать в run_limited.
+    Таймаутом ограничено только ожидание слота: блок сам ограничивает сроком каждое ожидание,
+    иначе отмена по таймауту могла бы прийти в код, читающий результат между частями.
+    """
+    timeout = AI_REQUEST_TIMEOUT if timeout is None else timeout
+    deadline = asyncio.get_running_loop().time() + timeout
+    async with asyncio.timeout_at(deadline):
+        await _semaphore.acquire()
+    try:
+        async with asyncio.timeout_at(deadline):
+            await _bucket.acquire()
+        yield deadline
+    finally:
+        _semaphore.release()
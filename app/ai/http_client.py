@@ -0,0 +1,78 @@
+import os
+import random
+import asyncio
+import importlib.util
+import dotenv
+import httpx
+from loguru import logger
+from urllib.parse import urlsplit
+from app.metrics import RETRIES
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Таймауты HTTP-запросов в секундах: установка соединения и ожидание ответа
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))
+# Размер пула соединений
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '10'))
+# Количество повторов при 429/5xx и ошибках сети, базовая задержка между ними
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.5'))
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# HTTP/2 включается, только если установлен пакет h2
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+# Общий клиент с пулом соединений, создается при первом обращении
+_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий асинхронный HTTP-клиент с keep-alive пулом соединений."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+async def close_http_client():
+    """Закрывает общий HTTP-клиент и его соединения."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    """Задержка перед повтором: Retry-After от сервера или экспоненциальная с джиттером."""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return float(retry_after)
+    return random.uniform(0, HTTP_BACKOFF * 2 ** attempt)
+
+async def post_with_retry(url: str, retries: int = HTTP_RETRIES, **kwargs) -> httpx.Response:
+    """Отправляет POST-запрос через общий клиент, повторяя его при 429/5xx и ошибках сети."""
+    client = get_http_client()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.post(url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == retries:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"Ошибка сети при запросе к {url}: {e!r}, повтор через {delay:.1f} с")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = retry_delay(attempt, response)
+            logger.warning(f"Ответ {response.status_code} от {url}, повтор через {delay:.1f} с")
+        RETRIES.inc(target=urlsplit(url).netloc)
+        await asyncio.sleep(delay)
@@ -0,0 +1,175 @@
+import os
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import dotenv
+from loguru import logger
+from app.ai.sdk import get_sdk
+from app.ai.ai_assistants import (
+    INDEX_ID_PATH,
+    read_index_id,
+    get_assistant,
+    prepare_assistant,
+    load_or_create_assistant,
+    swap_assistant,
+    delete_assistant,
+)
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Как часто проверять index_id.json на изменения, в секундах
+INDEX_WATCH_INTERVAL = float(os.getenv('INDEX_WATCH_INTERVAL', '30'))
+# Как часто проверять срок жизни индекса и ассистента, в секундах
+INDEX_REFRESH_INTERVAL = float(os.getenv('INDEX_REFRESH_INTERVAL', '21600'))
+# За сколько дней до истечения продлевать индекс и ассистента
+INDEX_REFRESH_MARGIN_DAYS = float(os.getenv('INDEX_REFRESH_MARGIN_DAYS', '5'))
+# Через сколько секунд после переключения удалять прежнего ассистента, чтобы начатые запуски успели доработать
+ASSISTANT_RETIRE_DELAY = float(os.getenv('ASSISTANT_RETIRE_DELAY', '600'))
+# Пересобирать ли индекс через create_rag_index.py, если прежний уже истек
+INDEX_AUTO_REBUILD = os.getenv('INDEX_AUTO_REBUILD', 'True') == 'True'
+
+# Время жизни индекса и ассистента в днях, как при их создании
+RESOURCE_TTL_DAYS = 30
+
+def _file_signature(path: str):
+    """Время изменения и размер файла или None, если файла нет."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _expires_soon(expires_at: Optional[datetime], margin: timedelta) -> bool:
+    if expires_at is None:
+        return False
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at - datetime.now(timezone.utc) < margin
+
+class IndexManager:
+    """Подменяет поисковый индекс и ассистента без перезапуска бота.
+
+    Следит за index_id.json, в фоне готовит ассистента для нового индекса и переключает на него
+    новые запросы; запуски, начатые на прежнем ассистенте, дорабатывают на нем. Заранее продлевает
+    индекс и ассистента, пока не истек их срок жизни.
+    """
+
+    def __init__(self, path: str = INDEX_ID_PATH):
+        self.path = path
+        self.index_id = None
+        self.switches = 0
+        self.refreshes = 0
+        self._signature = None
+        self._lock = asyncio.Lock()
+        self._tasks = []
+        self._retiring = set()
+
+    def start(self):
+        """Запускает фоновые задачи наблюдения и продления."""
+        self._tasks = [
+            asyncio.create_task(self._watch()),
+            asyncio.create_task(self._refresh_loop()),
+        ]
+
+    async def stop(self):
+        """Останавливает фоновые задачи."""
+        # Непрошедшие отложенные удаления отменяются, прежний ассистент истечет сам
+        tasks = self._tasks + list(self._retiring)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def reload(self, force: bool = False) -> bool:
+        """Перечитывает index_id.json и переключается на новый индекс. Возвращает True, если было переключение."""
+        async with self._lock:
+            self._signature = _file_signature(self.path)
+            index_id = read_index_id()
+            if not force and index_id == self.index_id:
+                return False
+
+            logger.info(f"Подготовка ассистента для индекса {index_id}")
+            assistant = await load_or_create_assistant(index_id, delete_old=False)
+            previous = swap_assistant(assistant)
+            self.index_id = index_id
+            self.switches += 1
+            logger.info(f"Новые запросы идут к ассистенту {assistant.id} с индексом {index_id}")
+
+            if previous is not None and previous.id != assistant.id:
+                task = asyncio.create_task(self._retire(previous.id))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+            return True
+
+    async def _retire(self, assistant_id: str):
+        # Начатые запуски дорабатывают на прежнем ассистенте, удаляем его позже
+        await asyncio.sleep(ASSISTANT_RETIRE_DELAY)
+        await delete_assistant(assistant_id)
+
+    async def _watch(self):
+        # Первый ассистент создается как обычно, дальше следим за файлом
+        await prepare_assistant()
+        self.index_id = read_index_id()
+        self._signature = _file_signature(self.path)
+        while True:
+            await asyncio.sleep(INDEX_WATCH_INTERVAL)
+            signature = _file_signature(self.path)
+            if signature is None or signature == self._signature:
+                continue
+            try:
+                await self.reload()
+            except Exception as e:
+                # Остаемся на прежнем ассистенте до следующего изменения файла
+                logger.error(f"Не удалось переключиться на новый индекс: {e}")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(INDEX_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка продления индекса и ассистента: {e}")
+
+    async def refresh(self):
+        """Продлевает индекс и ассистента, если их срок жизни скоро истечет; истекший индекс пересобирает."""
+        margin = timedelta(days=INDEX_REFRESH_MARGIN_DAYS)
+        sdk = get_sdk()
+        try:
+            search_index = await sdk.search_indexes.get(self.index_id or read_index_id())
+        except Exception as e:
+            logger.error(f"Поисковый индекс недоступен: {e}")
+            if INDEX_AUTO_REBUILD:
+                await self.rebuild()
+            return
+
+        if _expires_soon(search_index.expires_at, margin):
+            await search_index.update(ttl_days=RESOURCE_TTL_DAYS, expiration_policy="SINCE_LAST_ACTIVE")
+            self.refreshes += 1
+            logger.info(f"Срок жизни индекса {search_index.id} продлен")
+
+        assistant = await get_assistant()
+        if _expires_soon(getattr(assistant, 'expires_at', None), margin):
+            await assistant.update(ttl_days=RESOURCE_TTL_DAYS, expiration_policy="SINCE_LAST_ACTIVE")
+            self.refreshes += 1
+            logger.info(f"Срок жизни ассистента {assistant.id} продлен")
+
+    async def rebuild(self):
+        """Пересобирает индекс из базы знаний и переключается на него."""
+        # Импорт здесь: скрипт сборки и его настройки нужны боту только при пересборке
+        import create_rag_index
+        logger.info("Пересборка поискового индекса")
+        # Файлы истекшего индекса тоже могли истечь, поэтому загружаем все заново
+        await create_rag_index.main(full_rebuild=True)
+        await self.reload()
+
+    def stats(self) -> dict:
+        """Возвращает текущий индекс и количество переключений и продлений."""
+        return {
+            'index_id': self.index_id,
+            'switches': self.switches,
+            'refreshes': self.refreshes,
+        }
+
+# Общий менеджер индекса для всего приложения
+index_manager = IndexManager()
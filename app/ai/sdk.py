@@ -0,0 +1,20 @@
+import os
+from dotenv import load_dotenv
+from yandex_cloud_ml_sdk import AsyncYCloudML
+
+# Загрузка переменных окружения из файла .env
+load_dotenv()
+
+# Получение идентификаторов папки и API ключа из переменных окружения
+FOLDER_ID = os.getenv('YC_FOLDER_ID')
+API_KEY = os.getenv('YC_API_KEY')
+
+# Общий клиент SDK для всего приложения, создается при первом обращении
+_sdk = None
+
+def get_sdk() -> AsyncYCloudML:
+    """Возвращает общий асинхронный клиент SDK Yandex Cloud."""
+    global _sdk
+    if _sdk is None:
+        _sdk = AsyncYCloudML(folder_id=FOLDER_ID, auth=API_KEY)
+    return _sdk
@@ -1,8 +1,10 @@
 import os
-import requests
 import dotenv
 from loguru import logger
-from yandex_cloud_ml_sdk import YCloudML
+from app.ai.thread_history import thread_history
+from app.ai.http_client import post_with_retry, RETRY_STATUSES
+from app.ai.call_policy import searchapi_calls
+from app.metrics import span
 
 # Загрузка переменных окружения
 dotenv.load_dotenv()
@@ -17,8 +19,18 @@ SERP_SITE = os.getenv('SERP_SITE', None)
 SERP_HOST = os.getenv('SERP_HOST', None)
 SERP_URL = os.getenv('SERP_URL', None)
 
-# Инициализация SDK Yandex Cloud
-sdk = YCloudML(folder_id=FOLDER_ID, auth=API_KEY)
+async def post_search(data: dict):
+    """Отправляет запрос генеративного поиска с предельным временем и предохранителем."""
+    headers = {"Authorization": f"Api-Key {API_KEY}"}
+
+    async def _request():
+        response = await post_with_retry(SEARCH_API_GENERATIVE, headers=headers, json=data)
+        # 429/5xx после всех повторов означает, что сервис недоступен
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    return await searchapi_calls.call(_request)
 
 def process_response(response):
     """Обрабатывает ответ от API и возвращает комбинированный контент."""
@@ -27,8 +39,9 @@ def process_response(response):
 
     # Проверяем тип контента в ответе
     if "application/json" in response.headers.get("Content-Type", ""):
-        content = response.json().get("message", {}).get("content", "")
-        sources = response.json().get("links", [])
+        payload = response.json()
+        content = payload.get("message", {}).get("content", "")
+        sources = payload.get("links", [])
         logger.info(content)
         for i, link in enumerate(sources, start=1):
             logger.info(f"[{i}]: {link}")
@@ -43,14 +56,12 @@ def process_response(response):
 
 async def search_api_generative_contextual(message: str, thread_id: str):
     """Выполняет генеративный поиск с учетом контекста треда."""
-    # Получаем сообщения из треда
-    thread_messages = sdk.threads.get(thread_id).read()
-    messages = [{"content": item.parts[0], "role": item.role} for item in thread_messages]
+    # Берем свежую часть истории из локальной копии треда в пределах бюджета токенов
+    messages = await thread_history.window(thread_id)
     
     # Добавляем новое сообщение от пользователя
     messages.append({"content": message, "role": "user"})
     
-    headers = {"Authorization": f"Api-Key {API_KEY}"}
     data = {
         "messages": messages,
         "site": SERP_SITE,
@@ -58,19 +69,18 @@ async def search_api_generative_contextual(message: str, thread_id: str):
         "url": SERP_URL
     }
 
-    # Отправляем запрос к API
-    response = requests.post(SEARCH_API_GENERATIVE, headers=headers, json=data)
+    # Отправляем запрос к API через общий пул соединений
+    with span('search_api'):
+        response = await post_search(data)
     combined_content = process_response(response)
     
-    # Записываем сообщения в тред
-    thread = sdk.threads.get(thread_id)
-    thread.write(message)
-    thread.write(combined_content, labels={"role": "assistant"})
+    # Записываем сообщения в историю, в удаленный тред они уходят в фоне
+    await thread_history.append(thread_id, "user", message)
+    await thread_history.append(thread_id, "assistant", combined_content)
     return combined_content
 
 async def search_api_generative(message: str):
     """Выполняет генеративный поиск без контекста треда."""
-    headers = {"Authorization": f"Api-Key {API_KEY}"}
     data = {
         "messages": [{"content": message, "role": "user"}],
         "site": SERP_SITE,
@@ -78,8 +88,9 @@ async def search_api_generative(message: str):
         "url": SERP_URL
     }
 
-    # Отправляем запрос к API
-    response = requests.post(SEARCH_API_GENERATIVE, headers=headers, json=data)
+    # Отправляем запрос к API через общий пул соединений
+    with span('search_api'):
+        response = await post_search(data)
     combined_content = process_response(response)
     
     return combined_content
\ No newline at end of file
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Optional
+from loguru import logger
+
+class SingleFlight:
+    """Объединяет одинаковые запросы, пока первый из них выполняется: все ждут один результат.
+
+    Запрос выполняется отдельной задачей, поэтому отмена первого обработчика не обрывает его для остальных.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._waiters = {}
+        # Сколько раз запрос действительно выполнялся и сколько вызовов удалось сэкономить
+        self.calls = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    async def do(self, key: Optional[str], func, *args):
+        """Выполняет func(*args) или присоединяется к уже идущему запросу с тем же ключом.
+
+        Возвращает пару (результат, shared): shared истинно, если результат получен от чужого запроса.
+        При key=None запрос выполняется без объединения.
+        """
+        if key is None:
+            self.calls += 1
+            return await func(*args), False
+
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+            self._waiters[key] += 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+            logger.debug(f"Запрос присоединен к выполняющемуся, ожидающих: {self._waiters[key]}: {key}")
+            return await asyncio.shield(task), True
+
+        self.calls += 1
+        task = asyncio.ensure_future(func(*args))
+        self._flights[key] = task
+        self._waiters[key] = 0
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key: str, task: asyncio.Future):
+        self._flights.pop(key, None)
+        self._waiters.pop(key, None)
+        # Ошибку получают ожидающие; если все они отменены, не даем asyncio ругаться на нее
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        """Возвращает статистику объединения запросов."""
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights),
+            'waiting': sum(self._waiters.values()),
+            'max_waiters': self.max_waiters,
+        }
+
+# Общий объединитель запросов к ассистенту и Search API
+single_flight = SingleFlight()
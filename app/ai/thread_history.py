@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+from typing import List, Optional
+import dotenv
+from loguru import logger
+from app.cache import LRUCache
+from app.ai.sdk import get_sdk
+from app.ai.concurrency import run_limited, run_background
+from app.db_wrappers.state import SHARED_STATE, add_thread_messages, get_thread_messages
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Сколько потоков держать в памяти
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '1000'))
+# Сколько последних сообщений потока держать в памяти и читать из базы
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', '200'))
+# Бюджет токенов на историю в запросе к Search API
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '3000'))
+# Грубая оценка: для русского текста один токен - примерно три символа
+CHARS_PER_TOKEN = 3
+
+def estimate_tokens(text: str) -> int:
+    """Оценивает количество токенов в тексте."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def token_window(messages: List[tuple], budget: int) -> List[tuple]:
+    """Возвращает самые свежие сообщения, суммарно укладывающиеся в бюджет токенов."""
+    window = []
+    total = 0
+    for message in reversed(messages):
+        total += message[2]
+        if total > budget and window:
+            break
+        window.append(message)
+    window.reverse()
+    return window
+
+class ThreadHistory:
+    """Локальная копия истории потоков: хранилище состояния только на дозапись и кэш последних сообщений в памяти.
+
+    Запросы строятся по локальной копии, а запись в удаленный поток идет в фоне.
+    При общем хранилище сообщения в поток дописывают и другие реплики, поэтому история всегда
+    читается из хранилища, а память лишь отмечает потоки, уже перенесенные из удаленного потока.
+    """
+
+    def __init__(self, cache_size: int = HISTORY_CACHE_SIZE, max_messages: int = HISTORY_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._memory = LRUCache(cache_size)
+        # Последняя фоновая запись по каждому потоку, чтобы сообщения уходили по порядку
+        self._pending = {}
+
+    async def load(self, thread_id: str) -> List[tuple]:
+        """Возвращает последние сообщения потока: (role, content, tokens).
+
+        Если локальной копии еще нет, она один раз заполняется из удаленного потока.
+        """
+        messages = self._memory.get(thread_id)
+        if messages is not None and not SHARED_STATE:
+            return messages
+
+        known = messages is not None
+        messages = await get_thread_messages(thread_id, self.max_messages)
+        if not messages and not known:
+            messages = await self._import_remote(thread_id)
+        self._memory.set(thread_id, messages)
+        return messages
+
+    async def _import_remote(self, thread_id: str) -> List[tuple]:
+        """Переносит историю удаленного потока в локальную копию."""
+        thread = await run_limited(get_sdk().threads.get(thread_id))
+        remote = await run_limited(_read_thread(thread))
+        remote.sort(key=lambda item: item.created_at)
+
+        now = time.time()
+        messages = []
+        for item in remote[-self.max_messages:]:
+            role = (item.labels or {}).get('role') or item.author.role.lower()
+            messages.append((role, item.text, estimate_tokens(item.text)))
+        if messages:
+            await add_thread_messages([(thread_id, *message, now) for message in messages])
+            logger.debug(f"История потока {thread_id} перенесена в локальную копию: {len(messages)} сообщений")
+        return messages
+
+    def mark_new(self, thread_id: str):
+        """Отмечает только что созданный поток, чтобы не читать его пустую историю."""
+        self._memory.set(thread_id, [])
+
+    async def append(self, thread_id: str, role: str, content: str, sync: bool = True):
+        """Дописывает сообщение в локальную копию и, если sync, в фоне отправляет его в удаленный поток."""
+        messages = await self.load(thread_id)
+        message = (role, content, estimate_tokens(content))
+        messages.append(message)
+        del messages[:-self.max_messages]
+        await add_thread_messages([(thread_id, *message, time.time())])
+
+        if sync:
+            previous = self._pending.get(thread_id)
+            task = asyncio.create_task(self._write_remote(previous, thread_id, role, content))
+            self._pending[thread_id] = task
+            task.add_done_callback(lambda done: self._forget(thread_id, done))
+
+    async def record(self, thread_id: str, role: str, content: str):
+        """Дописывает в локальную копию сообщение, которое уже есть в удаленном потоке."""
+        if self._memory.get(thread_id) is None and not await get_thread_messages(thread_id, 1):
+            # Локальной копии нет: при первом чтении она целиком возьмется из удаленного потока
+            return
+        await self.append(thread_id, role, content, sync=False)
+
+    def _forget(self, thread_id: str, task: asyncio.Task):
+        # Убираем запись, только если за ней не поставлена следующая
+        if self._pending.get(thread_id) is task:
+            del self._pending[thread_id]
+
+    async def _write_remote(self, previous: Optional[asyncio.Task], thread_id: str, role: str, content: str):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            thread = await run_background(get_sdk().threads.get(thread_id))
+            if role == 'user':
+                await run_background(thread.write(content))
+            else:
+                await run_background(thread.write(content, labels={"role": role}))
+        except Exception as e:
+            logger.error(f"Не удалось записать сообщение в поток {thread_id}: {e}")
+
+    async def window(self, thread_id: str, budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+        """Возвращает свежую часть истории в пределах бюджета токенов в формате сообщений API."""
+        messages = token_window(await self.load(thread_id), budget)
+        return [{"content": content, "role": role} for role, content, _ in messages]
+
+    async def flush(self):
+        """Дожидается отправки всех сообщений в удаленные потоки."""
+        pending = list(self._pending.values())
+        if pending:
+            await asyncio.wait(pending)
+
+async def _read_thread(thread) -> list:
+    """Читает все сообщения треда."""
+    return [message async for message in thread.read()]
+
+# Общая история потоков для всего приложения
+thread_history = ThreadHistory()
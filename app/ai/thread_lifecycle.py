@@ -0,0 +1,89 @@
+import os
+import asyncio
+import dotenv
+from loguru import logger
+from app.ai.sdk import get_sdk
+from app.ai.concurrency import run_background
+from app.ai.thread_history import thread_history, estimate_tokens, token_window
+from app.ai.ai_assistants import ai_assistant_new_thread, ai_assistant_discard_thread
+from app.db_wrappers.state import add_context_usage, swap_thread_id
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Порог сжатия: количество сообщений или оценка токенов в потоке
+COMPACT_MAX_MESSAGES = int(os.getenv('COMPACT_MAX_MESSAGES', '40'))
+COMPACT_MAX_TOKENS = int(os.getenv('COMPACT_MAX_TOKENS', '8000'))
+# Сколько токенов истории отдавать модели для пересказа
+COMPACT_INPUT_TOKENS = int(os.getenv('COMPACT_INPUT_TOKENS', '6000'))
+# Модель для пересказа: облегченная модель дешевле и быстрее основной
+COMPACT_MODEL = os.getenv('COMPACT_MODEL', 'yandexgpt-lite')
+
+SUMMARY_INSTRUCTION = (
+    "Кратко перескажи разговор пользователя с ассистентом по технической документации. "
+    "Сохрани оборудование, модели, номиналы, места хранения и нерешенные вопросы. "
+    "Не добавляй ничего от себя, не больше 15 предложений."
+)
+# С этой фразы начинается пересказ в новом потоке
+SUMMARY_PREFIX = "Краткое содержание предыдущего разговора:\n"
+
+# Фоновые задачи сжатия по chat_id: не больше одной на чат
+_compacting = {}
+
+async def summarize(messages: list) -> str:
+    """Пересказывает историю потока облегченной моделью."""
+    dialog = '\n'.join(f"{role}: {content}" for role, content, _ in messages)
+    model = get_sdk().models.completions(COMPACT_MODEL).configure(temperature=0.2)
+    result = await run_background(model.run([
+        {"role": "system", "text": SUMMARY_INSTRUCTION},
+        {"role": "user", "text": dialog},
+    ]))
+    return result.alternatives[0].text.strip()
+
+async def compact_thread(chat_id: str, thread_id: str, context_tokens: int):
+    """Пересказывает поток чата в новый поток и подменяет им старый."""
+    messages = token_window(await thread_history.load(thread_id), COMPACT_INPUT_TOKENS)
+    if not messages:
+        return
+    summary = SUMMARY_PREFIX + await summarize(messages)
+
+    new_thread_id = await ai_assistant_new_thread(chat_id, background=True)
+    thread = await run_background(get_sdk().threads.get(new_thread_id))
+    await run_background(thread.write(summary, labels={"role": "assistant"}))
+    await thread_history.record(new_thread_id, 'assistant', summary)
+
+    summary_tokens = estimate_tokens(summary)
+    swapped = await swap_thread_id(
+        chat_id, thread_id, new_thread_id,
+        message_count=1, context_tokens=summary_tokens,
+        tokens_saved=max(context_tokens - summary_tokens, 0),
+    )
+    if swapped:
+        logger.info(f"Поток чата {chat_id} сжат: {context_tokens} -> {summary_tokens} токенов")
+    else:
+        logger.debug(f"Поток чата {chat_id} сменился во время сжатия, пересказ не используется")
+        ai_assistant_discard_thread(new_thread_id)
+
+async def _compact_in_background(chat_id: str, thread_id: str, context_tokens: int):
+    try:
+        await compact_thread(chat_id, thread_id, context_tokens)
+    except Exception as e:
+        logger.error(f"Не удалось сжать поток чата {chat_id}: {e}")
+    finally:
+        _compacting.pop(chat_id, None)
+
+async def track_exchange(chat_id: str, thread_id: str, question: str, answer: str, prompt: str = None):
+    """Учитывает вопрос и ответ в счетчиках потока и запускает сжатие в фоне при превышении порога.
+
+    prompt - сообщение, которое на самом деле ушло в поток (вопрос с позициями склада), если оно длиннее вопроса.
+    """
+    tokens = estimate_tokens(prompt or question) + estimate_tokens(answer)
+    usage = await add_context_usage(chat_id, thread_id, 2, tokens)
+    if usage is None:
+        return
+    message_count, context_tokens = usage
+    if message_count < COMPACT_MAX_MESSAGES and context_tokens < COMPACT_MAX_TOKENS:
+        return
+    if chat_id in _compacting:
+        return
+    _compacting[chat_id] = asyncio.create_task(_compact_in_background(chat_id, thread_id, context_tokens))
@@ -1,5 +1,5 @@
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, MessageHandler, InlineQueryHandler, filters
 from loguru import logger
 import dotenv
 import os
@@ -9,8 +9,13 @@ from app.handlers import (
     searchapi_contextual_handler,
     ai_assistant_handler,
     new_thread_handler,
+    stats_handler,
+    reload_index_handler,
+    inline_query_handler,
     help_handler
 )
+from app.inventory.search import get_inventory
+from app.inventory.inline import get_inline_index
 from telegram import BotCommand
 
 # Загрузка переменных окружения
@@ -19,6 +24,8 @@ dotenv.load_dotenv()
 # Получение токена и настройки ответа
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 REPLY_ALL = os.getenv("REPLY_ALL") == "True"
+# Сколько обновлений обрабатывается одновременно; порядок внутри чата держит планировщик
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
 
 async def register_handlers(application: Application) -> None:
     """Регистрация обработчиков команд и сообщений."""
@@ -27,7 +34,8 @@ async def register_handlers(application: Application) -> None:
         BotCommand("help", "Помощь"),
         #BotCommand("searchapi", "Поиск через SearchAPI"),
         #BotCommand("searchapi_contextual", "Поиск через SearchAPI с контекстом треда"),
-        BotCommand("new_thread", "Создать новый поток")
+        BotCommand("new_thread", "Создать новый поток"),
+        BotCommand("stats", "Размер контекста потока")
     ]
     
     # Устанавливаем команды для бота
@@ -42,6 +50,9 @@ async def register_handlers(application: Application) -> None:
     #application.add_handler(CommandHandler("searchapi", searchapi_handler))
     #application.add_handler(CommandHandler("searchapi_contextual", searchapi_contextual_handler))
     application.add_handler(CommandHandler("new_thread", new_thread_handler))
+    application.add_handler(CommandHandler("stats", stats_handler))
+    # Служебная команда не показывается в меню
+    application.add_handler(CommandHandler("reload_index", reload_index_handler))
     
     # Регистрация обработчика текстовых сообщений
     application.add_handler(
@@ -51,14 +62,21 @@ async def register_handlers(application: Application) -> None:
         ),
     )
     
+    # Встроенный режим (@бот запрос) отвечает позициями склада; его нужно включить у BotFather командой /setinline
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+    
     logger.info("Все обработчики успешно зарегистрированы.")
 
 async def bot_init() -> Application:
     """Инициализация бота и регистрация обработчиков."""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(CONCURRENT_UPDATES).build()
     
     logger.debug("Инициализация бота завершена.")
     
+    # Загружаем индекс склада заранее, чтобы первый запрос не ждал
+    get_inventory()
+    get_inline_index()
+    
     # Регистрируем обработчики
     await register_handlers(application)
     
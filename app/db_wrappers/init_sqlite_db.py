@@ -1,9 +1,9 @@
 import sqlite3
 from loguru import logger
 import os
+from app.db_wrappers.logstore import init_log_store
 
-def init_sqlite_db():
-    db_path = 'data/tgbot.db'
+def init_sqlite_db(db_path: str = 'data/tgbot.db', log_db_path: str = None):
     
     # Проверяем существование директории и создаем её при необходимости
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
@@ -13,6 +13,9 @@ def init_sqlite_db():
     with sqlite3.connect(db_path) as conn:
         cursor = conn.cursor()
         
+        # Режим WAL сохраняется в файле базы, поэтому его достаточно включить один раз
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Создаем таблицы, если они не существуют
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS tgbot_chats (
@@ -23,17 +26,46 @@ def init_sqlite_db():
         ''')
         
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tgbot_logs (
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            cache_key TEXT PRIMARY KEY,
+            answer TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            duration REAL
+        )
+        ''')
+        
+        # Счетчики размера контекста потока; колонки добавляются и в уже существующие базы
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(tgbot_chats)')}
+        for column in ('message_count', 'context_tokens', 'compactions', 'tokens_saved'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE tgbot_chats ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+        
+        # Локальная копия истории потоков ассистента, только дописывается
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS thread_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT NOT NULL,
-            user_nickname TEXT,
-            message_text TEXT,
-            message_time TEXT
+            thread_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            created_at REAL NOT NULL
         )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_thread_messages_thread ON thread_messages (thread_id, id)')
         
         conn.commit()
     
+    # Контекстный менеджер sqlite3 только коммитит, соединение нужно закрыть явно
+    conn.close()
+    
+    # Логи переписки хранятся в отдельной базе; логи прежних версий переносятся туда из основной
+    if init_log_store(log_db_path, legacy_db_path=db_path):
+        # Место, которое занимали логи, возвращается системе один раз после переноса
+        with sqlite3.connect(db_path) as conn:
+            conn.execute('VACUUM')
+        conn.close()
+    
     logger.info("База данных SQLite успешно инициализирована")
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+import os
+import asyncio
+from contextlib import suppress
+import dotenv
+from loguru import logger
+from app.db_wrappers.state import create_logs
+from app.db_wrappers.logstore import to_timestamp
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Максимальное количество логов, ожидающих записи; при переполнении новые логи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Размер пачки, при достижении которого логи записываются сразу
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+# Максимальное время в секундах, которое лог ждет записи
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '1.0'))
+
+class LogWriter:
+    """Отложенная запись логов переписки пачками в фоновой задаче."""
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._batch = []
+        self._task = None
+        # Пачка, которая пишется сейчас: запись не прерывается отменой задачи
+        self._writing = None
+
+    def push(self, chat_id: str, user_nickname: str, message_text: str, message_time):
+        """Ставит лог в очередь на запись. Никогда не ждет и не бросает исключений."""
+        try:
+            # Время хранится целым числом секунд Unix
+            self._queue.put_nowait((chat_id, user_nickname, message_text, to_timestamp(message_time)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Очередь логов переполнена, лог отброшен (всего отброшено: {self.dropped})")
+
+    def start(self):
+        """Запускает фоновую задачу записи."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.debug("Фоновая запись логов запущена")
+
+    async def stop(self):
+        """Останавливает фоновую задачу и дописывает все накопленные логи."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # Пачку, которую задача начала писать до отмены, дожидаемся, а не бросаем
+        if self._writing is not None:
+            await self._writing
+
+        while not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+        await self._flush()
+        logger.debug("Фоновая запись логов остановлена")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Ждем первый лог, затем добираем пачку до размера или до истечения интервала
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                # asyncio.timeout, а не wait_for: в Python 3.11 wait_for теряет отмену, пришедшую
+                # одновременно с логом, и остановка записи зависает
+                try:
+                    async with asyncio.timeout(timeout):
+                        self._batch.append(await self._queue.get())
+                except TimeoutError:
+                    break
+            await self._flush()
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        # Запись не прерывается при остановке задачи, иначе пачка потеряется; stop() ее дожидается
+        self._writing = asyncio.ensure_future(self._write(batch))
+        await asyncio.shield(self._writing)
+
+    async def _write(self, batch: list):
+        try:
+            await create_logs(batch)
+        except Exception as e:
+            logger.error(f"Ошибка при записи пачки логов ({len(batch)} шт.): {e}")
+
+# Общий экземпляр для всего приложения
+log_writer = LogWriter()
+
+def enqueue_log(chat_id: str, user_nickname: str, message_text: str, message_time):
+    """Ставит лог переписки в очередь на запись в tgbot_logs. Время - datetime, строка ISO или секунды Unix."""
+    log_writer.push(chat_id, user_nickname, message_text, message_time)
+
+def start_log_writer():
+    """Запускает фоновую запись логов."""
+    log_writer.start()
+
+async def stop_log_writer():
+    """Останавливает фоновую запись и дописывает очередь."""
+    await log_writer.stop()
@@ -0,0 +1,394 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Set
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Логи переписки лежат в отдельной базе, чтобы их рост и обслуживание не мешали поиску потоков чатов.
+# Это хранилище логов для STATE_BACKEND=sqlite. С PocketBase логи пишутся в PocketBase и читаются
+# через state.get_chat_logs/get_period_stats, а помесячный архив ниже касается только этой базы
+LOG_DB_PATH = os.getenv('LOG_DB_PATH', 'data/tgbot_logs.db')
+# Куда складывать сжатые помесячные архивы логов
+LOG_ARCHIVE_DIR = os.getenv('LOG_ARCHIVE_DIR', 'data/log_archive')
+# Сколько дней логи хранятся в базе; месяцы, целиком старше этого срока, уходят в архив
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))
+# Как часто архивировать старые логи и обслуживать базы, в секундах
+LOG_MAINTENANCE_INTERVAL = float(os.getenv('LOG_MAINTENANCE_INTERVAL', '3600'))
+# Первое обслуживание откладывается, чтобы не мешать запуску бота
+LOG_MAINTENANCE_DELAY = 60.0
+
+# Архив и освобождение места идут небольшими порциями, между ними успевают записаться новые логи
+ARCHIVE_CHUNK = 5000
+VACUUM_PAGES = 1000
+
+# Длина периода для статистики по времени, в секундах; месяцы считаются по календарю
+PERIODS = {'hour': 3600, 'day': 86400}
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+)
+
+# auto_vacuum действует, только если задан до создания первой таблицы
+SCHEMA = (
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    '''
+    CREATE TABLE IF NOT EXISTS tgbot_logs (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        user_nickname TEXT,
+        message_text TEXT,
+        created_at INTEGER NOT NULL
+    )
+    ''',
+    # Логи чата за период и статистика по периодам читаются только по индексам
+    'CREATE INDEX IF NOT EXISTS idx_tgbot_logs_chat ON tgbot_logs (chat_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_tgbot_logs_created ON tgbot_logs (created_at, chat_id)',
+)
+
+LOG_COLUMNS = ('id', 'chat_id', 'user_nickname', 'message_text', 'created_at')
+
+SQL_CREATE_LOG = 'INSERT INTO tgbot_logs (chat_id, user_nickname, message_text, created_at) VALUES (?, ?, ?, ?)'
+SQL_GET_CHAT_LOGS = (
+    'SELECT id, chat_id, user_nickname, message_text, created_at FROM tgbot_logs '
+    'WHERE chat_id = ? AND created_at >= ? AND created_at < ? ORDER BY created_at DESC, id DESC LIMIT ?'
+)
+SQL_PERIOD_STATS = (
+    'SELECT created_at - created_at % ? AS period, COUNT(*), COUNT(DISTINCT chat_id) FROM tgbot_logs '
+    'WHERE created_at >= ? AND created_at < ? GROUP BY period ORDER BY period'
+)
+SQL_MONTH_STATS = (
+    "SELECT strftime('%Y-%m', created_at, 'unixepoch') AS period, COUNT(*), COUNT(DISTINCT chat_id) FROM tgbot_logs "
+    'WHERE created_at >= ? AND created_at < ? GROUP BY period ORDER BY period'
+)
+SQL_OLDEST_LOG = 'SELECT MIN(created_at) FROM tgbot_logs'
+SQL_ARCHIVE_CHUNK = (
+    'SELECT id, chat_id, user_nickname, message_text, created_at FROM tgbot_logs '
+    'WHERE created_at >= ? AND created_at < ? ORDER BY created_at LIMIT ?'
+)
+SQL_DELETE_LOG = 'DELETE FROM tgbot_logs WHERE id = ?'
+# Логи из основной базы прежних версий; время было текстом ISO
+SQL_MIGRATE_LEGACY = (
+    'INSERT INTO main.tgbot_logs (chat_id, user_nickname, message_text, created_at) '
+    "SELECT chat_id, user_nickname, message_text, COALESCE(CAST(strftime('%s', message_time) AS INTEGER), 0) "
+    'FROM legacy.tgbot_logs ORDER BY id'
+)
+
+# Все обращения к базе логов идут в своем потоке, отдельно от потока основной базы
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='logstore')
+_connection: Optional[sqlite3.Connection] = None
+
+def to_timestamp(value=None) -> int:
+    """Время сообщения в секундах Unix: из datetime, строки ISO или числа; без значения - текущее."""
+    if value is None:
+        return int(time.time())
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+def period_of(created_at: int, period: str):
+    """Период, к которому относится время для get_period_stats: начало часа или дня в секундах, месяц - "YYYY-MM"."""
+    if period == 'month':
+        return datetime.fromtimestamp(created_at, timezone.utc).strftime('%Y-%m')
+    if period not in PERIODS:
+        raise ValueError(f"Неизвестный период: {period}")
+    return created_at - created_at % PERIODS[period]
+
+def _month_start(timestamp: int) -> int:
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return int(datetime(moment.year, moment.month, 1, tzinfo=timezone.utc).timestamp())
+
+def _next_month(month_start: int) -> int:
+    moment = datetime.fromtimestamp(month_start, timezone.utc)
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+def archive_path(month_start: int) -> str:
+    """Файл архива месяца: data/log_archive/tgbot_logs-2024-01.jsonl.gz."""
+    month = datetime.fromtimestamp(month_start, timezone.utc).strftime('%Y-%m')
+    return os.path.join(LOG_ARCHIVE_DIR, f"tgbot_logs-{month}.jsonl.gz")
+
+def init_log_store(db_path: Optional[str] = None, legacy_db_path: Optional[str] = None) -> int:
+    """Создает базу логов и переносит в нее логи из основной базы прежних версий.
+
+    Возвращает количество перенесенных логов.
+    """
+    db_path = db_path or LOG_DB_PATH
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute('PRAGMA journal_mode=WAL')
+
+        migrated = 0
+        if legacy_db_path and os.path.exists(legacy_db_path):
+            conn.execute('ATTACH DATABASE ? AS legacy', (legacy_db_path,))
+            legacy = conn.execute(
+                "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = 'tgbot_logs'"
+            ).fetchone()
+            if legacy:
+                # Перенос и удаление прежней таблицы - одна транзакция: логи не теряются и не дублируются
+                conn.execute('BEGIN')
+                try:
+                    migrated = conn.execute(SQL_MIGRATE_LEGACY).rowcount
+                    conn.execute('DROP TABLE legacy.tgbot_logs')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                conn.execute('COMMIT')
+                logger.info(f"Логи перенесены из {legacy_db_path} в {db_path}: {migrated} шт.")
+            conn.execute('DETACH DATABASE legacy')
+    finally:
+        conn.close()
+    return migrated
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает долгоживущее соединение с базой логов, создавая его при первом обращении."""
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(LOG_DB_PATH, check_same_thread=False, isolation_level=None)
+        for pragma in PRAGMAS:
+            _connection.execute(pragma)
+        logger.debug(f"Открыто соединение с базой логов: {LOG_DB_PATH}")
+    return _connection
+
+async def run_in_log_db(func, *args):
+    """Выполняет функцию в потоке базы логов, не блокируя цикл событий."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+def _close():
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+async def close_log_store():
+    """Закрывает соединение с базой логов после выполнения всех поставленных в очередь операций."""
+    await run_in_log_db(_close)
+    logger.debug("Соединение с базой логов закрыто")
+
+def _write_logs(rows: List[tuple]):
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        conn.executemany(SQL_CREATE_LOG, rows)
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _get_chat_logs(chat_id: str, since: int, until: int, limit: int) -> List[tuple]:
+    return get_connection().execute(SQL_GET_CHAT_LOGS, (chat_id, since, until, limit)).fetchall()
+
+def _period_stats(period: str, since: int, until: int) -> List[tuple]:
+    if period == 'month':
+        return get_connection().execute(SQL_MONTH_STATS, (since, until)).fetchall()
+    return get_connection().execute(SQL_PERIOD_STATS, (PERIODS[period], since, until)).fetchall()
+
+async def write_logs(rows: List[tuple]):
+    """Записывает пачку логов одной транзакцией.
+
+    Каждая строка: (chat_id, user_nickname, message_text, created_at), created_at - секунды Unix.
+    """
+    await run_in_log_db(_write_logs, rows)
+
+async def get_chat_logs(chat_id: str, since: Optional[int] = None, until: Optional[int] = None,
+                        limit: int = 100) -> List[dict]:
+    """Последние limit логов чата за период [since, until) в хронологическом порядке."""
+    rows = await run_in_log_db(
+        _get_chat_logs, str(chat_id), since or 0, until if until is not None else 2 ** 62, limit
+    )
+    return [dict(zip(LOG_COLUMNS, row)) for row in reversed(rows)]
+
+async def get_period_stats(since: Optional[int] = None, until: Optional[int] = None,
+                           period: str = 'day') -> List[dict]:
+    """Количество логов и чатов по периодам (hour, day или month, по UTC) за [since, until)."""
+    if period != 'month' and period not in PERIODS:
+        raise ValueError(f"Неизвестный период: {period}")
+    rows = await run_in_log_db(_period_stats, period, since or 0, until if until is not None else 2 ** 62)
+    return [{'period': row[0], 'messages': row[1], 'chats': row[2]} for row in rows]
+
+def read_archive(since: Optional[int] = None, until: Optional[int] = None,
+                 chat_id: Optional[str] = None) -> Iterator[dict]:
+    """Читает логи из помесячных архивов за [since, until), при необходимости только одного чата.
+
+    Логи за последние LOG_RETENTION_DAYS дней лежат в базе, их возвращают get_chat_logs и get_period_stats.
+    """
+    if not os.path.isdir(LOG_ARCHIVE_DIR):
+        return
+    since = since or 0
+    until = until if until is not None else 2 ** 62
+    for name in sorted(os.listdir(LOG_ARCHIVE_DIR)):
+        if not (name.startswith('tgbot_logs-') and name.endswith('.jsonl.gz')):
+            continue
+        month_start = int(datetime.strptime(name[len('tgbot_logs-'):-len('.jsonl.gz')], '%Y-%m')
+                          .replace(tzinfo=timezone.utc).timestamp())
+        if _next_month(month_start) <= since or month_start >= until:
+            continue
+        for log in _read_archive_file(os.path.join(LOG_ARCHIVE_DIR, name)):
+            if since <= log['created_at'] < until and (chat_id is None or log['chat_id'] == str(chat_id)):
+                yield log
+
+def _read_archive_file(path: str) -> Iterator[dict]:
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile) as e:
+        # Оборванная при сбое последняя порция: все полные порции до нее уже прочитаны
+        logger.warning(f"Архив логов {path} поврежден в конце: {e}")
+
+def _append_archive(path: str, rows: List[tuple]):
+    # Каждая порция - отдельный член gzip, файл дописывается без перечитывания
+    data = ''.join(json.dumps(dict(zip(LOG_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab') as file:
+        file.write(gzip.compress(data.encode('utf-8')))
+        file.flush()
+        os.fsync(file.fileno())
+
+def _archived_ids(path: str) -> Set[int]:
+    if not os.path.exists(path):
+        return set()
+    return {log['id'] for log in _read_archive_file(path)}
+
+def _oldest_log() -> Optional[int]:
+    return get_connection().execute(SQL_OLDEST_LOG).fetchone()[0]
+
+def _archive_chunk(since: int, until: int, limit: int) -> List[tuple]:
+    return get_connection().execute(SQL_ARCHIVE_CHUNK, (since, until, limit)).fetchall()
+
+def _delete_logs(ids: List[int]):
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        conn.executemany(SQL_DELETE_LOG, [(log_id,) for log_id in ids])
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _incremental_vacuum(pages: int) -> int:
+    conn = get_connection()
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+def _checkpoint() -> tuple:
+    conn = get_connection()
+    conn.execute('PRAGMA optimize')
+    return conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+
+class LogMaintenance:
+    """Фоновое обслуживание логов: переносит старые месяцы в сжатые архивы и освобождает место.
+
+    Все работы идут короткими порциями в потоке базы логов, поэтому запись новых логов не ждет
+    окончания архивации. Архивирует только локальную базу логов (STATE_BACKEND=sqlite).
+    """
+
+    def __init__(self, retention_days: int = LOG_RETENTION_DAYS, interval: float = LOG_MAINTENANCE_INTERVAL):
+        self.retention_days = retention_days
+        self.interval = interval
+        self.archived = 0
+        self.runs = 0
+        self.last_run = 0.0
+        self._task = None
+
+    def start(self):
+        """Запускает фоновое обслуживание."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновое обслуживание."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(LOG_MAINTENANCE_DELAY)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания логов: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[float] = None):
+        """Архивирует месяцы старше срока хранения, освобождает место и сбрасывает журнал WAL."""
+        started = time.monotonic()
+        # В базе остается месяц, в который попадает граница срока хранения, и все последующие
+        cutoff = _month_start(int((now or time.time()) - self.retention_days * 86400))
+        archived = 0
+        oldest = await run_in_log_db(_oldest_log)
+        while oldest is not None and oldest < cutoff:
+            month_start = _month_start(oldest)
+            archived += await self.archive_month(month_start)
+            oldest = await run_in_log_db(_oldest_log)
+
+        if archived:
+            # Свободные страницы отдаются порциями; если база создана без auto_vacuum, число не уменьшается
+            free = await run_in_log_db(_incremental_vacuum, VACUUM_PAGES)
+            while free:
+                previous, free = free, await run_in_log_db(_incremental_vacuum, VACUUM_PAGES)
+                if free >= previous:
+                    break
+        busy, wal_pages, _ = await run_in_log_db(_checkpoint)
+        # Журнал основной базы тоже сбрасываем, не дожидаясь читателей
+        from app.db_wrappers.sqlitedb import checkpoint
+        try:
+            await checkpoint()
+        except Exception as e:
+            logger.warning(f"Не удалось сбросить журнал основной базы: {e}")
+
+        self.archived += archived
+        self.runs += 1
+        self.last_run = time.time()
+        logger.info(f"Обслуживание логов за {time.monotonic() - started:.2f} с: в архив {archived} шт., "
+                    f"страниц журнала {wal_pages}{', база занята' if busy else ''}")
+
+    async def archive_month(self, month_start: int) -> int:
+        """Переносит логи месяца в сжатый архив порциями. Возвращает количество перенесенных логов."""
+        path = archive_path(month_start)
+        until = _next_month(month_start)
+        # Логи, записанные в архив перед сбоем, но не удаленные из базы, второй раз не пишутся
+        done = await asyncio.to_thread(_archived_ids, path)
+        archived = 0
+        while True:
+            rows = await run_in_log_db(_archive_chunk, month_start, until, ARCHIVE_CHUNK)
+            if not rows:
+                break
+            fresh = [row for row in rows if row[0] not in done]
+            if fresh:
+                await asyncio.to_thread(_append_archive, path, fresh)
+            await run_in_log_db(_delete_logs, [row[0] for row in rows])
+            archived += len(fresh)
+        logger.info(f"Логи за {os.path.basename(path)[len('tgbot_logs-'):-len('.jsonl.gz')]} перенесены в архив: {archived} шт.")
+        return archived
+
+    def stats(self) -> dict:
+        """Возвращает количество перенесенных в архив логов и выполненных обслуживаний."""
+        return {
+            'archived': self.archived,
+            'runs': self.runs,
+            'last_run': self.last_run,
+        }
+
+# Общий экземпляр для всего приложения
+log_maintenance = LogMaintenance()
@@ -0,0 +1,444 @@
+from loguru import logger
+import os
+import asyncio
+import json
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+import dotenv
+from pocketbase import PocketBase
+from pocketbase.utils import ClientResponseError
+from app.cache import LRUCache
+from app.db_wrappers.logstore import PERIODS, to_timestamp, period_of
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Адрес PocketBase и учетная запись администратора
+POCKETBASE_URL = os.getenv('POCKETBASE_URL', 'http://127.0.0.1:8090')
+POCKETBASE_EMAIL = os.getenv('POCKETBASE_EMAIL')
+POCKETBASE_PASSWORD = os.getenv('POCKETBASE_PASSWORD')
+# Реплики меняют поток чата независимо, поэтому кэш chat_id -> thread_id живет недолго
+THREAD_CACHE_SIZE = int(os.getenv('THREAD_CACHE_SIZE', '10000'))
+THREAD_CACHE_TTL = float(os.getenv('STATE_THREAD_CACHE_TTL', '30'))
+# Сколько записей отправлять одним пакетным запросом /api/batch (PocketBase 0.23+, пакетные запросы
+# включаются в настройках сервера; по умолчанию сервер принимает до 50 запросов в пакете)
+POCKETBASE_BATCH_SIZE = int(os.getenv('POCKETBASE_BATCH_SIZE', '50'))
+# Сколько записей читать одним запросом при выборке логов для статистики и устаревших ответов
+LOG_PAGE_SIZE = 500
+
+# Коллекции повторяют таблицы SQLite:
+# tgbot_chats: chat_id (text, уникальный индекс), thread_id (text),
+#              message_count, context_tokens, compactions, tokens_saved (number)
+# tgbot_logs: chat_id, user_nickname, message_text, message_time (text),
+#             created_at (number, секунды Unix; по нему строятся выборки за период)
+# tgbot_thread_messages: thread_id, role, content (text), tokens, created_at (number)
+# tgbot_answer_cache: cache_key (text, уникальный индекс), answer, fingerprint (text), created_at, duration (number)
+# Логи остаются в PocketBase: помесячный архив logstore.py их не касается, срок их хранения
+# настраивается в самом PocketBase
+CHATS = 'tgbot_chats'
+LOGS = 'tgbot_logs'
+THREAD_MESSAGES = 'tgbot_thread_messages'
+ANSWERS = 'tgbot_answer_cache'
+
+_client: Optional[PocketBase] = None
+# Доступны ли пакетные запросы; на сервере без них записи создаются по одной
+_batch_available = True
+# Размер пакета, который принял сервер; уменьшается, если сервер отклоняет пакет настроенного размера
+_batch_size = POCKETBASE_BATCH_SIZE
+_thread_cache = LRUCache(THREAD_CACHE_SIZE, THREAD_CACHE_TTL)
+
+def get_client() -> PocketBase:
+    """Возвращает клиент PocketBase, авторизуясь при первом обращении."""
+    global _client
+    if _client is None:
+        client = PocketBase(POCKETBASE_URL, timeout=10)
+        if POCKETBASE_EMAIL:
+            client.admins.auth_with_password(POCKETBASE_EMAIL, POCKETBASE_PASSWORD)
+        _client = client
+        logger.debug(f"Подключение к PocketBase: {POCKETBASE_URL}")
+    return _client
+
+async def run_in_db(func, *args):
+    """Выполняет синхронный вызов клиента PocketBase в потоке, не блокируя цикл событий."""
+    return await asyncio.to_thread(func, *args)
+
+async def close_db():
+    """Закрывает HTTP-соединения клиента."""
+    global _client
+    if _client is not None:
+        await run_in_db(_client.http_client.close)
+        _client = None
+
+def _quote(value: str) -> str:
+    # json.dumps дает строку в кавычках с экранированием, подходящую для фильтра PocketBase;
+    # кириллицу оставляем как есть, последовательности \uXXXX фильтр не разбирает
+    return json.dumps(str(value), ensure_ascii=False)
+
+def _chat_filter(chat_id: str) -> str:
+    return f"chat_id = {_quote(chat_id)}"
+
+def _find_chat(chat_id: str):
+    try:
+        # SDK дополняет query_params на месте, поэтому каждому вызову нужен свой словарь
+        return get_client().collection(CHATS).get_first_list_item(_chat_filter(chat_id), query_params={})
+    except ClientResponseError as e:
+        if e.status == 404:
+            return None
+        raise
+
+def _get_all_chats() -> List[str]:
+    records = get_client().collection(CHATS).get_full_list(query_params={'fields': 'chat_id'})
+    return [record.chat_id for record in records]
+
+def _chat_exists(chat_id: str) -> bool:
+    return _find_chat(chat_id) is not None
+
+def _get_thread_id(chat_id: str) -> Optional[str]:
+    record = _find_chat(chat_id)
+    return (record.thread_id or None) if record else None
+
+def _set_thread_id(chat_id: str, thread_id: str):
+    record = _find_chat(chat_id)
+    if record is not None:
+        get_client().collection(CHATS).update(
+            record.id, {'thread_id': thread_id, 'message_count': 0, 'context_tokens': 0}
+        )
+
+def _create_chat_and_thread(chat_id: str, thread_id: str):
+    get_client().collection(CHATS).create({'chat_id': str(chat_id), 'thread_id': thread_id})
+
+def _save_thread_id(chat_id: str, thread_id: str):
+    record = _find_chat(chat_id)
+    if record is None:
+        try:
+            _create_chat_and_thread(chat_id, thread_id)
+            return
+        except ClientResponseError as e:
+            # Чат успела создать другая реплика
+            if e.status != 400:
+                raise
+            record = _find_chat(chat_id)
+    get_client().collection(CHATS).update(
+        record.id, {'thread_id': thread_id, 'message_count': 0, 'context_tokens': 0}
+    )
+
+def _insert_thread_if_absent(chat_id: str, thread_id: str) -> str:
+    record = _find_chat(chat_id)
+    if record is None:
+        try:
+            _create_chat_and_thread(chat_id, thread_id)
+            return thread_id
+        except ClientResponseError as e:
+            # Уникальный индекс по chat_id: при гонке реплик побеждает первая запись
+            if e.status != 400:
+                raise
+            record = _find_chat(chat_id)
+    if not record.thread_id:
+        get_client().collection(CHATS).update(record.id, {'thread_id': thread_id})
+        return thread_id
+    return record.thread_id
+
+def _add_context_usage(chat_id: str, thread_id: str, messages: int, tokens: int) -> Optional[tuple]:
+    record = _find_chat(chat_id)
+    if record is None or record.thread_id != thread_id:
+        return None
+    # Модификатор "+" увеличивает значение на сервере, параллельные приращения не теряются
+    record = get_client().collection(CHATS).update(
+        record.id, {'message_count+': messages, 'context_tokens+': tokens}
+    )
+    return record.message_count, record.context_tokens
+
+def _swap_thread_id(chat_id: str, old_thread_id: str, new_thread_id: str,
+                    message_count: int, context_tokens: int, tokens_saved: int) -> bool:
+    record = _find_chat(chat_id)
+    if record is None or record.thread_id != old_thread_id:
+        return False
+    get_client().collection(CHATS).update(record.id, {
+        'thread_id': new_thread_id,
+        'message_count': message_count,
+        'context_tokens': context_tokens,
+        'compactions+': 1,
+        'tokens_saved+': tokens_saved,
+    })
+    return True
+
+def _get_chat_stats(chat_id: str) -> Optional[dict]:
+    record = _find_chat(chat_id)
+    if record is None:
+        return None
+    keys = ('thread_id', 'message_count', 'context_tokens', 'compactions', 'tokens_saved')
+    return {key: getattr(record, key, 0) for key in keys}
+
+def _log_record(chat_id: str, user_nickname: str, message_text: str, created_at: int) -> dict:
+    return {
+        'chat_id': str(chat_id),
+        'user_nickname': user_nickname,
+        'message_text': message_text,
+        'message_time': datetime.fromtimestamp(created_at, timezone.utc).isoformat(),
+        'created_at': created_at,
+    }
+
+def _create_log(chat_id: str, user_nickname: str, message_text: str, created_at: int):
+    get_client().collection(LOGS).create(_log_record(chat_id, user_nickname, message_text, created_at))
+
+def _send_batch(collection: str, records: List[dict]):
+    requests = [
+        {'method': 'POST', 'url': f'/api/collections/{collection}/records', 'body': record}
+        for record in records
+    ]
+    get_client().send('/api/batch', {'method': 'POST', 'body': {'requests': requests}})
+
+def _create_records(collection: str, records: List[dict]):
+    global _batch_available, _batch_size
+    start = 0
+    size = _batch_size
+    while _batch_available and start < len(records):
+        chunk = records[start:start + size]
+        try:
+            # Пакет записывается одной транзакцией: при ошибке в нем не сохраняется ни одна запись
+            _send_batch(collection, chunk)
+        except ClientResponseError as e:
+            if e.status in (403, 404):
+                # 404 - PocketBase старше 0.23, 403 - пакетные запросы выключены в настройках
+                _batch_available = False
+                logger.warning("Пакетные запросы PocketBase недоступны, записи создаются по одной")
+                break
+            if e.status == 400 and len(chunk) > 1:
+                # Сервер может ограничивать размер пакета сильнее настройки: повторяем пакетом вдвое меньше
+                size = max(1, len(chunk) // 2)
+                continue
+            # Обрыв соединения, ошибка сервера или прокси, не знающий /api/batch: пакет не записан целиком
+            logger.warning(f"Пакетный запрос PocketBase не выполнен ({e.status}), записи создаются по одной")
+            break
+        start += len(chunk)
+        if size < _batch_size:
+            _batch_size = size
+            logger.warning(f"Размер пакета PocketBase уменьшен до {size}")
+    # Оставшиеся записи идут подряд в одном потоке по одному соединению
+    for record in records[start:]:
+        try:
+            get_client().collection(collection).create(record)
+        except ClientResponseError as e:
+            # Запись, которую сервер не принимает, не должна лишать записи остальные
+            if e.status != 400:
+                raise
+            logger.error(f"Запись в {collection} отклонена PocketBase: {e}")
+
+def _create_logs(rows: List[tuple]):
+    _create_records(LOGS, [_log_record(*row) for row in rows])
+
+def _answer_filter(cache_key: str) -> str:
+    return f"cache_key = {_quote(cache_key)}"
+
+def _find_answer(cache_key: str):
+    try:
+        return get_client().collection(ANSWERS).get_first_list_item(_answer_filter(cache_key), query_params={})
+    except ClientResponseError as e:
+        if e.status == 404:
+            return None
+        raise
+
+def _get_cached_answer(cache_key: str, fingerprint: str, min_created_at: float) -> Optional[tuple]:
+    record = _find_answer(cache_key)
+    if record is None or record.fingerprint != fingerprint or record.created_at < min_created_at:
+        return None
+    return record.answer, record.duration
+
+def _save_cached_answer(cache_key: str, answer: str, fingerprint: str, created_at: float, duration: float):
+    data = {'cache_key': cache_key, 'answer': answer, 'fingerprint': fingerprint,
+            'created_at': created_at, 'duration': duration}
+    record = _find_answer(cache_key)
+    if record is None:
+        try:
+            get_client().collection(ANSWERS).create(data)
+            return
+        except ClientResponseError as e:
+            # Ответ на тот же вопрос успела сохранить другая реплика
+            if e.status != 400:
+                raise
+            record = _find_answer(cache_key)
+    get_client().collection(ANSWERS).update(record.id, data)
+
+def _delete_stale_answers(fingerprint: str, min_created_at: float) -> int:
+    records = get_client().collection(ANSWERS).get_full_list(batch=LOG_PAGE_SIZE, query_params={
+        'filter': f"fingerprint != {_quote(fingerprint)} || created_at < {float(min_created_at)}",
+        'fields': 'id',
+    })
+    for record in records:
+        get_client().collection(ANSWERS).delete(record.id)
+    return len(records)
+
+def _add_thread_messages(rows: List[tuple]):
+    # Порядок сообщений задает created_at, а строки одной пачки приходят с одинаковым временем
+    _create_records(THREAD_MESSAGES, [
+        {'thread_id': thread_id, 'role': role, 'content': content, 'tokens': tokens,
+         'created_at': created_at + index * 1e-6}
+        for index, (thread_id, role, content, tokens, created_at) in enumerate(rows)
+    ])
+
+def _get_thread_messages(thread_id: str, limit: int) -> List[tuple]:
+    result = get_client().collection(THREAD_MESSAGES).get_list(1, limit, query_params={
+        'filter': f"thread_id = {_quote(thread_id)}",
+        'sort': '-created_at',
+        'fields': 'role,content,tokens',
+    })
+    return [(record.role, record.content, int(record.tokens)) for record in reversed(result.items)]
+
+def _range_filter(since: int, until: int) -> str:
+    return f"created_at >= {int(since)} && created_at < {int(until)}"
+
+def _get_chat_logs(chat_id: str, since: int, until: int, limit: int) -> List[dict]:
+    result = get_client().collection(LOGS).get_list(1, limit, query_params={
+        'filter': f"{_chat_filter(chat_id)} && {_range_filter(since, until)}",
+        'sort': '-created_at',
+    })
+    return [
+        {'id': record.id, 'chat_id': record.chat_id, 'user_nickname': record.user_nickname,
+         'message_text': record.message_text, 'created_at': int(record.created_at)}
+        for record in reversed(result.items)
+    ]
+
+def _period_stats(period: str, since: int, until: int) -> List[dict]:
+    # В PocketBase нет группировки, поэтому читаем только время и чат и считаем здесь
+    records = get_client().collection(LOGS).get_full_list(batch=LOG_PAGE_SIZE, query_params={
+        'filter': _range_filter(since, until),
+        'fields': 'chat_id,created_at',
+    })
+    periods = {}
+    for record in records:
+        counts = periods.setdefault(period_of(int(record.created_at), period), [0, set()])
+        counts[0] += 1
+        counts[1].add(record.chat_id)
+    return [{'period': key, 'messages': messages, 'chats': len(chats)}
+            for key, (messages, chats) in sorted(periods.items())]
+
+async def get_all_chats() -> List[str]:
+    """Получает все chat_id из PocketBase."""
+    logger.debug("Получение всех чатов из PocketBase")
+    chat_ids = await run_in_db(_get_all_chats)
+    logger.debug(f"Получено чатов: {len(chat_ids)}")
+    return chat_ids
+
+async def chat_exists(chat_id: str) -> bool:
+    """Проверяет существование чата по chat_id."""
+    logger.debug(f"Проверка существования чата с ID: {chat_id}")
+    return await run_in_db(_chat_exists, chat_id)
+
+async def get_thread_id(chat_id: str) -> Optional[str]:
+    """Получает thread_id для указанного chat_id."""
+    thread_id = _thread_cache.get(str(chat_id))
+    if thread_id is not None:
+        return thread_id
+    logger.debug(f"Получение thread_id для чата с ID: {chat_id}")
+    thread_id = await run_in_db(_get_thread_id, chat_id)
+    if thread_id is not None:
+        _thread_cache.set(str(chat_id), thread_id)
+    return thread_id
+
+async def set_thread_id(chat_id: str, thread_id: str):
+    """Устанавливает thread_id для указанного chat_id."""
+    logger.debug(f"Установка thread_id для чата с ID: {chat_id}")
+    await run_in_db(_set_thread_id, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
+
+async def create_chat_and_thread(chat_id: str, thread_id: str):
+    """Создает новый чат с указанным chat_id и thread_id."""
+    logger.debug(f"Создание чата и thread_id для чата с ID: {chat_id}")
+    await run_in_db(_create_chat_and_thread, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
+
+async def save_thread_id(chat_id: str, thread_id: str):
+    """Создает чат или обновляет его thread_id."""
+    logger.debug(f"Сохранение thread_id для чата с ID: {chat_id}")
+    await run_in_db(_save_thread_id, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
+
+async def get_or_create_thread_id(chat_id: str, create_thread: Callable[[], Awaitable[str]],
+                                  discard_thread: Optional[Callable[[str], None]] = None) -> str:
+    """Возвращает поток чата, создавая его при отсутствии.
+
+    Если поток одновременно создали несколько реплик, сохраняется первый, остальные получают его же,
+    а свои потоки передают в discard_thread, чтобы они не копились.
+    """
+    thread_id = await get_thread_id(chat_id)
+    if thread_id:
+        return thread_id
+    created = await create_thread()
+    thread_id = await run_in_db(_insert_thread_if_absent, chat_id, created)
+    if thread_id != created:
+        logger.debug(f"Поток для чата {chat_id} уже создан другой репликой, используется он")
+        if discard_thread is not None:
+            discard_thread(created)
+    _thread_cache.set(str(chat_id), thread_id)
+    return thread_id
+
+async def add_context_usage(chat_id: str, thread_id: str, messages: int, tokens: int) -> Optional[tuple]:
+    """Увеличивает счетчики сообщений и токенов потока чата. Возвращает новые значения или None."""
+    return await run_in_db(_add_context_usage, chat_id, thread_id, messages, tokens)
+
+async def swap_thread_id(chat_id: str, old_thread_id: str, new_thread_id: str,
+                         message_count: int, context_tokens: int, tokens_saved: int) -> bool:
+    """Заменяет поток чата после сжатия, если за это время поток не сменили другим способом."""
+    logger.debug(f"Замена потока после сжатия для чата с ID: {chat_id}")
+    swapped = await run_in_db(
+        _swap_thread_id, chat_id, old_thread_id, new_thread_id, message_count, context_tokens, tokens_saved
+    )
+    if swapped:
+        _thread_cache.set(str(chat_id), new_thread_id)
+    return swapped
+
+async def get_chat_stats(chat_id: str) -> Optional[dict]:
+    """Возвращает счетчики контекста и статистику сжатий для чата."""
+    return await run_in_db(_get_chat_stats, chat_id)
+
+async def create_log(chat_id: str, user_nickname: str, message_text: str, message_time):
+    """Создает лог для указанного чата."""
+    logger.debug(f"Создание лога для чата с ID: {chat_id}")
+    await run_in_db(_create_log, chat_id, user_nickname, message_text, to_timestamp(message_time))
+
+async def create_logs(rows: List[tuple]):
+    """Создает пачку логов.
+
+    Каждая строка: (chat_id, user_nickname, message_text, created_at), created_at - секунды Unix.
+    """
+    logger.debug(f"Запись пачки логов: {len(rows)} шт.")
+    await run_in_db(_create_logs, rows)
+
+async def get_chat_logs(chat_id: str, since: Optional[int] = None, until: Optional[int] = None,
+                        limit: int = 100) -> List[dict]:
+    """Последние limit логов чата за период [since, until) в хронологическом порядке."""
+    return await run_in_db(
+        _get_chat_logs, str(chat_id), since or 0, until if until is not None else 2 ** 62, limit
+    )
+
+async def get_period_stats(since: Optional[int] = None, until: Optional[int] = None,
+                           period: str = 'day') -> List[dict]:
+    """Количество логов и чатов по периодам (hour, day или month, по UTC) за [since, until)."""
+    if period != 'month' and period not in PERIODS:
+        raise ValueError(f"Неизвестный период: {period}")
+    return await run_in_db(_period_stats, period, since or 0, until if until is not None else 2 ** 62)
+
+async def get_cached_answer(cache_key: str, fingerprint: str, min_created_at: float) -> Optional[tuple]:
+    """Получает сохраненный ответ и время его генерации, если он еще актуален."""
+    return await run_in_db(_get_cached_answer, cache_key, fingerprint, min_created_at)
+
+async def save_cached_answer(cache_key: str, answer: str, fingerprint: str, created_at: float, duration: float):
+    """Сохраняет ответ в общий кэш."""
+    await run_in_db(_save_cached_answer, cache_key, answer, fingerprint, created_at, duration)
+
+async def delete_stale_answers(fingerprint: str, min_created_at: float) -> int:
+    """Удаляет устаревшие ответы и ответы, построенные по старой базе знаний."""
+    deleted = await run_in_db(_delete_stale_answers, fingerprint, min_created_at)
+    logger.debug(f"Удалено устаревших ответов из кэша: {deleted}")
+    return deleted
+
+async def add_thread_messages(rows: List[tuple]):
+    """Дописывает сообщения в общую историю потоков.
+
+    Каждая строка: (thread_id, role, content, tokens, created_at).
+    """
+    await run_in_db(_add_thread_messages, rows)
+
+async def get_thread_messages(thread_id: str, limit: int) -> List[tuple]:
+    """Возвращает последние limit сообщений потока в хронологическом порядке: (role, content, tokens)."""
+    return await run_in_db(_get_thread_messages, thread_id, limit)
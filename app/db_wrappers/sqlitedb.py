@@ -1,69 +1,313 @@
 from loguru import logger
+import os
+import asyncio
 import sqlite3
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
+import dotenv
+from app.cache import LRUCache
+from app.db_wrappers import logstore
 
-logger.warning("Используется sqlitedb!")
+# Загрузка переменных окружения
+dotenv.load_dotenv()
 
 DB_PATH = 'data/tgbot.db'
+# Максимальное количество чатов в кэше chat_id -> thread_id
+THREAD_CACHE_SIZE = int(os.getenv('THREAD_CACHE_SIZE', '10000'))
 
-def dict_factory(cursor, row):
-    """Создает словарь из строки результата запроса."""
-    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не делает fsync на каждый коммит
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-8000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+# Тексты запросов неизменны, поэтому sqlite3 переиспользует их подготовленные выражения
+SQL_GET_ALL_CHATS = 'SELECT chat_id FROM tgbot_chats'
+SQL_CHAT_EXISTS = 'SELECT 1 FROM tgbot_chats WHERE chat_id = ?'
+SQL_GET_THREAD_ID = 'SELECT thread_id FROM tgbot_chats WHERE chat_id = ?'
+SQL_SET_THREAD_ID = (
+    'UPDATE tgbot_chats SET thread_id = ?, message_count = 0, context_tokens = 0 WHERE chat_id = ?'
+)
+SQL_CREATE_CHAT = 'INSERT INTO tgbot_chats (chat_id, thread_id) VALUES (?, ?)'
+SQL_UPSERT_THREAD_ID = (
+    'INSERT INTO tgbot_chats (chat_id, thread_id) VALUES (?, ?) '
+    'ON CONFLICT(chat_id) DO UPDATE SET thread_id = excluded.thread_id, message_count = 0, context_tokens = 0'
+)
+# Поток сохраняется, только если у чата его еще нет; возвращается тот, что в итоге записан
+SQL_INSERT_THREAD_IF_ABSENT = (
+    'INSERT INTO tgbot_chats (chat_id, thread_id) VALUES (?, ?) '
+    'ON CONFLICT(chat_id) DO UPDATE SET thread_id = COALESCE(tgbot_chats.thread_id, excluded.thread_id) '
+    'RETURNING thread_id'
+)
+SQL_ADD_CONTEXT_USAGE = (
+    'UPDATE tgbot_chats SET message_count = message_count + ?, context_tokens = context_tokens + ? '
+    'WHERE chat_id = ? AND thread_id = ? RETURNING message_count, context_tokens'
+)
+SQL_SWAP_THREAD_ID = (
+    'UPDATE tgbot_chats SET thread_id = ?, message_count = ?, context_tokens = ?, '
+    'compactions = compactions + 1, tokens_saved = tokens_saved + ? '
+    'WHERE chat_id = ? AND thread_id = ?'
+)
+SQL_GET_CHAT_STATS = (
+    'SELECT thread_id, message_count, context_tokens, compactions, tokens_saved '
+    'FROM tgbot_chats WHERE chat_id = ?'
+)
+SQL_GET_CACHED_ANSWER = (
+    'SELECT answer, duration FROM answer_cache '
+    'WHERE cache_key = ? AND fingerprint = ? AND created_at >= ?'
+)
+SQL_SAVE_CACHED_ANSWER = (
+    'INSERT OR REPLACE INTO answer_cache (cache_key, answer, fingerprint, created_at, duration) '
+    'VALUES (?, ?, ?, ?, ?)'
+)
+SQL_DELETE_STALE_ANSWERS = 'DELETE FROM answer_cache WHERE fingerprint != ? OR created_at < ?'
+SQL_ADD_THREAD_MESSAGE = (
+    'INSERT INTO thread_messages (thread_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)'
+)
+SQL_GET_THREAD_MESSAGES = (
+    'SELECT role, content, tokens FROM ('
+    'SELECT id, role, content, tokens FROM thread_messages WHERE thread_id = ? ORDER BY id DESC LIMIT ?'
+    ') ORDER BY id'
+)
+
+# Все обращения к базе выполняются в одном выделенном потоке с одним долгоживущим соединением
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlitedb')
+_connection: Optional[sqlite3.Connection] = None
+
+# Кэш chat_id -> thread_id: для вернувшегося чата поток находится без обращения к базе.
+# Все записи thread_id идут через этот модуль, поэтому кэш обновляется при записи
+_thread_cache = LRUCache(THREAD_CACHE_SIZE)
 
 def get_connection() -> sqlite3.Connection:
-    """Устанавливает соединение с базой данных SQLite."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = dict_factory
-    return conn
+    """Возвращает долгоживущее соединение с базой данных SQLite, создавая его при первом обращении."""
+    global _connection
+    if _connection is None:
+        # isolation_level=None - автокоммит, пакетные операции открывают транзакцию явно
+        _connection = sqlite3.connect(
+            DB_PATH,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        for pragma in PRAGMAS:
+            _connection.execute(pragma)
+        logger.debug(f"Открыто соединение с SQLite: {DB_PATH}")
+    return _connection
+
+async def run_in_db(func, *args):
+    """Выполняет функцию в потоке базы данных, не блокируя цикл событий."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+def _close():
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+async def close_db():
+    """Закрывает соединение после выполнения всех поставленных в очередь операций."""
+    await run_in_db(_close)
+    logger.debug("Соединение с SQLite закрыто")
+
+def _get_all_chats() -> List[str]:
+    return [row[0] for row in get_connection().execute(SQL_GET_ALL_CHATS)]
+
+def _chat_exists(chat_id: str) -> bool:
+    return get_connection().execute(SQL_CHAT_EXISTS, (chat_id,)).fetchone() is not None
+
+def _get_thread_id(chat_id: str) -> Optional[str]:
+    row = get_connection().execute(SQL_GET_THREAD_ID, (chat_id,)).fetchone()
+    return row[0] if row else None
+
+def _set_thread_id(chat_id: str, thread_id: str):
+    get_connection().execute(SQL_SET_THREAD_ID, (thread_id, chat_id))
+
+def _create_chat_and_thread(chat_id: str, thread_id: str):
+    get_connection().execute(SQL_CREATE_CHAT, (chat_id, thread_id))
+
+def _save_thread_id(chat_id: str, thread_id: str):
+    get_connection().execute(SQL_UPSERT_THREAD_ID, (chat_id, thread_id))
+
+def _insert_thread_if_absent(chat_id: str, thread_id: str) -> str:
+    return get_connection().execute(SQL_INSERT_THREAD_IF_ABSENT, (chat_id, thread_id)).fetchone()[0]
+
+def _add_context_usage(chat_id: str, thread_id: str, messages: int, tokens: int) -> Optional[tuple]:
+    return get_connection().execute(SQL_ADD_CONTEXT_USAGE, (messages, tokens, chat_id, thread_id)).fetchone()
+
+def _swap_thread_id(chat_id: str, old_thread_id: str, new_thread_id: str,
+                    message_count: int, context_tokens: int, tokens_saved: int) -> bool:
+    cursor = get_connection().execute(
+        SQL_SWAP_THREAD_ID,
+        (new_thread_id, message_count, context_tokens, tokens_saved, chat_id, old_thread_id)
+    )
+    return cursor.rowcount > 0
+
+def _get_chat_stats(chat_id: str) -> Optional[tuple]:
+    return get_connection().execute(SQL_GET_CHAT_STATS, (chat_id,)).fetchone()
+
+def _checkpoint() -> tuple:
+    # PASSIVE не ждет читателей и писателей: переносит в базу то, что можно перенести сейчас
+    return get_connection().execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+
+def _get_cached_answer(cache_key: str, fingerprint: str, min_created_at: float) -> Optional[tuple]:
+    return get_connection().execute(SQL_GET_CACHED_ANSWER, (cache_key, fingerprint, min_created_at)).fetchone()
+
+def _save_cached_answer(cache_key: str, answer: str, fingerprint: str, created_at: float, duration: float):
+    get_connection().execute(SQL_SAVE_CACHED_ANSWER, (cache_key, answer, fingerprint, created_at, duration))
+
+def _delete_stale_answers(fingerprint: str, min_created_at: float) -> int:
+    return get_connection().execute(SQL_DELETE_STALE_ANSWERS, (fingerprint, min_created_at)).rowcount
 
-def get_all_chats() -> List[str]:
+def _add_thread_messages(rows: List[tuple]):
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        conn.executemany(SQL_ADD_THREAD_MESSAGE, rows)
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _get_thread_messages(thread_id: str, limit: int) -> List[tuple]:
+    return get_connection().execute(SQL_GET_THREAD_MESSAGES, (thread_id, limit)).fetchall()
+
+async def get_all_chats() -> List[str]:
     """Получает все chat_id из базы данных."""
     logger.debug("Получение всех чатов из SQLite")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT chat_id FROM tgbot_chats')
-        chat_ids = [item['chat_id'] for item in cursor.fetchall()]
-    logger.debug(f"Полученные ID чатов: {chat_ids}")
+    chat_ids = await run_in_db(_get_all_chats)
+    logger.debug(f"Получено чатов: {len(chat_ids)}")
     return chat_ids
 
-def chat_exists(chat_id: str) -> bool:
+async def chat_exists(chat_id: str) -> bool:
     """Проверяет существование чата по chat_id."""
     logger.debug(f"Проверка существования чата с ID: {chat_id}")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1 FROM tgbot_chats WHERE chat_id = ?', (chat_id,))
-        exists = cursor.fetchone() is not None
-    return exists
+    return await run_in_db(_chat_exists, chat_id)
 
-def get_thread_id(chat_id: str) -> Optional[str]:
+async def get_thread_id(chat_id: str) -> Optional[str]:
     """Получает thread_id для указанного chat_id."""
+    thread_id = _thread_cache.get(str(chat_id))
+    if thread_id is not None:
+        return thread_id
     logger.debug(f"Получение thread_id для чата с ID: {chat_id}")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT thread_id FROM tgbot_chats WHERE chat_id = ?', (chat_id,))
-        result = cursor.fetchone()
-    return result['thread_id'] if result else None
+    thread_id = await run_in_db(_get_thread_id, chat_id)
+    if thread_id is not None:
+        _thread_cache.set(str(chat_id), thread_id)
+    return thread_id
 
-def set_thread_id(chat_id: str, thread_id: str):
+async def set_thread_id(chat_id: str, thread_id: str):
     """Устанавливает thread_id для указанного chat_id."""
     logger.debug(f"Установка thread_id для чата с ID: {chat_id}")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE tgbot_chats SET thread_id = ? WHERE chat_id = ?', (thread_id, chat_id))
+    await run_in_db(_set_thread_id, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
 
-def create_chat_and_thread(chat_id: str, thread_id: str):
+async def create_chat_and_thread(chat_id: str, thread_id: str):
     """Создает новый чат с указанным chat_id и thread_id."""
     logger.debug(f"Создание чата и thread_id для чата с ID: {chat_id}")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO tgbot_chats (chat_id, thread_id) VALUES (?, ?)', (chat_id, thread_id))
+    await run_in_db(_create_chat_and_thread, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
+
+async def save_thread_id(chat_id: str, thread_id: str):
+    """Создает чат или обновляет его thread_id одним запросом."""
+    logger.debug(f"Сохранение thread_id для чата с ID: {chat_id}")
+    await run_in_db(_save_thread_id, chat_id, thread_id)
+    _thread_cache.set(str(chat_id), thread_id)
+
+async def get_or_create_thread_id(chat_id: str, create_thread: Callable[[], Awaitable[str]],
+                                  discard_thread: Optional[Callable[[str], None]] = None) -> str:
+    """Возвращает поток чата, создавая его при отсутствии.
+
+    Если поток одновременно создали несколько обработчиков, сохраняется первый, остальные получают его же,
+    а свои потоки передают в discard_thread, чтобы они не копились.
+    """
+    thread_id = await get_thread_id(chat_id)
+    if thread_id:
+        return thread_id
+    created = await create_thread()
+    thread_id = await run_in_db(_insert_thread_if_absent, str(chat_id), created)
+    if thread_id != created:
+        logger.debug(f"Поток для чата {chat_id} уже создан, используется существующий")
+        if discard_thread is not None:
+            discard_thread(created)
+    _thread_cache.set(str(chat_id), thread_id)
+    return thread_id
 
-def create_log(chat_id: str, user_nickname: str, message_text: str, message_time: str):
+async def add_context_usage(chat_id: str, thread_id: str, messages: int, tokens: int) -> Optional[tuple]:
+    """Увеличивает счетчики сообщений и токенов потока чата. Возвращает новые значения или None."""
+    return await run_in_db(_add_context_usage, str(chat_id), thread_id, messages, tokens)
+
+async def swap_thread_id(chat_id: str, old_thread_id: str, new_thread_id: str,
+                         message_count: int, context_tokens: int, tokens_saved: int) -> bool:
+    """Заменяет поток чата после сжатия, если за это время поток не сменили другим способом."""
+    logger.debug(f"Замена потока после сжатия для чата с ID: {chat_id}")
+    swapped = await run_in_db(
+        _swap_thread_id, str(chat_id), old_thread_id, new_thread_id, message_count, context_tokens, tokens_saved
+    )
+    if swapped:
+        _thread_cache.set(str(chat_id), new_thread_id)
+    return swapped
+
+async def get_chat_stats(chat_id: str) -> Optional[dict]:
+    """Возвращает счетчики контекста и статистику сжатий для чата."""
+    row = await run_in_db(_get_chat_stats, str(chat_id))
+    if row is None:
+        return None
+    keys = ('thread_id', 'message_count', 'context_tokens', 'compactions', 'tokens_saved')
+    return dict(zip(keys, row))
+
+async def create_log(chat_id: str, user_nickname: str, message_text: str, message_time):
     """Создает лог для указанного чата."""
     logger.debug(f"Создание лога для чата с ID: {chat_id}")
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO tgbot_logs (chat_id, user_nickname, message_text, message_time) VALUES (?, ?, ?, ?)',
-            (chat_id, user_nickname, message_text, message_time)
-        )
+    await logstore.write_logs([(chat_id, user_nickname, message_text, logstore.to_timestamp(message_time))])
+
+async def create_logs(rows: List[tuple]):
+    """Создает пачку логов одной транзакцией.
+
+    Каждая строка: (chat_id, user_nickname, message_text, created_at), created_at - секунды Unix.
+    Логи пишутся в отдельную базу логов (logstore.py).
+    """
+    logger.debug(f"Запись пачки логов: {len(rows)} шт.")
+    await logstore.write_logs(rows)
+
+async def get_chat_logs(chat_id: str, since: Optional[int] = None, until: Optional[int] = None,
+                        limit: int = 100) -> List[dict]:
+    """Последние limit логов чата за период [since, until) в хронологическом порядке."""
+    return await logstore.get_chat_logs(chat_id, since, until, limit)
+
+async def get_period_stats(since: Optional[int] = None, until: Optional[int] = None,
+                           period: str = 'day') -> List[dict]:
+    """Количество логов и чатов по периодам (hour, day или month, по UTC) за [since, until)."""
+    return await logstore.get_period_stats(since, until, period)
+
+async def checkpoint() -> tuple:
+    """Переносит журнал WAL в файл базы, не блокируя чтение и запись."""
+    return await run_in_db(_checkpoint)
+
+async def get_cached_answer(cache_key: str, fingerprint: str, min_created_at: float) -> Optional[tuple]:
+    """Получает сохраненный ответ и время его генерации, если он еще актуален."""
+    return await run_in_db(_get_cached_answer, cache_key, fingerprint, min_created_at)
+
+async def save_cached_answer(cache_key: str, answer: str, fingerprint: str, created_at: float, duration: float):
+    """Сохраняет ответ в постоянный кэш."""
+    await run_in_db(_save_cached_answer, cache_key, answer, fingerprint, created_at, duration)
+
+async def delete_stale_answers(fingerprint: str, min_created_at: float) -> int:
+    """Удаляет устаревшие ответы и ответы, построенные по старой базе знаний."""
+    deleted = await run_in_db(_delete_stale_answers, fingerprint, min_created_at)
+    logger.debug(f"Удалено устаревших ответов из кэша: {deleted}")
+    return deleted
+
+async def add_thread_messages(rows: List[tuple]):
+    """Дописывает сообщения в локальную историю потоков одной транзакцией.
+
+    Каждая строка: (thread_id, role, content, tokens, created_at).
+    """
+    await run_in_db(_add_thread_messages, rows)
+
+async def get_thread_messages(thread_id: str, limit: int) -> List[tuple]:
+    """Возвращает последние limit сообщений потока в хронологическом порядке: (role, content, tokens)."""
+    return await run_in_db(_get_thread_messages, thread_id, limit)
@@ -0,0 +1,43 @@
+import os
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Где хранится общее состояние бота (чаты, потоки, история потоков, кэш ответов, логи): sqlite - локальный файл, подходит
+# для одного процесса; pocketbase - сетевое хранилище, общее для нескольких реплик
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+
+if STATE_BACKEND == 'pocketbase':
+    from app.db_wrappers import pocketbasedb as backend
+elif STATE_BACKEND == 'sqlite':
+    from app.db_wrappers import sqlitedb as backend
+else:
+    raise ValueError(f"Неизвестное хранилище состояния: {STATE_BACKEND}")
+# sqlitedb импортируется при любом хранилище, поэтому о выборе сообщаем здесь, а не при импорте модуля
+logger.info(f"Хранилище состояния: {STATE_BACKEND}")
+# Состояние общее для нескольких реплик: копиям в памяти процесса нельзя доверять без сверки с хранилищем
+SHARED_STATE = STATE_BACKEND != 'sqlite'
+
+# Оба модуля реализуют одинаковый набор функций
+get_all_chats = backend.get_all_chats
+chat_exists = backend.chat_exists
+get_thread_id = backend.get_thread_id
+set_thread_id = backend.set_thread_id
+create_chat_and_thread = backend.create_chat_and_thread
+save_thread_id = backend.save_thread_id
+get_or_create_thread_id = backend.get_or_create_thread_id
+add_context_usage = backend.add_context_usage
+swap_thread_id = backend.swap_thread_id
+get_chat_stats = backend.get_chat_stats
+create_log = backend.create_log
+create_logs = backend.create_logs
+get_chat_logs = backend.get_chat_logs
+get_period_stats = backend.get_period_stats
+get_cached_answer = backend.get_cached_answer
+save_cached_answer = backend.save_cached_answer
+delete_stale_answers = backend.delete_stale_answers
+add_thread_messages = backend.add_thread_messages
+get_thread_messages = backend.get_thread_messages
+close_state = backend.close_db
@@ -0,0 +1,54 @@
+import os
+import time
+import asyncio
+import dotenv
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Сколько секунд ждать следующего запроса пользователя, прежде чем отвечать на текущий
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', '0.3'))
+# Записи о пользователях, которые давно ничего не присылали, удаляются
+DEBOUNCE_FORGET_AFTER = 60.0
+
+class Debouncer:
+    """Пропускает запросы пользователя не чаще раза в delay секунд.
+
+    Первый запрос после паузы выполняется сразу. Запрос, пришедший раньше, ждет окончания интервала
+    и отменяется, если за это время от того же пользователя пришел более новый: пока пользователь
+    печатает, обрабатывается только последний вариант запроса.
+    """
+
+    def __init__(self, delay: float = INLINE_DEBOUNCE):
+        self.delay = delay
+        # user_id -> [номер последнего запроса, время последнего пропущенного запроса]
+        self._users = {}
+        self._sequence = 0
+        self.dropped = 0
+
+    async def wait(self, user_id) -> bool:
+        """Ждет своей очереди. Возвращает False, если запрос устарел и отвечать на него не нужно."""
+        self._sequence += 1
+        ticket = self._sequence
+        now = time.monotonic()
+        entry = self._users.setdefault(user_id, [ticket, 0.0])
+        entry[0] = ticket
+
+        delay = entry[1] + self.delay - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+            if entry[0] != ticket:
+                self.dropped += 1
+                return False
+        entry[1] = time.monotonic()
+        self._prune(entry[1])
+        return True
+
+    def _prune(self, now: float):
+        if len(self._users) < 1024:
+            return
+        for user_id in [user_id for user_id, (_, sent) in self._users.items() if now - sent > DEBOUNCE_FORGET_AFTER]:
+            del self._users[user_id]
+
+# Общий для всех встроенных запросов экземпляр
+inline_debouncer = Debouncer()
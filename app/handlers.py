@@ -1,17 +1,53 @@
-from telegram import Update
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import ContextTypes
 from loguru import logger
 import dotenv
 import os
+import time
 from app.ai.searchapi import search_api_generative, search_api_generative_contextual
-from app.ai.ai_assistants import ai_assistant, ai_assistant_new_thread
-from app.db_wrappers.sqlitedb import create_log, chat_exists, get_thread_id, set_thread_id, create_chat_and_thread
+from app.ai.ai_assistants import (
+    ai_assistant, ai_assistant_stream, ai_assistant_new_thread, ai_assistant_discard_thread, with_inventory_context,
+)
+from app.ai.answer_cache import answer_cache, normalize_query
+from app.ai.single_flight import single_flight
+from app.ai.thread_lifecycle import track_exchange
+from app.ai.thread_history import thread_history
+from app.ai.index_manager import index_manager
+from app.db_wrappers.state import get_or_create_thread_id, get_thread_id, save_thread_id, get_chat_stats
+from app.db_wrappers.log_writer import enqueue_log
+from app.inventory.search import search_inventory, format_records, format_record, clean
+from app.inventory.inline import get_inline_index
+from app.inventory.retrieval import get_retriever
+from app.debounce import inline_debouncer
+from app.streaming import StreamingReply, keep_typing
+from app.scheduler import chat_scheduler, SchedulerOverloaded
+from app.metrics import span, timed, MESSAGES, FALLBACKS
 
 # Загрузка переменных окружения
 dotenv.load_dotenv()
 
 # Получение имени бота из переменных окружения
 BOT_NAME = os.getenv("BOT_NAME")
+# Отвечать ли на однозначные запросы по складу без обращения к ассистенту
+INVENTORY_DIRECT_ANSWERS = os.getenv("INVENTORY_DIRECT_ANSWERS", "True") == "True"
+# Показывать ли ответ ассистента по мере генерации правками сообщения
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "True") == "True"
+# Сколько секунд Telegram может хранить у себя ответ на встроенный запрос
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+
+# Чаты, которым разрешены служебные команды, через запятую
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").split(",") if chat_id.strip()}
+
+# Ответы при ожидании в очереди и при перегрузке
+QUEUED_REPLY = "Отвечаю на предыдущий вопрос, этот вопрос в очереди. Пожалуйста, подождите."
+OVERLOADED_REPLY = "Сейчас слишком много вопросов. Пожалуйста, подождите немного и повторите вопрос."
+# Ответ, когда не ответили ни ассистент, ни запасные источники
+FALLBACK_REPLY = (
+    "Сейчас не получается найти ответ, попробуйте повторить вопрос чуть позже. "
+    "А пока можно поискать самим в таблице склада: https://storage.yandexcloud.net/drivers.data/storage/storage.xlsx"
+)
+# Сколько позиций склада показывать, когда ассистент недоступен
+FALLBACK_RECORDS = 5
 
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start."""
@@ -23,13 +59,16 @@ async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug(f"Вызвана команда /help от пользователя с ID: {update.effective_user.id}")
     help_info = """Для получения ответа от AI-ассистента, просто напишите ваш вопрос в чат.
 Для отчистки истории сообщений, создайте новый тред командой: /new_thread.
+Размер истории текущего треда показывает команда /stats.
 """
     
     await update.message.reply_text(help_info)
 
+@timed('searchapi_contextual_handler')
 async def searchapi_contextual_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик запросов API поиска с контекстом треда."""
     logger.debug("Запрос API поиска с контекстом треда")
+    MESSAGES.inc(kind='searchapi_contextual')
     
     # Получаем идентификатор чата и информацию о пользователе
     chat_id = update.effective_chat.id or None
@@ -51,24 +90,31 @@ async def searchapi_contextual_handler(update: Update, context: ContextTypes.DEF
     thread_id = await safely_get_thread_id(chat_id)
     
     try:
-        # Генерируем ответ с учетом контекста треда
-        generated_content = await search_api_generative_contextual(query, thread_id)
-        await update.message.reply_text(generated_content)
+        # Генерируем ответ с учетом контекста треда, по очереди с другими вопросами чата
+        async with chat_scheduler.turn(chat_id):
+            generated_content = await search_api_generative_contextual(query, thread_id)
+        with span('telegram_send'):
+            await update.message.reply_text(generated_content)
+        await track_exchange(chat_id, thread_id, query, generated_content)
         
         # Логируем информацию о запросе и ответе
-        create_log(chat_id, user_nickname, query, date.isoformat())
-        create_log(chat_id, user_nickname, generated_content, date.isoformat())
+        enqueue_log(chat_id, user_nickname, query, date)
+        enqueue_log(chat_id, user_nickname, generated_content, date)
+    except SchedulerOverloaded:
+        await update.message.reply_text(OVERLOADED_REPLY)
     except Exception as e:
         await update.message.reply_text("Произошла ошибка при обработке запроса.")
         logger.error(f"Ошибка при обработке запроса: {e}")
         
         # Логируем ошибку
-        create_log(chat_id, user_nickname, query, date.isoformat())
-        create_log(chat_id, user_nickname, str(e), date.isoformat())
+        enqueue_log(chat_id, user_nickname, query, date)
+        enqueue_log(chat_id, user_nickname, str(e), date)
 
+@timed('searchapi_handler')
 async def searchapi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик запросов к API поиска."""
     logger.debug("Обработка запроса к API поиска")
+    MESSAGES.inc(kind='searchapi')
     
     chat_id = update.effective_chat.id
     user_nickname = update.effective_user.username or "Неизвестный пользователь"
@@ -88,20 +134,32 @@ async def searchapi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = query[1]
     
     try:
-        # Генерируем ответ на запрос
-        generated_content = await search_api_generative(query)
-        await update.message.reply_text(generated_content)
+        # Генерируем ответ на запрос, если его еще нет в кэше
+        generated_content = await answer_cache.get(query, namespace='searchapi')
+        if generated_content is None:
+            # Одинаковые запросы, пришедшие одновременно, ждут один ответ
+            started = time.monotonic()
+            async with chat_scheduler.turn(chat_id):
+                generated_content, shared = await single_flight.do(
+                    coalesce_key('searchapi', query), search_api_generative, query
+                )
+            if not shared:
+                await answer_cache.set(query, generated_content, time.monotonic() - started, namespace='searchapi')
+        with span('telegram_send'):
+            await update.message.reply_text(generated_content)
         
         # Логируем информацию о запросе и ответе
-        create_log(chat_id, user_nickname, query, date.isoformat())
-        create_log(chat_id, user_nickname, generated_content, date.isoformat())
+        enqueue_log(chat_id, user_nickname, query, date)
+        enqueue_log(chat_id, user_nickname, generated_content, date)
+    except SchedulerOverloaded:
+        await update.message.reply_text(OVERLOADED_REPLY)
     except Exception as e:
         await update.message.reply_text("Произошла ошибка при обработке вашего запроса.")
         logger.error(f"Ошибка при обработке запроса: {e}")
         
         # Логируем информацию об ошибке
-        create_log(chat_id, user_nickname, query, date.isoformat())
-        create_log(chat_id, user_nickname, str(e), date.isoformat())
+        enqueue_log(chat_id, user_nickname, query, date)
+        enqueue_log(chat_id, user_nickname, str(e), date)
 
 async def new_thread_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Создание нового потока для чата."""
@@ -110,34 +168,258 @@ async def new_thread_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     chat_id = update.effective_chat.id
     thread_id = await ai_assistant_new_thread(chat_id=chat_id)
     
-    # Проверяем, существует ли уже поток для данного чата
-    if chat_exists(chat_id):
-        set_thread_id(chat_id, thread_id)
-    else:
-        create_chat_and_thread(chat_id, thread_id)
+    # Создаем чат или заменяем его поток одним запросом
+    await save_thread_id(chat_id, thread_id)
         
     await update.message.reply_text(f"Новый поток успешно создан: {thread_id}")
 
+@timed('assistant_handler')
 async def ai_assistant_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка запроса к AI ассистенту."""
     logger.debug("Обработка запроса к AI")
     
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
-    
     chat_id = update.effective_chat.id
-    thread_id = await safely_get_thread_id(chat_id)
+    user_nickname = update.effective_user.username or "Неизвестный пользователь"
+    date = update.message.date
+    question = update.message.text
+    
+    # Однозначные запросы по складу обслуживаем из локального индекса.
+    # Такие ответы логируются и дописываются в поток чата так же, как ответы ассистента
+    if INVENTORY_DIRECT_ANSWERS:
+        with span('inventory_search'):
+            result = search_inventory(question)
+        if result.unambiguous:
+            logger.debug(f"Ответ из индекса склада ({result.reason}): {len(result.records)} позиций")
+            MESSAGES.inc(kind='inventory')
+            answer = format_records(result.records)
+            with span('telegram_send'):
+                await update.message.reply_text(answer)
+            enqueue_log(chat_id, user_nickname, question, date)
+            enqueue_log(chat_id, user_nickname, answer, date)
+            await remember_exchange(chat_id, question, answer)
+            return
+    
+    # Повторяющиеся вопросы обслуживаем из кэша ответов. В кэше только ответы на первый вопрос потока:
+    # следующие вопросы ("а где он лежит?") опираются на историю своего чата
+    if not chat_scheduler.queued(chat_id) and await is_context_free(chat_id):
+        answer = await answer_cache.get(question)
+        if answer is not None:
+            MESSAGES.inc(kind='cached')
+            with span('telegram_send'):
+                await update.message.reply_text(answer)
+            enqueue_log(chat_id, user_nickname, question, date)
+            enqueue_log(chat_id, user_nickname, answer, date)
+            await remember_exchange(chat_id, question, answer)
+            return
+    
+    MESSAGES.inc(kind='assistant')
+    
+    thread_id = None
+    reply = None
+    prompt = None
+    context_free = False
+    
+    async def _ask():
+        nonlocal thread_id, reply, prompt
+        thread_id = await safely_get_thread_id(chat_id)
+        started = time.monotonic()
+        # Вопрос уходит в поток вместе с позициями склада, их учитываем и в размере контекста
+        prompt = with_inventory_context(question)
+        
+        if not STREAM_REPLIES:
+            answer = await ai_assistant(question, thread_id, prompt)
+            with span('telegram_send'):
+                await update.message.reply_text(answer)
+        else:
+            # Показываем ответ по мере генерации, правя одно сообщение
+            reply = StreamingReply(update.message)
+            await reply.start()
+            answer = ''
+            async for answer in ai_assistant_stream(question, thread_id, prompt):
+                await reply.update(answer)
+            with span('telegram_send'):
+                await reply.finish(answer)
+        
+        if context_free:
+            await answer_cache.set(question, answer, time.monotonic() - started)
+        return answer
+    
+    async def _notify_queued():
+        await update.message.reply_text(QUEUED_REPLY)
+    
+    # Вопросы одного чата обрабатываются по очереди, при перегрузке просим подождать.
+    # Пока ассистент думает, держим статус "печатает".
+    # Если такой же вопрос уже выполняется в другом чате, ждем его ответ вместо нового запуска.
+    # Объединяются только вопросы, открывающие поток: ответ на них не зависит от истории чата
+    try:
+        async with chat_scheduler.turn(chat_id, on_wait=_notify_queued):
+            async with keep_typing(context.bot, chat_id):
+                context_free = await is_context_free(chat_id)
+                key = coalesce_key('assistant', question) if context_free else None
+                answer, shared = await single_flight.do(key, _ask)
+    except SchedulerOverloaded:
+        await update.message.reply_text(OVERLOADED_REPLY)
+        return
+    except Exception as e:
+        # Ассистент не ответил: истекло время, ошибка сервиса или предохранитель разомкнут
+        logger.error(f"Ассистент не ответил: {e!r}")
+        answer, source = await fallback_answer(question, await is_context_free(chat_id))
+        FALLBACKS.inc(source=source)
+        with span('telegram_send'):
+            if reply is not None:
+                # Начатый потоковый ответ заменяется запасным
+                await reply.finish(answer)
+            else:
+                await update.message.reply_text(answer)
+        enqueue_log(chat_id, user_nickname, question, date)
+        enqueue_log(chat_id, user_nickname, answer, date)
+        return
+    
+    # Логируем вопрос и ответ, по ним же оценивается поиск по складу
+    enqueue_log(chat_id, user_nickname, question, date)
+    enqueue_log(chat_id, user_nickname, answer, date)
+    
+    if shared:
+        with span('telegram_send'):
+            await update.message.reply_text(answer)
+        # Ответ сгенерирован в потоке другого чата, в свой поток дописываем его сами
+        await remember_exchange(chat_id, question, answer)
+        return
+    
+    # Длинные потоки сжимаются в фоне, чтобы контекст следующих запросов не рос
+    await track_exchange(chat_id, thread_id, question, answer, prompt)
+
+async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает размер контекста потока чата и сколько удалось сэкономить сжатием."""
+    stats = await get_chat_stats(update.effective_chat.id)
+    if not stats:
+        await update.message.reply_text("Для этого чата еще нет потока.")
+        return
+    
+    await update.message.reply_text(
+        f"Сообщений в потоке: {stats['message_count']}\n"
+        f"Токенов в контексте (оценка): {stats['context_tokens']}\n"
+        f"Сжатий потока: {stats['compactions']}\n"
+        f"Сэкономлено токенов контекста: {stats['tokens_saved']}"
+    )
+
+async def reload_index_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Служебная команда: переключиться на индекс из index_id.json или пересобрать индекс."""
+    if update.effective_chat.id not in ADMIN_CHAT_IDS:
+        return
     
-    # Получаем ответ от AI ассистента
-    answer = await ai_assistant(update.message.text, thread_id)
-    await update.message.reply_text(answer)
+    rebuild = bool(context.args) and context.args[0] == "rebuild"
+    await update.message.reply_text("Пересобираю индекс..." if rebuild else "Перечитываю index_id.json...")
+    try:
+        if rebuild:
+            await index_manager.rebuild()
+            switched = True
+        else:
+            switched = await index_manager.reload()
+    except Exception as e:
+        logger.error(f"Ошибка переключения индекса: {e}")
+        await update.message.reply_text(f"Не удалось переключить индекс: {e}")
+        return
+    
+    if switched:
+        await update.message.reply_text(f"Новые вопросы идут к индексу {index_manager.index_id}")
+    else:
+        await update.message.reply_text(f"Индекс не изменился: {index_manager.index_id}")
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Встроенный режим (@бот запрос): позиции склада из локального индекса, без обращения к ассистенту."""
+    inline_query = update.inline_query
+    query = inline_query.query.strip()
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    
+    # Пока пользователь печатает, Telegram присылает запрос на каждую букву; отвечаем на последний.
+    # Следующие страницы уже найденного запроса отдаем сразу
+    if not query or (offset == 0 and not await inline_debouncer.wait(inline_query.from_user.id)):
+        return
+    MESSAGES.inc(kind='inline')
+    
+    with span('inline_search'):
+        found, next_offset = get_inline_index().search(query, offset)
+    results = []
+    for record_id, record in found:
+        place = clean(record.get('used_placement')) or clean(record.get('placement'))
+        location = ', '.join(part for part in (clean(record.get('storage_location')), place) if part)
+        results.append(InlineQueryResultArticle(
+            id=str(record_id),
+            title=' '.join(part for part in (clean(record.get('equipment_group')), clean(record.get('manufacturer'))) if part),
+            description=f"{clean(record.get('specs'))}\n{clean(record.get('qty')) or '?'} шт." + (f", {location}" if location else ''),
+            input_message_content=InputTextMessageContent(format_record(record)),
+        ))
+    
+    with span('telegram_send'):
+        await inline_query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            next_offset=str(next_offset) if next_offset is not None else '',
+        )
+
+async def fallback_answer(question: str, context_free: bool = True) -> tuple:
+    """Ответ без ассистента: сохраненный ответ, позиции склада, генеративный поиск или заготовленный ответ.
+
+    Сохраненный ответ берется только для вопроса без истории в чате (context_free), как и в кэше.
+    Возвращает ответ и его источник. Никогда не бросает исключений.
+    """
+    if context_free:
+        try:
+            answer = await answer_cache.get(question, stale=True)
+            if answer is not None:
+                return answer, 'cache'
+        except Exception as e:
+            logger.warning(f"Кэш ответов недоступен: {e!r}")
+    
+    try:
+        with span('inventory_search'):
+            records = search_inventory(question).records[:FALLBACK_RECORDS]
+            if not records:
+                records = [record for record, _ in get_retriever().retrieve(question, k=FALLBACK_RECORDS)]
+        if records:
+            return format_records(records), 'inventory'
+    except Exception as e:
+        logger.warning(f"Ошибка поиска по складу: {e!r}")
+    
+    try:
+        return await search_api_generative(question), 'searchapi'
+    except Exception as e:
+        logger.warning(f"Генеративный поиск не ответил: {e!r}")
+    
+    return FALLBACK_REPLY, 'canned'
+
+def coalesce_key(namespace: str, query: str):
+    """Ключ для объединения одинаковых запросов или None, если вопрос пустой после нормализации."""
+    normalized = normalize_query(query)
+    return f"{namespace}:{normalized}" if normalized else None
+
+async def is_context_free(chat_id: str) -> bool:
+    """Пуст ли поток чата: ответ на первый вопрос потока не зависит от разговора и годится для любого чата."""
+    try:
+        thread_id = await get_thread_id(chat_id)
+        return thread_id is None or not await thread_history.load(thread_id)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать историю потока чата {chat_id}: {e!r}")
+        return False
+
+async def remember_exchange(chat_id: str, question: str, answer: str):
+    """Дописывает в поток чата вопрос и ответ, которые ассистент в этом потоке не генерировал.
+
+    Без этого следующий вопрос чата ушел бы ассистенту без контекста уже показанного ответа.
+    """
+    try:
+        thread_id = await safely_get_thread_id(chat_id)
+        await thread_history.append(thread_id, 'user', question)
+        await thread_history.append(thread_id, 'assistant', answer)
+        await track_exchange(chat_id, thread_id, question, answer)
+    except Exception as e:
+        logger.error(f"Не удалось дописать ответ в поток чата {chat_id}: {e!r}")
 
 async def safely_get_thread_id(chat_id: str) -> str:
     """Безопасное получение идентификатора потока для чата."""
-    thread_id = get_thread_id(chat_id)
-    
-    # Если поток не найден, создаем новый
-    if not thread_id:
-        thread_id = await ai_assistant_new_thread(chat_id)
-        create_chat_and_thread(chat_id, thread_id)
-        
-    return get_thread_id(chat_id)
\ No newline at end of file
+    # Если поток не найден, создаем новый; при гонке реплик все получают один поток
+    with span('db_lookup'):
+        return await get_or_create_thread_id(
+            chat_id, lambda: ai_assistant_new_thread(chat_id), ai_assistant_discard_thread
+        )
\ No newline at end of file
@@ -0,0 +1,129 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, NamedTuple, Tuple
+from urllib.parse import parse_qs
+from loguru import logger
+
+# Ограничения на запрос: размер тела и время чтения
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30.0
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body: bytes
+
+class Response(NamedTuple):
+    status: int
+    body: bytes = b''
+    content_type: str = 'application/json'
+
+class PayloadTooLarge(ValueError):
+    """Тело запроса больше MAX_BODY_SIZE."""
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+class HttpServer:
+    """Небольшой HTTP/1.1-сервер на asyncio с keep-alive и таблицей маршрутов."""
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server = None
+        self._connections = set()
+
+    def route(self, method: str, path: str, handler: Handler):
+        """Регистрирует обработчик для метода и пути."""
+        self._routes[(method, path)] = handler
+
+    async def start(self):
+        """Начинает принимать соединения."""
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info(f"HTTP-сервер слушает {self.listen}:{self.port}")
+
+    async def stop(self):
+        """Останавливает прием соединений."""
+        if self._server is not None:
+            self._server.close()
+            # Закрываем простаивающие keep-alive соединения, чтобы их задачи завершились
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            # Соединение держится открытым, пока клиент отправляет новые запросы
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                if request is None:
+                    break
+                request, keep_alive = request
+                response = await self._dispatch(request)
+                keep_alive = keep_alive and response.status < 400
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            status = 413 if isinstance(e, PayloadTooLarge) else 400
+            self._write_response(writer, Response(status), False)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Читает запрос: (Request, держать ли соединение) или None, если клиент закрыл соединение."""
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, version = line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', '0'))
+        if length > MAX_BODY_SIZE:
+            raise PayloadTooLarge()
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        keep_alive = version.strip() == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        return Request(method, path, parse_qs(query), headers, body), keep_alive
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            return Response(405 if known_path else 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка обработки {request.method} {request.path}: {e}")
+            return Response(500)
+
+    def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        headers = [
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}",
+            f"Content-Length: {len(response.body)}",
+            f"Content-Type: {response.content_type}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + response.body)
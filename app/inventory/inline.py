@@ -0,0 +1,161 @@
+import os
+import bisect
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+import dotenv
+from app.cache import LRUCache
+from app.inventory.normalize import tokenize, normalize_text, ngrams, is_model_token
+from app.inventory.search import STOP_WORDS, NOMINAL_RE, TEXT_FIELDS, InventoryIndex, get_inventory
+from app.inventory.units import parse_constraints
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Сколько позиций отдавать на одной странице встроенного режима (Telegram принимает до 50)
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', '20'))
+# Сколько запросов помнить, чтобы следующие страницы не искались заново
+INLINE_RESULTS_CACHE_SIZE = 256
+INLINE_RESULTS_CACHE_TTL = 60.0
+
+# Вклад слова запроса в оценку позиции в зависимости от того, как оно совпало
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.6
+# Слово с опечаткой должно разделять с настоящим хотя бы такую долю триграмм
+FUZZY_MIN_SIMILARITY = 0.5
+# Слишком короткий префикс совпадает с половиной склада, его не расширяем
+MIN_PREFIX = 2
+MAX_EXPANSIONS = 64
+
+class InlineIndex:
+    """Поиск по складу для встроенного режима: слова можно не дописывать и писать с опечатками.
+
+    Позиция получает оценку за каждое слово запроса: точное совпадение, совпадение по началу слова
+    или похожее слово по триграммам. Выше стоят позиции, в которых нашлось больше слов запроса.
+    """
+
+    def __init__(self, index: InventoryIndex):
+        self.index = index
+        # Словарь склада: слово -> позиции, отсортированный список слов для поиска по префиксу
+        self.words: Dict[str, Set[int]] = defaultdict(set)
+        for record_id, record in enumerate(index.records):
+            for name in TEXT_FIELDS:
+                for token in tokenize(record.get(name) or ''):
+                    self.words[token].add(record_id)
+        self.sorted_words = sorted(self.words)
+        # Триграммы слов для поиска похожих слов
+        self.word_grams: Dict[str, Set[str]] = defaultdict(set)
+        for word in self.words:
+            if len(word) >= 4:
+                for gram in ngrams(word):
+                    self.word_grams[gram].add(word)
+        self._variants = LRUCache(4096)
+        self._results = LRUCache(INLINE_RESULTS_CACHE_SIZE, INLINE_RESULTS_CACHE_TTL)
+
+    def _prefixed(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.sorted_words, prefix)
+        words = []
+        for word in self.sorted_words[start:start + MAX_EXPANSIONS]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    def _similar(self, token: str) -> List[Tuple[str, float]]:
+        grams = ngrams(token)
+        shared = defaultdict(int)
+        for gram in grams:
+            for word in self.word_grams.get(gram, ()):
+                shared[word] += 1
+        similar = []
+        for word, count in shared.items():
+            similarity = count / (len(grams) + len(ngrams(word)) - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                similar.append((word, similarity))
+        return similar
+
+    def variants(self, token: str, prefix: bool) -> Dict[int, float]:
+        """Позиции, в которых встречается слово запроса, с оценкой совпадения."""
+        key = (token, prefix)
+        cached = self._variants.get(key)
+        if cached is not None:
+            return cached
+
+        scores: Dict[int, float] = {}
+
+        def add(record_ids, score: float):
+            for record_id in record_ids:
+                if scores.get(record_id, 0.0) < score:
+                    scores[record_id] = score
+
+        if prefix and len(token) >= MIN_PREFIX:
+            for word in self._prefixed(token):
+                add(self.words[word], EXACT_SCORE if word == token else PREFIX_SCORE)
+        else:
+            add(self.words.get(token, ()), EXACT_SCORE)
+        # Коды моделей ищутся и внутри слов: "5sx2" в "siemens5sx23c25"
+        if is_model_token(token):
+            add(self.index.match_model(token), EXACT_SCORE)
+        if len(token) >= 4:
+            for word, similarity in self._similar(token):
+                add(self.words[word], FUZZY_SCORE * similarity)
+
+        self._variants.set(key, scores)
+        return scores
+
+    def ranked(self, query: str) -> List[int]:
+        """Номера подходящих позиций, лучшие первыми."""
+        # Последнее слово может быть еще не дописано: от этого зависит ранжирование, поэтому и ключ
+        typing = not query.endswith(' ')
+        key = (normalize_text(query), typing)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+
+        codes = NOMINAL_RE.findall(query)
+        nominal_ids = sorted({record_id for code in codes for record_id in self.index.by_nominal.get(code, ())})
+        if nominal_ids:
+            self._results.set(key, nominal_ids)
+            return nominal_ids
+
+        constraints, rest = parse_constraints(query)
+        tokens = [token for token in tokenize(rest) if token not in STOP_WORDS]
+        totals: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+        for position, token in enumerate(tokens):
+            for record_id, score in self.variants(token, typing and position == len(tokens) - 1).items():
+                total = totals[record_id]
+                total[0] += 1
+                total[1] += score
+
+        if tokens:
+            # Показываем только позиции, в которых нашлось больше всего слов запроса
+            best = max((total[0] for total in totals.values()), default=0)
+            candidates = [(record_id, total) for record_id, total in totals.items() if total[0] == best]
+        elif constraints:
+            # В запросе только величины: "25А"
+            candidates = [(record_id, [0, 0.0]) for record_id in range(len(self.index.records))]
+        else:
+            candidates = []
+        candidates = [item for item in candidates if self.index.matches_constraints(item[0], constraints)]
+        candidates.sort(key=lambda item: (-item[1][1], item[0]))
+        ranked = [record_id for record_id, _ in candidates]
+        self._results.set(key, ranked)
+        return ranked
+
+    def search(self, query: str, offset: int = 0, limit: int = INLINE_PAGE_SIZE) -> Tuple[List[Tuple[int, dict]], Optional[int]]:
+        """Страница результатов: (номер позиции, позиция) и смещение следующей страницы или None."""
+        ranked = self.ranked(query)
+        page = ranked[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(ranked) else None
+        return [(record_id, self.index.records[record_id]) for record_id in page], next_offset
+
+# Индекс строится при первом обращении и после обновления склада
+_inline_index: Optional[InlineIndex] = None
+
+def get_inline_index() -> InlineIndex:
+    """Возвращает поиск для встроенного режима, строя его заново, когда перестроен индекс склада."""
+    global _inline_index
+    index = get_inventory()
+    if _inline_index is None or _inline_index.index is not index:
+        _inline_index = InlineIndex(index)
+    return _inline_index
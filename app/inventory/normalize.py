@@ -0,0 +1,55 @@
+import re
+
+# Кириллические буквы, похожие на латинские. В кодах моделей их часто путают: "С60А" и "C60A".
+# "В" переводится в "v", потому что на складе это почти всегда вольты
+LOOKALIKES = str.maketrans({
+    'а': 'a', 'в': 'v', 'е': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o',
+    'р': 'p', 'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ё': 'e',
+})
+
+# Окончания, которые отбрасываются при грубом стемминге русских слов
+ENDINGS = (
+    'ями', 'ами', 'его', 'ого', 'ему', 'ому', 'ыми', 'ими', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь',
+)
+
+TOKEN_RE = re.compile(r'[0-9a-zа-яё]+')
+CYRILLIC_RE = re.compile(r'[а-яё]')
+LATIN_OR_DIGIT_RE = re.compile(r'[0-9a-z]')
+
+def normalize_text(text: str) -> str:
+    """Приводит текст к нижнему регистру и схлопывает пробелы."""
+    return ' '.join(str(text).lower().replace('ё', 'е').split())
+
+def is_model_token(token: str) -> bool:
+    """Проверяет, похож ли токен на код модели или номенклатуры (есть цифры или латиница)."""
+    return LATIN_OR_DIGIT_RE.search(token) is not None
+
+def fold_lookalikes(token: str) -> str:
+    """Заменяет кириллические буквы, похожие на латинские, в кодах моделей."""
+    return token.translate(LOOKALIKES) if is_model_token(token) else token
+
+def tokenize(text: str) -> list:
+    """Разбивает текст на нормализованные токены."""
+    return [fold_lookalikes(token) for token in TOKEN_RE.findall(normalize_text(text))]
+
+def compact(text: str) -> str:
+    """Возвращает строку без пробелов и разделителей для поиска по подстроке кода модели."""
+    return ''.join(tokenize(text))
+
+def stem(word: str) -> str:
+    """Грубый стемминг русского слова: отбрасывает окончание и обрезает до 5 символов."""
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)]
+            break
+    return word[:5]
+
+def ngrams(text: str, n: int = 3) -> set:
+    """Возвращает множество символьных n-грамм строки."""
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
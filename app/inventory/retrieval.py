@@ -0,0 +1,187 @@
+import os
+import math
+import heapq
+import importlib.util
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import dotenv
+from loguru import logger
+from app.inventory.normalize import tokenize, stem, ngrams, is_model_token
+from app.inventory.search import STOP_WORDS, TEXT_FIELDS, InventoryIndex, clean
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Добавлять ли к вопросу ассистенту подходящие позиции склада
+RETRIEVAL_ENABLED = os.getenv('RETRIEVAL_ENABLED', 'True') == 'True'
+# Сколько позиций добавлять и минимальная оценка позиции
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '0.35'))
+# Вес сходства по символьным n-граммам относительно BM25
+RETRIEVAL_NGRAM_WEIGHT = float(os.getenv('RETRIEVAL_NGRAM_WEIGHT', '0.5'))
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Векторный подсчет оценок включается, только если установлен numpy и позиций достаточно много:
+# на нескольких сотнях позиций накладные расходы numpy больше выигрыша
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+NUMPY_MIN_RECORDS = 1000
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+# Поля позиции, по которым идет поиск: текстовые и номенклатурный код
+RETRIEVAL_FIELDS = TEXT_FIELDS + ('nominal',)
+
+CONTEXT_HEADER = "Позиции склада, найденные по вопросу (используй их, если они подходят):"
+
+def _terms(text: str) -> List[str]:
+    """Термы для BM25: коды моделей как есть, русские слова - основами."""
+    return [
+        token if is_model_token(token) else stem(token)
+        for token in tokenize(text) if token not in STOP_WORDS
+    ]
+
+def _query_grams(text: str) -> set:
+    """Символьные триграммы значимых слов запроса."""
+    grams = set()
+    for token in tokenize(text):
+        if token not in STOP_WORDS and len(token) >= 3:
+            grams |= ngrams(token)
+    return grams
+
+class HybridRetriever:
+    """Ранжирует позиции склада по BM25 и сходству символьных n-грамм.
+
+    BM25 находит позиции по словам запроса, n-граммы - по частям кодов моделей и словам с опечатками.
+    Обе оценки приводятся к [0, 1] и складываются с весом RETRIEVAL_NGRAM_WEIGHT.
+    """
+
+    def __init__(self, records: List[dict], index: Optional[InventoryIndex] = None,
+                 use_numpy: Optional[bool] = None):
+        self.records = records
+        if use_numpy is None:
+            use_numpy = len(records) >= NUMPY_MIN_RECORDS
+        self.use_numpy = use_numpy and NUMPY_AVAILABLE
+        # Триграммы позиций уже посчитаны в индексе склада
+        index = index or InventoryIndex(records)
+        self.index = index
+
+        documents = [
+            Counter(_terms(' '.join(str(record.get(name) or '') for name in RETRIEVAL_FIELDS)))
+            for record in records
+        ]
+        lengths = [sum(document.values()) for document in documents]
+        average = sum(lengths) / len(lengths) if lengths else 0.0
+
+        # Терм -> (номера позиций, вклад терма в оценку каждой позиции)
+        postings: Dict[str, Tuple[list, list]] = defaultdict(lambda: ([], []))
+        for record_id, document in enumerate(documents):
+            for term, frequency in document.items():
+                postings[term][0].append(record_id)
+                postings[term][1].append(frequency)
+        self._postings = {}
+        for term, (ids, frequencies) in postings.items():
+            idf = math.log(1 + (len(records) - len(ids) + 0.5) / (len(ids) + 0.5))
+            weights = [
+                idf * frequency * (BM25_K1 + 1)
+                / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * lengths[record_id] / (average or 1)))
+                for record_id, frequency in zip(ids, frequencies)
+            ]
+            self._postings[term] = self._posting(ids, weights)
+        # Слово запроса, которого нет на складе, считается редким термом: запрос из общих слов
+        # с одним случайным совпадением не получает высокую оценку
+        self._unknown_weight = math.log(1 + (len(records) - 0.5) / 1.5) * (BM25_K1 + 1) / (1 + BM25_K1)
+
+        # Триграмма -> позиции, в которых она встречается
+        self._grams = {
+            gram: np.asarray(sorted(ids), dtype=np.int32) if self.use_numpy else sorted(ids)
+            for gram, ids in index.by_trigram.items()
+        }
+        logger.info(f"Поиск по складу для ассистента построен: {len(records)} позиций, "
+                    f"{len(self._postings)} термов, numpy: {'да' if self.use_numpy else 'нет'}")
+
+    def _posting(self, ids: list, weights: list):
+        if self.use_numpy:
+            return np.asarray(ids, dtype=np.int32), np.asarray(weights, dtype=np.float32)
+        return ids, weights
+
+    def scores(self, query: str):
+        """Возвращает оценки всех позиций: массив numpy или словарь номер -> оценка."""
+        terms = set(_terms(query))
+        term_postings = [self._postings[term] for term in terms if term in self._postings]
+        grams = _query_grams(query)
+        gram_postings = [self._grams[gram] for gram in grams if gram in self._grams]
+        if not term_postings and not gram_postings:
+            return {}
+
+        # Наибольшая возможная оценка BM25: каждый терм запроса с наибольшим вкладом
+        unknown = sum(1 for term in terms if term not in self._postings)
+        upper = sum(float(max(weights)) for _, weights in term_postings) + unknown * self._unknown_weight or 1.0
+        gram_weight = RETRIEVAL_NGRAM_WEIGHT / (len(grams) or 1)
+
+        if self.use_numpy:
+            scores = np.zeros(len(self.records), dtype=np.float32)
+            for ids, weights in term_postings:
+                scores[ids] += weights / upper
+            for ids in gram_postings:
+                scores[ids] += gram_weight
+            return scores
+
+        scores = defaultdict(float)
+        for ids, weights in term_postings:
+            for record_id, weight in zip(ids, weights):
+                scores[record_id] += weight / upper
+        for ids in gram_postings:
+            for record_id in ids:
+                scores[record_id] += gram_weight
+        return scores
+
+    def retrieve(self, query: str, k: int = RETRIEVAL_TOP_K, min_score: float = RETRIEVAL_MIN_SCORE) -> List[Tuple[dict, float]]:
+        """Возвращает до k лучших позиций с оценкой не ниже min_score."""
+        scores = self.scores(query)
+        if self.use_numpy and len(scores):
+            count = min(k, len(scores))
+            top = np.argpartition(-scores, count - 1)[:count]
+            ranked = sorted(((int(i), float(scores[i])) for i in top), key=lambda item: -item[1])
+        else:
+            ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1]) if len(scores) else []
+        return [(self.records[record_id], score) for record_id, score in ranked if score >= min_score]
+
+def format_context_record(record: dict) -> str:
+    """Позиция склада в одну строку: только заполненные поля, без служебных имен."""
+    place = clean(record.get('used_placement')) or clean(record.get('placement'))
+    parts = [
+        clean(record.get('equipment_group')),
+        clean(record.get('manufacturer')),
+        clean(record.get('specs')),
+        f"{clean(record.get('qty')) or '?'} шт.",
+        ', '.join(part for part in (clean(record.get('storage_location')), place) if part),
+        clean(record.get('new_placement')) and f"новое место: {clean(record.get('new_placement'))}",
+        clean(record.get('installation')) and f"для: {clean(record.get('installation'))}",
+        clean(record.get('nominal')) and f"SAP {clean(record.get('nominal'))}",
+        clean(record.get('notes')),
+    ]
+    return '- ' + '; '.join(part for part in parts if part)
+
+# Поиск строится при первом обращении и после обновления склада
+_retriever: Optional[HybridRetriever] = None
+
+def get_retriever() -> HybridRetriever:
+    """Возвращает поиск по складу для ассистента, строя его заново, когда перестроен индекс склада."""
+    global _retriever
+    from app.inventory.search import get_inventory
+    index = get_inventory()
+    if _retriever is None or _retriever.index is not index:
+        _retriever = HybridRetriever(index.records, index)
+    return _retriever
+
+def inventory_context(query: str) -> str:
+    """Возвращает подходящие к вопросу позиции склада в компактном виде или пустую строку."""
+    if not RETRIEVAL_ENABLED:
+        return ''
+    found = get_retriever().retrieve(query)
+    if not found:
+        return ''
+    return CONTEXT_HEADER + '\n' + '\n'.join(format_context_record(record) for record, _ in found)
@@ -0,0 +1,260 @@
+import os
+import re
+import json
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+import dotenv
+from loguru import logger
+from app.inventory.normalize import tokenize, compact, stem, ngrams, is_model_token
+from app.inventory.units import Quantity, parse_quantities, parse_constraints
+from app.inventory.store import STORE_SUFFIX, InventoryStore
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Путь к файлу со складскими остатками: storage.json или хранилище склада .inv
+INVENTORY_PATH = os.getenv('INVENTORY_PATH', 'knowledge/docs/storage.json')
+# Хранилище склада рядом с storage.json, которое собирает ingest_inventory.py. Если оно есть, склад
+# читается из него: так же поступает create_rag_index.py, и бот с поисковым индексом видят одни данные
+INVENTORY_STORE_PATH = os.path.splitext(INVENTORY_PATH)[0] + STORE_SUFFIX
+# Как часто проверять, не обновился ли файл склада, в секундах
+INVENTORY_CHECK_INTERVAL = float(os.getenv('INVENTORY_CHECK_INTERVAL', '10'))
+# Максимальное количество позиций, которое можно выдать без участия ассистента
+INVENTORY_MAX_DIRECT = int(os.getenv('INVENTORY_MAX_DIRECT', '5'))
+# Максимальное количество значимых слов в запросе, который еще считается поиском по складу
+INVENTORY_MAX_TERMS = 6
+
+# Поля, по которым строится полнотекстовый индекс
+TEXT_FIELDS = ('equipment_group', 'manufacturer', 'specs', 'installation')
+# Поля, в которых ищутся величины с единицами измерения
+QUANTITY_FIELDS = ('specs', 'manufacturer', 'installation')
+
+# Номенклатурный код: только цифры, не меньше пяти
+NOMINAL_RE = re.compile(r'(?<![\w.,-])\d{5,}(?![\w.,-])')
+
+# Слова, которые не несут смысла для поиска по складу
+STOP_WORDS = {
+    'а', 'и', 'или', 'в', 'во', 'на', 'с', 'со', 'по', 'под', 'для', 'из', 'от', 'к', 'у', 'о', 'об',
+    'есть', 'ли', 'ну', 'же', 'бы', 'то', 'это', 'этот', 'эта', 'еще',
+    'мне', 'нам', 'нас', 'вас', 'у', 'там', 'тут', 'где', 'какой', 'какая', 'какие', 'каких', 'какое',
+    'сколько', 'штук', 'шт', 'надо', 'нужен', 'нужна', 'нужно', 'нужны', 'хочу',
+    'найди', 'найти', 'поищи', 'покажи', 'подскажи', 'скажи', 'пожалуйста', 'плиз',
+    'лежит', 'лежат', 'имеется', 'имеются', 'наличии', 'склад', 'складе',
+}
+
+@dataclass
+class SearchResult:
+    """Результат поиска по складу."""
+    records: List[dict] = field(default_factory=list)
+    # True, если ответ можно выдать сразу, без обращения к ассистенту
+    unambiguous: bool = False
+    # Как был найден результат: nominal, model, group или пустая строка
+    reason: str = ''
+
+class InventoryIndex:
+    """Индекс складских позиций для быстрого поиска в памяти."""
+
+    def __init__(self, records: List[dict]):
+        self.records = records
+        # Точный индекс по номенклатурному коду
+        self.by_nominal: Dict[str, List[int]] = defaultdict(list)
+        # Инвертированный индекс: токен или основа слова -> номера позиций
+        self.by_token: Dict[str, Set[int]] = defaultdict(set)
+        self.by_stem: Dict[str, Set[int]] = defaultdict(set)
+        # Слова и основы слов из группы оборудования, чтобы понимать, что в запросе названа группа
+        self.group_tokens: Set[str] = set()
+        self.group_stems: Set[str] = set()
+        # Индекс триграмм для поиска кодов моделей по подстроке
+        self.by_trigram: Dict[str, Set[int]] = defaultdict(set)
+        self.compacts: List[str] = []
+        self.quantities: List[List[Quantity]] = []
+
+        for record_id, record in enumerate(records):
+            self._add(record_id, record)
+
+        logger.info(f"Индекс склада построен: {len(records)} позиций")
+
+    @classmethod
+    def from_file(cls, path: str = INVENTORY_PATH) -> 'InventoryIndex':
+        """Загружает позиции из хранилища склада или из JSON файла вида {"storage": [...]}."""
+        return cls(load_records(path))
+
+    def _add(self, record_id: int, record: dict):
+        """Добавляет позицию во все индексы."""
+        for code in NOMINAL_RE.findall(str(record.get('nominal') or '')):
+            self.by_nominal[code].append(record_id)
+
+        for field_name in TEXT_FIELDS:
+            value = record.get(field_name)
+            if not value:
+                continue
+            for token in tokenize(value):
+                self.by_token[token].add(record_id)
+                self.by_stem[stem(token)].add(record_id)
+                if field_name == 'equipment_group':
+                    self.group_tokens.add(token)
+                    self.group_stems.add(stem(token))
+
+        text = ' '.join(str(record.get(name) or '') for name in TEXT_FIELDS)
+        record_compact = compact(text)
+        self.compacts.append(record_compact)
+        for gram in ngrams(record_compact):
+            self.by_trigram[gram].add(record_id)
+
+        quantities = []
+        for field_name in QUANTITY_FIELDS:
+            quantities.extend(parse_quantities(record.get(field_name)))
+        self.quantities.append(quantities)
+
+    def match_model(self, token: str) -> Set[int]:
+        """Находит позиции, в которых встречается код модели или его часть."""
+        ids = set(self.by_token.get(token, ()))
+        if len(token) < 3:
+            return ids
+        candidates = None
+        for gram in ngrams(token):
+            posting = self.by_trigram.get(gram)
+            if not posting:
+                return ids
+            candidates = set(posting) if candidates is None else candidates & posting
+            if not candidates:
+                return ids
+        return ids | {record_id for record_id in candidates if token in self.compacts[record_id]}
+
+    def matches_constraints(self, record_id: int, constraints: List[Quantity]) -> bool:
+        """Проверяет, что позиция удовлетворяет всем ограничениям на величины."""
+        quantities = self.quantities[record_id]
+        return all(any(q.overlaps(c) for q in quantities) for c in constraints)
+
+    def search(self, query: str) -> SearchResult:
+        """Ищет позиции по запросу пользователя."""
+        # Номенклатурный код однозначно определяет позицию
+        codes = NOMINAL_RE.findall(query)
+        nominal_ids = sorted({record_id for code in codes for record_id in self.by_nominal.get(code, ())})
+        if nominal_ids:
+            return SearchResult(
+                records=[self.records[record_id] for record_id in nominal_ids],
+                unambiguous=len(nominal_ids) <= INVENTORY_MAX_DIRECT,
+                reason='nominal',
+            )
+
+        constraints, rest = parse_constraints(query)
+        terms = [token for token in tokenize(rest) if token not in STOP_WORDS]
+        if not terms or len(terms) > INVENTORY_MAX_TERMS:
+            return SearchResult()
+
+        candidates = None
+        has_model = has_group = False
+        for term in terms:
+            if is_model_token(term):
+                ids = self.match_model(term)
+                has_model = has_model or bool(ids)
+            else:
+                term_stem = stem(term)
+                # Точное название группы ("контактор") не должно цеплять соседние ("блок-контакт")
+                if term in self.group_tokens:
+                    ids = self.by_token[term]
+                else:
+                    ids = self.by_stem.get(term_stem, set())
+                has_group = has_group or term_stem in self.group_stems
+            # Каждое значимое слово запроса должно найтись, иначе это не поиск по складу
+            if not ids:
+                return SearchResult()
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return SearchResult()
+
+        record_ids = sorted(
+            record_id for record_id in candidates
+            if self.matches_constraints(record_id, constraints)
+        )
+        reason = 'model' if has_model else 'group' if has_group else ''
+        return SearchResult(
+            records=[self.records[record_id] for record_id in record_ids],
+            unambiguous=bool(record_ids) and bool(reason) and len(record_ids) <= INVENTORY_MAX_DIRECT,
+            reason=reason,
+        )
+
+def clean(value) -> str:
+    """Приводит значение поля к строке без лишних пробелов."""
+    return ' '.join(str(value).split()) if value is not None else ''
+
+def format_record(record: dict) -> str:
+    """Форматирует позицию склада для ответа в чат."""
+    title = ' '.join(part for part in (clean(record.get('equipment_group')), clean(record.get('manufacturer'))) if part)
+    specs = clean(record.get('specs'))
+    lines = [f"• {title}" + (f" — {specs}" if specs else '')]
+
+    lines.append(f"  Количество: {clean(record.get('qty')) or '?'} шт.")
+
+    place = clean(record.get('used_placement')) or clean(record.get('placement'))
+    location = ', '.join(part for part in (clean(record.get('storage_location')), place) if part)
+    if location:
+        lines.append(f"  Где лежит: {location}")
+    if record.get('new_placement'):
+        lines.append(f"  Новое место: {clean(record.get('new_placement'))}")
+    if record.get('installation'):
+        lines.append(f"  Для чего: {clean(record.get('installation'))}")
+    if record.get('nominal'):
+        lines.append(f"  Код SAP: {clean(record.get('nominal'))}")
+    if record.get('notes'):
+        lines.append(f"  Примечание: {clean(record.get('notes'))}")
+    return '\n'.join(lines)
+
+def format_records(records: List[dict]) -> str:
+    """Форматирует список позиций склада для ответа в чат."""
+    header = "Нашла на складе:" if len(records) > 1 else "Нашла на складе, держи:"
+    return header + '\n\n' + '\n\n'.join(format_record(record) for record in records)
+
+# Индекс загружается при первом обращении и перестраивается, когда файл склада меняется
+_index: Optional[InventoryIndex] = None
+_index_mtime = None
+_checked_at = 0.0
+
+def inventory_source() -> str:
+    """Возвращает файл, из которого берется склад: хранилище .inv, если оно есть, иначе INVENTORY_PATH."""
+    if os.path.exists(INVENTORY_STORE_PATH):
+        return INVENTORY_STORE_PATH
+    return INVENTORY_PATH
+
+def load_records(path: str) -> List[dict]:
+    """Читает позиции из хранилища склада или из JSON файла вида {"storage": [...]}."""
+    if path.endswith(STORE_SUFFIX):
+        return InventoryStore.load(path).records()
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return data.get('storage', [])
+
+def _file_mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def get_inventory() -> InventoryIndex:
+    """Возвращает индекс склада, загружая его при первом обращении и после обновления файла."""
+    global _index, _index_mtime, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < INVENTORY_CHECK_INTERVAL:
+        return _index
+    _checked_at = now
+
+    source = inventory_source()
+    mtime = (source, _file_mtime(source))
+    if _index is None or mtime != _index_mtime:
+        if _index is not None:
+            logger.info(f"Файл склада {source} обновился, индекс перестраивается")
+        try:
+            _index = InventoryIndex.from_file(source)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить склад из {source}: {e}")
+            if _index is None:
+                _index = InventoryIndex([])
+        _index_mtime = mtime
+    return _index
+
+def search_inventory(query: str) -> SearchResult:
+    """Ищет позиции на складе по запросу пользователя."""
+    return get_inventory().search(query)
@@ -0,0 +1,176 @@
+import os
+import struct
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Расширение файла хранилища склада
+STORE_SUFFIX = '.inv'
+
+MAGIC = b'INVSTOR1'
+HEADER = struct.Struct('<8sIII')
+# Пустое значение в строковой колонке - строка с номером 0, в числовой - наименьшее int32
+NONE_INT = -2 ** 31
+
+# Поля позиции склада и их типы: s - строка, i - целое
+FIELDS = (
+    ('equipment_group', 's'),
+    ('manufacturer', 's'),
+    ('specs', 's'),
+    ('nominal', 's'),
+    ('qty', 'i'),
+    ('storage_location', 's'),
+    ('placement', 's'),
+    ('used_placement', 's'),
+    ('new_placement', 's'),
+    ('installation', 's'),
+    ('notes', 's'),
+)
+
+# Поля, которые определяют позицию; по ним сравниваются версии склада
+IDENTITY_FIELDS = ('equipment_group', 'manufacturer', 'specs', 'nominal', 'storage_location')
+
+def _pad(data: bytes) -> bytes:
+    """Дополняет нулями до границы 4 байт, чтобы колонки читались без копирования."""
+    return data + b'\0' * (-len(data) % 4)
+
+class StoreWriter:
+    """Собирает позиции склада по колонкам; одинаковые строки хранятся один раз."""
+
+    def __init__(self, fields: Tuple[Tuple[str, str], ...] = FIELDS):
+        self.fields = fields
+        self.count = 0
+        self._strings: Dict[str, int] = {'': 0}
+        self._columns = {name: array('I' if kind == 's' else 'i') for name, kind in fields}
+
+    def _intern(self, value: str) -> int:
+        string_id = self._strings.get(value)
+        if string_id is None:
+            string_id = self._strings[value] = len(self._strings)
+        return string_id
+
+    def add(self, record: dict):
+        """Добавляет позицию; значения уже должны быть нормализованы."""
+        for name, kind in self.fields:
+            value = record.get(name)
+            if kind == 's':
+                self._columns[name].append(0 if value is None else self._intern(str(value)))
+            else:
+                self._columns[name].append(NONE_INT if value is None else int(value))
+        self.count += 1
+
+    def to_bytes(self) -> bytes:
+        """Сериализует хранилище."""
+        names = [self._intern(name) for name, _ in self.fields]
+        blobs = [value.encode('utf-8') for value in self._strings]
+        offsets = array('I', [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+
+        parts = [
+            HEADER.pack(MAGIC, self.count, len(self.fields), len(blobs)),
+            offsets.tobytes(),
+            _pad(b''.join(blobs)),
+            array('I', names).tobytes(),
+            _pad(''.join(kind for _, kind in self.fields).encode('ascii')),
+        ]
+        parts.extend(self._columns[name].tobytes() for name, _ in self.fields)
+        return b''.join(parts)
+
+    def write(self, path: str):
+        """Записывает хранилище атомарно: бот, читающий файл, не увидит его наполовину записанным."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(self.to_bytes())
+        os.replace(temp_path, path)
+
+class InventoryStore:
+    """Склад, загруженный из колоночного файла. Колонки читаются из буфера файла без копирования."""
+
+    def __init__(self, data: bytes):
+        magic, count, field_count, string_count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Файл не является хранилищем склада")
+        view = memoryview(data)
+        position = HEADER.size
+
+        offsets = view[position:position + 4 * (string_count + 1)].cast('I')
+        position += 4 * (string_count + 1)
+        blob = bytes(view[position:position + offsets[-1]])
+        position += offsets[-1] + (-offsets[-1] % 4)
+        # Каждая строка декодируется один раз, все позиции ссылаются на один объект
+        self.strings: List[Optional[str]] = [None] + [
+            blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(1, string_count)
+        ]
+
+        names = view[position:position + 4 * field_count].cast('I')
+        position += 4 * field_count
+        kinds = bytes(view[position:position + field_count]).decode('ascii')
+        position += field_count + (-field_count % 4)
+
+        self.count = count
+        self.fields = tuple((self.strings[name_id], kind) for name_id, kind in zip(names, kinds))
+        self.columns = {}
+        for name, kind in self.fields:
+            self.columns[name] = view[position:position + 4 * count].cast('I' if kind == 's' else 'i')
+            position += 4 * count
+
+    @classmethod
+    def load(cls, path: str) -> 'InventoryStore':
+        """Загружает хранилище из файла."""
+        with open(path, 'rb') as file:
+            return cls(file.read())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def value(self, name: str, index: int):
+        """Значение поля позиции."""
+        kind = dict(self.fields)[name]
+        raw = self.columns[name][index]
+        if kind == 's':
+            return self.strings[raw]
+        return None if raw == NONE_INT else raw
+
+    def records(self) -> List[dict]:
+        """Все позиции в виде словарей, как в storage.json."""
+        columns = []
+        for name, kind in self.fields:
+            raw = self.columns[name].tolist()
+            if kind == 's':
+                strings = self.strings
+                columns.append((name, [strings[value] for value in raw]))
+            else:
+                columns.append((name, [None if value == NONE_INT else value for value in raw]))
+        return [{name: values[index] for name, values in columns} for index in range(self.count)]
+
+def identity_key(record: dict) -> Tuple[str, ...]:
+    """Ключ позиции для сравнения версий склада."""
+    return tuple(' '.join(str(record.get(name) or '').split()).lower() for name in IDENTITY_FIELDS)
+
+def diff_records(old: Iterable[dict], new: Iterable[dict]) -> List[dict]:
+    """Сравнивает две версии склада по ключам позиций.
+
+    Возвращает изменения вида {"op": "added" | "removed" | "changed", "key": [...], "record": ..., "previous": ...}.
+    Одинаковые позиции нумеруются по порядку, чтобы дубликаты не сливались.
+    """
+    def keyed(records: Iterable[dict]) -> Dict[tuple, dict]:
+        result, seen = {}, {}
+        for record in records:
+            key = identity_key(record)
+            number = seen[key] = seen.get(key, -1) + 1
+            result[key + ((str(number),) if number else ())] = record
+        return result
+
+    before, after = keyed(old), keyed(new)
+    changes = []
+    for key, record in after.items():
+        previous = before.get(key)
+        if previous is None:
+            changes.append({'op': 'added', 'key': list(key), 'record': record})
+        elif previous != record:
+            changes.append({'op': 'changed', 'key': list(key), 'record': record, 'previous': previous})
+    for key, record in before.items():
+        if key not in after:
+            changes.append({'op': 'removed', 'key': list(key), 'previous': record})
+    return changes
@@ -0,0 +1,132 @@
+import re
+import math
+from typing import List, NamedTuple, Optional, Tuple
+
+# Единицы измерения: написание -> (каноническая единица, множитель)
+UNITS = {
+    'квт': ('kW', 1.0), 'kw': ('kW', 1.0),
+    'вт': ('kW', 0.001), 'w': ('kW', 0.001),
+    'мкф': ('uF', 1.0), 'uf': ('uF', 1.0),
+    'ма': ('A', 0.001), 'ma': ('A', 0.001),
+    'а': ('A', 1.0), 'a': ('A', 1.0),
+    'кв': ('V', 1000.0), 'kv': ('V', 1000.0),
+    'мв': ('V', 0.001), 'mv': ('V', 0.001),
+    'в': ('V', 1.0), 'v': ('V', 1.0),
+    'ф': ('ph', 1.0), 'ph': ('ph', 1.0),
+}
+
+# Однобуквенные единицы в нижнем регистре, которые легко спутать с предлогами ("2 в наличии")
+AMBIGUOUS_LOWER = {'а', 'a', 'в', 'v'}
+
+NUM = r'\d+(?:[.,]\d+)?'
+UNIT = r'квт|kw|мкф|uf|ма|ma|мв|mv|кв|kv|вт|w|ф|ph|а|a|в|v'
+BOUNDARY_BEFORE = r'(?<![0-9a-zA-Zа-яА-ЯёЁ.,])'
+BOUNDARY_AFTER = r'(?![a-zA-Zа-яА-ЯёЁ])'
+
+QUANTITY_RE = re.compile(
+    rf'{BOUNDARY_BEFORE}(?P<lo>{NUM})(?:\s*[-–]\s*(?P<hi>{NUM}))?(?P<sep>\s?-?\s?)(?P<unit>{UNIT}){BOUNDARY_AFTER}',
+    re.IGNORECASE,
+)
+FROM_TO_RE = re.compile(
+    rf'от\s*(?P<lo>{NUM})\s*(?:{UNIT})?\s*до\s*(?P<hi>{NUM})(?P<sep>\s?)(?P<unit>{UNIT}){BOUNDARY_AFTER}',
+    re.IGNORECASE,
+)
+QUALIFIER_RE = re.compile(
+    r'(?<![а-яёa-z])(?P<op>не\s+более|не\s+менее|не\s+больше|не\s+меньше|больше|меньше|более|менее|свыше|до|от|<=|>=|<|>|≤|≥)\s*$',
+    re.IGNORECASE,
+)
+
+# Единицы, написанные словами: "2 ампера", "380 вольт", "3 фазы"
+UNIT_WORDS_RE = re.compile(r'(?P<num>\d)\s*(?P<word>киловатт|ватт|ампер|вольт|фаз)[а-яё]*', re.IGNORECASE)
+UNIT_WORDS = {'киловатт': 'кВт', 'ватт': 'Вт', 'ампер': 'А', 'вольт': 'В', 'фаз': 'ф'}
+
+UPPER_OPS = {'не более', 'не больше', 'меньше', 'менее', 'до', '<=', '<', '≤'}
+LOWER_OPS = {'не менее', 'не меньше', 'больше', 'более', 'свыше', 'от', '>=', '>', '≥'}
+
+class Quantity(NamedTuple):
+    """Значение или диапазон значений в канонической единице."""
+    unit: str
+    lo: float
+    hi: float
+
+    def overlaps(self, other: 'Quantity') -> bool:
+        """Проверяет, пересекаются ли диапазоны с учетом погрешности."""
+        eps = 1e-9 * max(1.0, self.lo, other.lo)
+        return self.unit == other.unit and self.lo <= other.hi + eps and other.lo <= self.hi + eps
+
+def _to_float(value: str) -> float:
+    return float(value.replace(',', '.'))
+
+def _unit(raw: str, sep: str) -> Optional[Tuple[str, float]]:
+    """Возвращает каноническую единицу или None, если написание похоже на предлог."""
+    if raw in AMBIGUOUS_LOWER and ' ' in sep:
+        return None
+    return UNITS.get(raw.lower())
+
+def expand_unit_words(text: str) -> str:
+    """Заменяет единицы, написанные словами, на сокращения: "2 ампера" -> "2А"."""
+    return UNIT_WORDS_RE.sub(lambda m: m.group('num') + UNIT_WORDS[m.group('word').lower()], text)
+
+def parse_quantities(text: Optional[str]) -> List[Quantity]:
+    """Извлекает из текста все величины с единицами измерения: "6-15А/500V" -> [6..15 A, 500 V]."""
+    if not text:
+        return []
+    quantities = []
+    for match in QUANTITY_RE.finditer(str(text)):
+        unit = _unit(match.group('unit'), match.group('sep'))
+        if unit is None:
+            continue
+        name, factor = unit
+        lo = _to_float(match.group('lo')) * factor
+        hi = _to_float(match.group('hi')) * factor if match.group('hi') else lo
+        quantities.append(Quantity(name, min(lo, hi), max(lo, hi)))
+    return quantities
+
+def parse_constraints(query: str) -> Tuple[List[Quantity], str]:
+    """Извлекает из запроса ограничения на величины и возвращает их вместе с остатком запроса.
+
+    Поддерживаются точные значения ("2А"), диапазоны ("от 10 до 25А", "10-25А")
+    и односторонние границы ("до 25А", "больше 10А").
+    """
+    query = expand_unit_words(query)
+    constraints = []
+    spans = []
+
+    for match in FROM_TO_RE.finditer(query):
+        unit = _unit(match.group('unit'), match.group('sep'))
+        if unit is None:
+            continue
+        name, factor = unit
+        lo, hi = _to_float(match.group('lo')) * factor, _to_float(match.group('hi')) * factor
+        constraints.append(Quantity(name, min(lo, hi), max(lo, hi)))
+        spans.append(match.span())
+
+    for match in QUANTITY_RE.finditer(query):
+        if any(start <= match.start() < end for start, end in spans):
+            continue
+        unit = _unit(match.group('unit'), match.group('sep'))
+        if unit is None:
+            continue
+        name, factor = unit
+        lo = _to_float(match.group('lo')) * factor
+        hi = _to_float(match.group('hi')) * factor if match.group('hi') else lo
+        start = match.start()
+
+        # Ищем перед числом уточнение вида "до", "больше", ">"
+        qualifier = QUALIFIER_RE.search(query[:start])
+        if qualifier and not match.group('hi'):
+            op = ' '.join(qualifier.group('op').lower().split())
+            if op in UPPER_OPS:
+                lo, hi = 0.0, hi
+            elif op in LOWER_OPS:
+                lo, hi = lo, math.inf
+            start = qualifier.start()
+
+        constraints.append(Quantity(name, min(lo, hi), max(lo, hi)))
+        spans.append((start, match.end()))
+
+    # Вырезаем найденные фрагменты из запроса
+    rest = query
+    for start, end in sorted(spans, reverse=True):
+        rest = rest[:start] + ' ' + rest[end:]
+    return constraints, ' '.join(rest.split())
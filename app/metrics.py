@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import contextlib
+import functools
+from typing import Dict, Tuple
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Этап дольше этого порога в секундах пишется в лог предупреждением
+SLOW_SPAN_THRESHOLD = float(os.getenv('SLOW_SPAN_THRESHOLD', '10'))
+# Как часто измерять задержку цикла событий
+LOOP_LAG_INTERVAL = 0.5
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Метрика с необязательными метками в формате Prometheus."""
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value:g}"]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Счетчики по корзинам, сумма и количество наблюдений
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _render_value(self, key, state) -> list:
+        lines = []
+        for bound, count in zip(self.buckets, state[0]):
+            labels = _format_labels(self.label_names, key, 'le="%g"' % bound)
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.label_names, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {state[2]}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {state[1]:g}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state[2]}")
+        return lines
+
+class Registry:
+    """Набор метрик приложения."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Добавляет функцию, которая обновляет метрики перед каждой выдачей."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'tgbot_stage_duration_seconds', "Длительность этапов обработки сообщения", ('stage',)))
+ERRORS = registry.register(Counter('tgbot_errors_total', "Ошибки по этапам", ('stage',)))
+RETRIES = registry.register(Counter('tgbot_retries_total', "Повторные запросы", ('target',)))
+HEDGES = registry.register(Counter('tgbot_hedged_requests_total', "Дублирующие запросы после задержки", ('target',)))
+CIRCUIT_OPEN = registry.register(Gauge('tgbot_circuit_open', "Разомкнут ли предохранитель сервиса", ('target',)))
+FALLBACKS = registry.register(Counter('tgbot_fallbacks_total', "Ответы без ассистента после его ошибки", ('source',)))
+CACHE_REQUESTS = registry.register(Counter(
+    'tgbot_cache_requests_total', "Обращения к кэшам", ('cache', 'result')))
+MESSAGES = registry.register(Counter('tgbot_messages_total', "Обработанные сообщения", ('kind',)))
+LOOP_LAG = registry.register(Gauge('tgbot_event_loop_lag_seconds', "Задержка цикла событий"))
+COMPONENT_STATS = registry.register(Gauge(
+    'tgbot_component_stat', "Состояние компонентов: кэши, объединение запросов, планировщик", ('component', 'stat')))
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Измеряет длительность этапа и учитывает ошибки этапа."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage)
+        if duration > SLOW_SPAN_THRESHOLD:
+            logger.warning(f"Медленный этап {stage}: {duration:.2f} с")
+
+def timed(stage: str):
+    """Декоратор: измеряет длительность асинхронной функции как этапа stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Фоновая задача: измеряет, насколько позже запланированного просыпается цикл событий."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.set(max(0.0, loop.time() - expected))
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Optional
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Разрешено ли включать профилировщик через HTTP
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'False') == 'True'
+# Интервал между снимками стека в секундах и максимальная длительность профилирования
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))
+PROFILER_MAX_SECONDS = 60.0
+
+class SamplingProfiler:
+    """Семплирующий профилировщик: в отдельном потоке периодически снимает стек основного потока.
+
+    Цикл событий работает в основном потоке, поэтому частые стеки показывают, чем он занят,
+    когда запросы обрабатываются медленно. Результат - свернутые стеки в формате flamegraph.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = False
+
+    def profile(self, seconds: float, thread_id: Optional[int] = None) -> str:
+        """Снимает стеки в течение seconds секунд и возвращает их в свернутом виде. Блокирует вызывающий поток."""
+        with self._lock:
+            if self._running:
+                raise RuntimeError("Профилировщик уже запущен")
+            self._running = True
+        try:
+            return self._collect(min(seconds, PROFILER_MAX_SECONDS), thread_id or threading.main_thread().ident)
+        finally:
+            self._running = False
+
+    def _collect(self, seconds: float, thread_id: int) -> str:
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                stacks[';'.join(reversed(names))] += 1
+            time.sleep(self.interval)
+
+        total = sum(stacks.values())
+        logger.info(f"Профилирование завершено: {total} снимков за {seconds:g} с")
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()) + '\n'
+
+# Общий профилировщик приложения
+profiler = SamplingProfiler()
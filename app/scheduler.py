@@ -0,0 +1,72 @@
+import os
+import asyncio
+import contextlib
+import dotenv
+from loguru import logger
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Сколько вопросов одного чата может ждать своей очереди
+CHAT_QUEUE_LIMIT = int(os.getenv('CHAT_QUEUE_LIMIT', '3'))
+# Сколько генераций всего может выполняться и ждать, после этого новые вопросы отклоняются
+SCHEDULER_MAX_PENDING = int(os.getenv('SCHEDULER_MAX_PENDING', '64'))
+
+class SchedulerOverloaded(Exception):
+    """Очередь переполнена, вопрос не принят."""
+
+class ChatScheduler:
+    """Выполняет длинные генерации по одной на чат в порядке поступления и ограничивает общую очередь.
+
+    Дешевые команды и ответы из кэша идут мимо планировщика и не ждут генераций.
+    """
+
+    def __init__(self, chat_limit: int = CHAT_QUEUE_LIMIT, max_pending: int = SCHEDULER_MAX_PENDING):
+        self.chat_limit = chat_limit
+        self.max_pending = max_pending
+        # chat_id -> [замок, количество вопросов в работе и в очереди]
+        self._chats = {}
+        self.pending = 0
+        self.rejected = 0
+
+    def queued(self, chat_id) -> int:
+        """Количество вопросов чата в работе и в очереди."""
+        entry = self._chats.get(chat_id)
+        return entry[1] if entry else 0
+
+    @contextlib.asynccontextmanager
+    async def turn(self, chat_id, on_wait=None):
+        """Ждет очереди чата. Если перед вопросом есть другие, один раз вызывает on_wait().
+
+        При переполнении очереди чата или общей очереди выбрасывает SchedulerOverloaded.
+        """
+        if self.queued(chat_id) >= self.chat_limit or self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Очередь переполнена, вопрос чата {chat_id} отклонен (всего в работе: {self.pending})")
+            raise SchedulerOverloaded()
+
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.pending += 1
+        try:
+            if entry[0].locked() and on_wait is not None:
+                await on_wait()
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            self.pending -= 1
+            # Замок простаивающего чата больше не нужен
+            if entry[1] == 0:
+                self._chats.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        """Возвращает состояние очередей."""
+        return {
+            'pending': self.pending,
+            'chats': len(self._chats),
+            'rejected': self.rejected,
+        }
+
+# Общий планировщик генераций
+chat_scheduler = ChatScheduler()
@@ -0,0 +1,117 @@
+import os
+import asyncio
+import contextlib
+import dotenv
+from loguru import logger
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Минимальный интервал между правками сообщения в секундах, чтобы не упираться в лимиты Telegram
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.2'))
+# Как часто повторять статус "печатает", Telegram показывает его около 5 секунд
+TYPING_INTERVAL = 4.0
+# Максимальная длина одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Текст, который показывается сразу и до прихода первых слов ответа
+PLACEHOLDER = '…'
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Делит длинный текст на части не длиннее limit, по возможности по границе абзаца или строки."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(' ', 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+@contextlib.asynccontextmanager
+async def keep_typing(bot, chat_id: int):
+    """Показывает статус "печатает", пока выполняется блок."""
+    async def _loop():
+        while True:
+            with contextlib.suppress(Exception):
+                await bot.send_chat_action(chat_id=chat_id, action='typing')
+            await asyncio.sleep(TYPING_INTERVAL)
+
+    task = asyncio.create_task(_loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+class StreamingReply:
+    """Ответ, который дописывается правками одного сообщения по мере генерации текста."""
+
+    def __init__(self, message: Message, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._reply = None
+        self._shown = ''
+        self._edited_at = 0.0
+
+    async def _edit(self, text: str):
+        """Правит сообщение, пропуская повторы и соблюдая RetryAfter от Telegram."""
+        if text == self._shown:
+            return
+        try:
+            await self._reply.edit_text(text)
+        except RetryAfter as e:
+            # Промежуточную правку просто пропускаем, следующая принесет более полный текст
+            logger.debug(f"Telegram просит подождать {e.retry_after} с перед правкой сообщения")
+            self._edited_at = asyncio.get_running_loop().time() + float(e.retry_after)
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+        self._shown = text
+        self._edited_at = asyncio.get_running_loop().time()
+
+    async def start(self):
+        """Сразу отправляет заглушку, чтобы пользователь видел ответ, не дожидаясь первых слов."""
+        if self._reply is None:
+            self._reply = await self.message.reply_text(PLACEHOLDER)
+            self._shown = PLACEHOLDER
+            self._edited_at = asyncio.get_running_loop().time()
+
+    async def update(self, text: str):
+        """Показывает накопленный текст, если с прошлой правки прошло достаточно времени."""
+        if not text.strip():
+            return
+        if self._reply is None:
+            self._reply = await self.message.reply_text(text[:MESSAGE_LIMIT])
+            self._shown = text[:MESSAGE_LIMIT]
+            self._edited_at = asyncio.get_running_loop().time()
+            return
+        # Заглушку заменяем первыми словами сразу, дальше правим не чаще interval
+        if self._shown != PLACEHOLDER and asyncio.get_running_loop().time() - self._edited_at < self.interval:
+            return
+        await self._edit(text[:MESSAGE_LIMIT])
+
+    async def finish(self, text: str):
+        """Показывает окончательный текст; если он длиннее лимита, остаток отправляется отдельными сообщениями."""
+        parts = split_text(text) or [PLACEHOLDER]
+        if self._reply is None:
+            self._reply = await self.message.reply_text(parts[0])
+            self._shown = parts[0]
+        else:
+            delay = self._edited_at - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(parts[0])
+            if self._shown != parts[0]:
+                # Последнюю правку Telegram не принял: повторяем ее после паузы
+                await asyncio.sleep(self.interval)
+                await self._edit(parts[0])
+        for part in parts[1:]:
+            await self.message.reply_text(part)
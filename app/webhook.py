@@ -0,0 +1,112 @@
+import os
+import hmac
+import json
+import asyncio
+from typing import Optional
+import dotenv
+from loguru import logger
+from telegram import Update
+from telegram.ext import Application
+from app.http_server import HttpServer, Request, Response
+from app.metrics import registry
+from app.profiler import profiler, PROFILER_ENABLED
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Адрес и порт HTTP-сервера бота: проверка здоровья и метрики в любом режиме, вебхук - в режиме webhook
+SERVER_LISTEN = os.getenv('SERVER_LISTEN', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '5000'))
+# Публичный адрес, на который Telegram отправляет обновления, например https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token; обязателен в режиме вебхука.
+# Общий для всех реплик, поэтому задается в окружении, а не генерируется при старте
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Регистрировать ли вебхук в Telegram при старте; среди нескольких реплик это делает одна
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', 'True') == 'True'
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+class TelegramWebhook:
+    """Прием обновлений Telegram.
+
+    Обновление сразу подтверждается и ставится в очередь приложения, обработчики выполняются в фоне.
+    """
+
+    def __init__(self, application: Application, path: str = WEBHOOK_PATH, secret: Optional[str] = WEBHOOK_SECRET):
+        if not secret:
+            # Без секрета любой POST на адрес вебхука был бы принят как обновление Telegram
+            raise RuntimeError("Для режима вебхука нужно задать WEBHOOK_SECRET")
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self.received = 0
+        self.rejected = 0
+
+    async def register(self):
+        """Регистрирует вебхук в Telegram, если это поручено этой реплике."""
+        if not WEBHOOK_REGISTER:
+            return
+        if not WEBHOOK_URL:
+            raise RuntimeError("Для режима вебхука нужно задать WEBHOOK_URL")
+        await self.application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + self.path,
+            secret_token=self.secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Вебхук зарегистрирован в Telegram")
+
+    async def handle(self, request: Request) -> Response:
+        """Проверяет секрет и ставит обновление в очередь приложения."""
+        secret = request.headers.get(SECRET_HEADER, '').encode('latin-1')
+        if not hmac.compare_digest(secret, self.secret.encode()):
+            self.rejected += 1
+            logger.warning("Запрос к вебхуку с неверным секретом отклонен")
+            return Response(403)
+
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except ValueError:
+            return Response(400)
+
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+def create_http_server(application: Application, webhook: Optional[TelegramWebhook] = None,
+                       listen: str = SERVER_LISTEN, port: int = SERVER_PORT) -> HttpServer:
+    """Собирает HTTP-сервер бота: /health, /metrics, профилировщик и, в режиме вебхука, прием обновлений."""
+    server = HttpServer(listen, port)
+
+    async def health(request: Request) -> Response:
+        data = {
+            'status': 'ok' if application.running else 'starting',
+            'queued_updates': application.update_queue.qsize(),
+        }
+        if webhook is not None:
+            data.update(received=webhook.received, rejected=webhook.rejected)
+        return Response(200, json.dumps(data).encode())
+
+    async def metrics(request: Request) -> Response:
+        return Response(200, registry.render().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    async def profile(request: Request) -> Response:
+        # Стеки снимаются из отдельного потока, цикл событий продолжает работать
+        try:
+            seconds = float(request.query.get('seconds', ['10'])[0])
+        except ValueError:
+            return Response(400)
+        try:
+            stacks = await asyncio.to_thread(profiler.profile, seconds)
+        except RuntimeError as e:
+            return Response(409, str(e).encode(), 'text/plain; charset=utf-8')
+        return Response(200, stacks.encode(), 'text/plain; charset=utf-8')
+
+    server.route('GET', '/health', health)
+    server.route('GET', '/metrics', metrics)
+    if PROFILER_ENABLED:
+        server.route('GET', '/debug/profile', profile)
+    if webhook is not None:
+        server.route('POST', webhook.path, webhook.handle)
+    return server
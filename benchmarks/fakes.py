@@ -0,0 +1,197 @@
+"""Подделки Telegram Bot API и Yandex Cloud ML SDK для нагрузочных прогонов без сети и токенов."""
+import math
+import time
+import random
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from telegram import Bot
+
+@dataclass
+class Latency:
+    """Логнормальное распределение задержки: медиана и разброс sigma, в секундах."""
+    median: float
+    sigma: float = 0.5
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    async def wait(self):
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+    @classmethod
+    def parse(cls, text: str) -> 'Latency':
+        """Разбирает "медиана[:sigma]", например "0.8:0.4"."""
+        median, _, sigma = text.partition(':')
+        return cls(float(median), float(sigma) if sigma else 0.5)
+
+@dataclass
+class FakeLatencies:
+    """Задержки подделанных сервисов."""
+    telegram: Latency = field(default_factory=lambda: Latency(0.05, 0.3))
+    thread_op: Latency = field(default_factory=lambda: Latency(0.03, 0.3))
+    run: Latency = field(default_factory=lambda: Latency(2.0, 0.5))
+    search_api: Latency = field(default_factory=lambda: Latency(1.5, 0.5))
+    # Количество частичных сообщений при потоковом ответе
+    stream_chunks: int = 8
+    # Доля запусков ассистента, которые зависают и не отвечают
+    run_hang: float = 0.0
+
+class FakeBot(Bot):
+    """Bot, у которого вместо HTTP-запросов к Telegram - задержка и правдоподобный ответ."""
+
+    def __init__(self, latency: Latency):
+        super().__init__('123456:fake-token')
+        # Объекты telegram после создания заморожены
+        with self._unfrozen():
+            self.latency = latency
+            self.calls = {}
+            self._message_ids = itertools.count(1000)
+            # Время отправки первого ответа и последней правки по chat_id
+            self.first_reply = {}
+            self.last_reply = {}
+
+    async def _do_post(self, endpoint: str, data: dict, **kwargs):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        await self.latency.wait()
+        chat_id = data.get('chat_id')
+        if endpoint in ('sendMessage', 'editMessageText'):
+            now = time.perf_counter()
+            self.first_reply.setdefault(chat_id, now)
+            self.last_reply[chat_id] = now
+            return {
+                'message_id': data.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+        return True
+
+class FakeThread:
+    def __init__(self, sdk: 'FakeSDK', thread_id: str):
+        self.sdk = sdk
+        self.id = thread_id
+        self.messages = []
+
+    async def write(self, content, labels=None):
+        self.sdk.count('thread.write')
+        await self.sdk.latencies.thread_op.wait()
+        role = (labels or {}).get('role', 'user')
+        self.messages.append(SimpleNamespace(
+            text=content, parts=(content,), labels=labels, author=SimpleNamespace(role=role.upper()),
+            created_at=time.time(),
+        ))
+
+    async def delete(self):
+        self.sdk.count('thread.delete')
+        await self.sdk.latencies.thread_op.wait()
+        self.sdk.threads_by_id.pop(self.id, None)
+
+    async def read(self):
+        self.sdk.count('thread.read')
+        await self.sdk.latencies.thread_op.wait()
+        for message in list(self.messages):
+            yield message
+
+class FakeThreads:
+    def __init__(self, sdk: 'FakeSDK'):
+        self.sdk = sdk
+        self._ids = itertools.count(1)
+
+    async def create(self, **kwargs):
+        self.sdk.count('threads.create')
+        await self.sdk.latencies.thread_op.wait()
+        thread = FakeThread(self.sdk, f"fake-thread-{next(self._ids)}")
+        self.sdk.threads_by_id[thread.id] = thread
+        return thread
+
+    async def get(self, thread_id: str):
+        self.sdk.count('threads.get')
+        await self.sdk.latencies.thread_op.wait()
+        return self.sdk.threads_by_id.setdefault(thread_id, FakeThread(self.sdk, thread_id))
+
+def fake_answer(question: str) -> str:
+    return f"Ответ на вопрос «{question}». " + "Подробности из документации. " * 20
+
+class FakeStreamEvent:
+    def __init__(self, text: str, final: bool):
+        self.text = text
+        self.error = None
+        self.is_failed = False
+        self.is_running = not final
+        self.is_succeeded = final
+
+class FakeRun:
+    def __init__(self, sdk: 'FakeSDK', thread: FakeThread):
+        self.sdk = sdk
+        self.thread = thread
+
+    def _answer(self) -> str:
+        question = self.thread.messages[-1].text if self.thread.messages else ''
+        return fake_answer(question)
+
+    async def _maybe_hang(self):
+        if random.random() < self.sdk.latencies.run_hang:
+            self.sdk.count('assistant.hung')
+            await asyncio.Event().wait()
+
+    async def wait(self, poll_interval: float = 0.5):
+        await self._maybe_hang()
+        await self.sdk.latencies.run.wait()
+        answer = self._answer()
+        await self.thread.write(answer, labels={'role': 'assistant'})
+        return SimpleNamespace(message=SimpleNamespace(parts=(answer,), text=answer))
+
+    async def __aiter__(self):
+        await self._maybe_hang()
+        answer = self._answer()
+        chunks = max(self.sdk.latencies.stream_chunks, 1)
+        total = self.sdk.latencies.run.sample()
+        for number in range(1, chunks + 1):
+            await asyncio.sleep(total / chunks)
+            yield FakeStreamEvent(answer[:len(answer) * number // chunks], number == chunks)
+        await self.thread.write(answer, labels={'role': 'assistant'})
+
+class FakeAssistant:
+    def __init__(self, sdk: 'FakeSDK'):
+        self.sdk = sdk
+        self.id = 'fake-assistant'
+
+    async def run(self, thread: FakeThread):
+        self.sdk.count('assistant.run')
+        return FakeRun(self.sdk, thread)
+
+    async def run_stream(self, thread: FakeThread):
+        self.sdk.count('assistant.run_stream')
+        return FakeRun(self.sdk, thread)
+
+class FakeCompletions:
+    def __init__(self, sdk: 'FakeSDK'):
+        self.sdk = sdk
+
+    def configure(self, **kwargs):
+        return self
+
+    async def run(self, messages):
+        self.sdk.count('completions.run')
+        await self.sdk.latencies.run.wait()
+        return SimpleNamespace(alternatives=[SimpleNamespace(text="Пользователь спрашивал про оборудование.")])
+
+class FakeSDK:
+    """Подделка AsyncYCloudML с потоками, ассистентом и моделями."""
+
+    def __init__(self, latencies: FakeLatencies):
+        self.latencies = latencies
+        self.calls = {}
+        self.threads_by_id = {}
+        self.threads = FakeThreads(self)
+        self.assistant = FakeAssistant(self)
+        self.models = SimpleNamespace(completions=lambda name: FakeCompletions(self))
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
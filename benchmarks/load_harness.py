@@ -0,0 +1,237 @@
+"""Нагрузочный прогон настоящих обработчиков app/handlers.py с поддельными Telegram и Yandex Cloud.
+
+Сообщения отправляются с заданной параллельностью, задержки сервисов задаются как "медиана[:sigma]".
+Отчет: задержки первого ответа и полного ответа (p50/p95/p99), задержка цикла событий,
+обращения к базе на сообщение, вызовы сервисов и пиковая память.
+
+Запуск: python -m benchmarks.load_harness --messages 500 --concurrency 50 --run-latency 2:0.5
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import resource
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from benchmarks.fakes import FakeBot, FakeSDK, FakeLatencies, Latency
+
+QUESTIONS = [
+    "Как заменить подшипник на моталке?",
+    "Какой момент затяжки у клеммы двигателя?",
+    "Что делать, если инвертор показывает ошибку OC?",
+    "Где лежит предохранитель 2А?",
+    "Как проверить датчик натяжения нити?",
+    "Какая периодичность смазки редуктора?",
+]
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=300, help="количество сообщений")
+    parser.add_argument('--concurrency', type=int, default=30, help="сколько сообщений обрабатывается одновременно")
+    parser.add_argument('--chats', type=int, default=100, help="количество разных чатов")
+    parser.add_argument('--repeat', type=float, default=0.3, help="доля повторяющихся вопросов")
+    parser.add_argument('--searchapi', type=float, default=0.0, help="доля запросов /searchapi")
+    parser.add_argument('--telegram-latency', type=Latency.parse, default=Latency(0.05, 0.3))
+    parser.add_argument('--thread-latency', type=Latency.parse, default=Latency(0.03, 0.3))
+    parser.add_argument('--run-latency', type=Latency.parse, default=Latency(2.0, 0.5))
+    parser.add_argument('--search-latency', type=Latency.parse, default=Latency(1.5, 0.5))
+    parser.add_argument('--run-hang', type=float, default=0.0, help="доля зависающих запусков ассистента")
+    parser.add_argument('--run-deadline', type=float, default=None,
+                        help="предельное время запуска ассистента, по умолчанию AI_RUN_DEADLINE")
+    parser.add_argument('--no-stream', action='store_true', help="отвечать одним сообщением вместо правок")
+    return parser.parse_args()
+
+def start_search_stub(latency: Latency) -> ThreadingHTTPServer:
+    """Заглушка генеративного Search API с задержкой из распределения."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency.sample())
+            body = json.dumps({"message": {"content": "Ответ поиска"}, "links": ["https://example.com"]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def monitor_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.01):
+    """Измеряет, насколько позже запланированного просыпается цикл событий."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+def make_update(bot: FakeBot, update_id: int, chat_id: int, text: str):
+    from telegram import Update
+    data = {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(datetime.now(timezone.utc).timestamp()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load', 'username': f'user{chat_id}'},
+            'text': text,
+        },
+    }
+    return Update.de_json(data, bot)
+
+async def main(args):
+    # Все файлы прогона во временном каталоге, реальная база и кэши не трогаются
+    workdir = tempfile.mkdtemp(prefix='load-harness-')
+    os.environ['STATE_BACKEND'] = 'sqlite'
+    os.environ['STREAM_REPLIES'] = 'False' if args.no_stream else 'True'
+    if args.run_deadline is not None:
+        # Общий таймаут запроса, как и по умолчанию, больше срока запуска: зависший запуск
+        # должен завершиться по сроку и попасть в предохранитель, а не быть отмененным
+        os.environ['AI_RUN_DEADLINE'] = str(args.run_deadline)
+        os.environ['AI_REQUEST_TIMEOUT'] = str(args.run_deadline * 1.5 + 1)
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    from app.db_wrappers import sqlitedb, logstore
+    from app.db_wrappers.init_sqlite_db import init_sqlite_db
+    sqlitedb.DB_PATH = os.path.join(workdir, 'tgbot.db')
+    logstore.LOG_DB_PATH = os.path.join(workdir, 'tgbot_logs.db')
+    init_sqlite_db(sqlitedb.DB_PATH)
+
+    # Считаем каждое обращение к потоку базы данных
+    db_ops = 0
+    run_in_db = sqlitedb.run_in_db
+
+    async def counted_run_in_db(func, *func_args):
+        nonlocal db_ops
+        db_ops += 1
+        return await run_in_db(func, *func_args)
+    sqlitedb.run_in_db = counted_run_in_db
+
+    latencies = FakeLatencies(
+        telegram=args.telegram_latency,
+        thread_op=args.thread_latency,
+        run=args.run_latency,
+        search_api=args.search_latency,
+        run_hang=args.run_hang,
+    )
+    sdk = FakeSDK(latencies)
+    from app.ai import sdk as sdk_module, ai_assistants, searchapi
+    sdk_module._sdk = sdk
+    ai_assistants._assistant = sdk.assistant
+    server = start_search_stub(args.search_latency)
+    searchapi.SEARCH_API_GENERATIVE = f"http://127.0.0.1:{server.server_port}/generative"
+
+    from app import handlers
+    from app.db_wrappers.log_writer import start_log_writer, stop_log_writer
+    from app.ai.http_client import close_http_client
+    from app.ai.answer_cache import answer_cache
+    from app.ai.single_flight import single_flight
+    from app.scheduler import chat_scheduler
+    from app.ai.call_policy import policy_stats
+    from app.metrics import FALLBACKS
+
+    bot = FakeBot(args.telegram_latency)
+    context = SimpleNamespace(bot=bot)
+    start_log_writer()
+
+    # Повторяющиеся вопросы берутся из небольшого набора, остальные уникальны
+    messages = []
+    for number in range(args.messages):
+        chat_id = 10_000 + random.randrange(args.chats)
+        if random.random() < args.repeat:
+            text = random.choice(QUESTIONS)
+        else:
+            text = f"{random.choice(QUESTIONS)} Вариант {number}"
+        if random.random() < args.searchapi:
+            text = f"/searchapi {text}"
+        messages.append((number, chat_id, text))
+
+    first_latencies, full_latencies, errors = [], [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def deliver(number: int, chat_id: int, text: str):
+        nonlocal errors
+        # Вопросы одного чата идут по очереди, поэтому время первого ответа по chat_id относится к этому сообщению
+        async with semaphore:
+            update = make_update(bot, number + 1, chat_id, text)
+            started = time.perf_counter()
+            bot.first_reply.pop(chat_id, None)
+            try:
+                if text.startswith('/searchapi'):
+                    await handlers.searchapi_handler(update, context)
+                else:
+                    await handlers.ai_assistant_handler(update, context)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"Ошибка обработчика: {e!r}")
+                return
+            finished = time.perf_counter()
+            first = bot.first_reply.get(chat_id, finished)
+            first_latencies.append(max(first - started, 0.0))
+            full_latencies.append(finished - started)
+
+    lag_samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples, stop))
+    tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(deliver(*message) for message in messages))
+    elapsed = time.perf_counter() - started
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    await monitor
+
+    await stop_log_writer()
+    await close_http_client()
+    await sqlitedb.close_db()
+    await logstore.close_log_store()
+    server.shutdown()
+
+    def line(name: str, values: list):
+        print(f"{name:<28} p50 {percentile(values, 50) * 1000:8.1f} мс   "
+              f"p95 {percentile(values, 95) * 1000:8.1f} мс   p99 {percentile(values, 99) * 1000:8.1f} мс")
+
+    print(f"Сообщений: {args.messages}, параллельно: {args.concurrency}, чатов: {args.chats}, ошибок: {errors}")
+    print(f"Время прогона: {elapsed:.2f} с, пропускная способность: {args.messages / elapsed:.1f} сообщ/с")
+    line("Первый ответ", first_latencies)
+    line("Полный ответ", full_latencies)
+    line("Задержка цикла событий", lag_samples)
+    print(f"{'Макс. задержка цикла':<28} {max(lag_samples, default=0) * 1000:.1f} мс")
+    print(f"{'Обращений к БД на сообщение':<28} {db_ops / max(args.messages, 1):.2f}")
+    print(f"{'Пиковая память (tracemalloc)':<28} {peak_traced / 1024 / 1024:.1f} МБ")
+    print(f"{'Пиковый RSS процесса':<28} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+    print(f"Вызовы SDK: {dict(sorted(sdk.calls.items()))}")
+    print(f"Вызовы Telegram: {dict(sorted(bot.calls.items()))}")
+    print(f"Кэш ответов: {answer_cache.stats()}")
+    print(f"Объединение запросов: {single_flight.stats()}")
+    print(f"Планировщик: {chat_scheduler.stats()}")
+    print(f"Вызовы Yandex Cloud: {policy_stats()}")
+    print(f"Запасные ответы: { {key[0]: int(value) for key, value in FALLBACKS._values.items()} }")
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
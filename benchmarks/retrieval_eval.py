@@ -0,0 +1,169 @@
+"""Оценка полноты и скорости локального поиска по складу (app/inventory/retrieval.py).
+
+Наборы вопросов:
+  - синтетические: по каждой позиции склада строятся вопросы о модели и о группе с параметрами,
+    в части вопросов кириллица и латиница перепутаны или пропущена буква; правильный ответ известен;
+  - из журнала: вопросы пользователей из tgbot_logs; правильными считаются позиции, которые находит
+    точный поиск по складу (app/inventory/search.py), вопросы без таких позиций пропускаются.
+
+Для сравнения тот же поиск работает по кускам файла склада примерно по 500 токенов, как нарезает
+его удаленный индекс: позиция считается найденной, только если она целиком попала в найденный кусок.
+
+Запуск: python -m benchmarks.retrieval_eval --db data/tgbot_logs.db --k 5
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+from benchmarks.load_harness import percentile
+
+# Размер куска и перекрытие удаленного индекса в символах, около 3 символов на токен
+CHUNK_CHARS = 500 * 3
+CHUNK_OVERLAP = 100 * 3
+# Сколько последних записей журнала просматривать
+LOG_LIMIT = 5000
+
+# Кириллические двойники латинских букв для порчи кодов моделей
+SWAPS = {'a': 'а', 'c': 'с', 'e': 'е', 'o': 'о', 'p': 'р', 'x': 'х', 'k': 'к', 'm': 'м'}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/tgbot_logs.db', help="база логов с таблицей tgbot_logs")
+    parser.add_argument('--k', type=int, default=5, help="сколько позиций выбирать")
+    parser.add_argument('--synthetic', type=int, default=300, help="сколько синтетических вопросов")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def perturb(text: str, rng: random.Random) -> str:
+    """Путает кириллицу с латиницей или пропускает букву, как в вопросах пользователей."""
+    if rng.random() < 0.5:
+        return ''.join(SWAPS.get(char, char) if rng.random() < 0.5 else char for char in text)
+    letters = [i for i, char in enumerate(text) if char.isalnum()]
+    if len(letters) < 5:
+        return text
+    drop = rng.choice(letters[1:])
+    return text[:drop] + text[drop + 1:]
+
+def synthetic_questions(records: list, count: int, rng: random.Random) -> list:
+    """Вопросы с известным ответом: (вопрос, множество номеров правильных позиций)."""
+    from app.inventory.search import clean
+    # Одинаковые позиции на разных складах считаются одним правильным ответом
+    same = {}
+    for record_id, record in enumerate(records):
+        key = (clean(record.get('manufacturer')).lower(), clean(record.get('specs')).lower())
+        same.setdefault(key, set()).add(record_id)
+
+    questions = []
+    for record_id in rng.sample(range(len(records)), min(count, len(records))):
+        record = records[record_id]
+        manufacturer, specs = clean(record.get('manufacturer')), clean(record.get('specs'))
+        group = clean(record.get('equipment_group')).lower()
+        if manufacturer and any(char.isdigit() for char in manufacturer):
+            text = f"Есть {manufacturer}?"
+        elif specs:
+            text = f"нужен {group} {specs} {manufacturer}"
+        else:
+            continue
+        if rng.random() < 0.4:
+            text = perturb(text, rng)
+        questions.append((text, same[(manufacturer.lower(), specs.lower())]))
+    return questions
+
+def logged_questions(db_path: str, records: list) -> list:
+    """Вопросы из журнала с позициями, которые находит точный поиск."""
+    from app.inventory.search import InventoryIndex
+    if not os.path.exists(db_path):
+        return []
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            'SELECT message_text FROM tgbot_logs ORDER BY id DESC LIMIT ?', (LOG_LIMIT,)
+        ).fetchall()
+
+    index = InventoryIndex(records)
+    ids = {id(record): record_id for record_id, record in enumerate(records)}
+    questions, seen = [], set()
+    for (text,) in rows:
+        # В журнале вперемешку вопросы и ответы; ответы длинные или начинаются с подписи
+        if not text or len(text) > 300 or text.startswith(('Ответ SearchAPI', 'Нашла на складе')) or text in seen:
+            continue
+        seen.add(text)
+        result = index.search(text)
+        if result.records and len(result.records) <= 20:
+            questions.append((text, {ids[id(record)] for record in result.records}))
+    return questions
+
+def build_chunks(records: list) -> tuple:
+    """Нарезает файл склада на куски с перекрытием. Возвращает куски и номера целиком попавших в них позиций."""
+    text, spans = '', []
+    for record in records:
+        start = len(text)
+        text += json.dumps(record, ensure_ascii=False, indent=2) + ',\n'
+        spans.append((start, len(text)))
+
+    chunks, contained = [], []
+    step = CHUNK_CHARS - CHUNK_OVERLAP
+    for start in range(0, max(len(text) - CHUNK_OVERLAP, 1), step):
+        end = start + CHUNK_CHARS
+        chunks.append({'specs': text[start:end]})
+        contained.append({record_id for record_id, (a, b) in enumerate(spans) if a >= start and b <= end})
+    return chunks, contained
+
+def evaluate(name: str, questions: list, search, k: int):
+    recalls, hits, latencies = [], 0, []
+    for text, relevant in questions:
+        started = time.perf_counter()
+        found = search(text)
+        latencies.append(time.perf_counter() - started)
+        matched = len(found & relevant)
+        recalls.append(matched / min(len(relevant), k))
+        hits += bool(matched)
+    count = len(questions) or 1
+    print(f"  {name:<26} recall@{k} {sum(recalls) / count:6.3f}   hit@{k} {hits / count:6.3f}   "
+          f"p50 {percentile(latencies, 50) * 1000:7.3f} мс   p95 {percentile(latencies, 95) * 1000:7.3f} мс")
+
+def main(args):
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    from app.inventory.search import inventory_source, load_records
+    from app.inventory.retrieval import HybridRetriever, NUMPY_AVAILABLE
+    records = load_records(inventory_source())
+    positions = {id(record): record_id for record_id, record in enumerate(records)}
+    k = args.k
+
+    retrievers = {'гибридный (python)': HybridRetriever(records, use_numpy=False)}
+    if NUMPY_AVAILABLE:
+        retrievers['гибридный (numpy)'] = HybridRetriever(records, use_numpy=True)
+    else:
+        print("numpy не установлен, векторный подсчет пропущен")
+
+    chunks, contained = build_chunks(records)
+    chunk_retriever = HybridRetriever(chunks, use_numpy=False)
+
+    def chunk_search(text: str) -> set:
+        found = set()
+        for chunk, _ in chunk_retriever.retrieve(text, k=k, min_score=0.0):
+            found |= contained[chunks.index(chunk)]
+        return found
+
+    sets = [
+        ("Синтетические вопросы", synthetic_questions(records, args.synthetic, random.Random(args.seed))),
+        ("Вопросы из журнала", logged_questions(args.db, records)),
+    ]
+    print(f"Позиций на складе: {len(records)}, кусков для сравнения: {len(chunks)}")
+    for title, questions in sets:
+        print(f"{title}: {len(questions)}")
+        if not questions:
+            continue
+        for name, retriever in retrievers.items():
+            evaluate(name, questions, lambda text, r=retriever: {
+                positions[id(record)] for record, _ in r.retrieve(text, k=k, min_score=0.0)
+            }, k)
+        evaluate(f"куски по 500 токенов, top-{k}", questions, chunk_search, k)
+
+if __name__ == "__main__":
+    main(parse_args())
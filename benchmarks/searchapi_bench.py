@@ -0,0 +1,67 @@
+"""Проверка клиента Search API на локальной заглушке: параллельные запросы должны перекрываться.
+
+Заглушка отвечает с задержкой, первые ответы отдает с кодом 503, чтобы проверить повторы.
+Запуск: python -m benchmarks.searchapi_bench [количество запросов] [задержка заглушки, с]
+"""
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.ai import searchapi
+from app.ai.http_client import close_http_client
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Заглушка генеративного поиска."""
+    protocol_version = 'HTTP/1.1'
+    delay = 0.2
+    fail_first = 2
+    connections = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with StubHandler.lock:
+            StubHandler.connections.add(self.client_address)
+            fail = StubHandler.fail_first > 0
+            StubHandler.fail_first -= 1
+        time.sleep(StubHandler.delay)
+
+        if fail:
+            status, body = 503, b'{}'
+        else:
+            status = 200
+            body = json.dumps({"message": {"content": "ok"}, "links": ["https://example.com"]}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+async def main(count: int, delay: float):
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    searchapi.SEARCH_API_GENERATIVE = f"http://127.0.0.1:{server.server_port}/generative"
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(searchapi.search_api_generative(f"вопрос {i}") for i in range(count)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_http_client()
+        server.shutdown()
+
+    ok = sum(1 for result in results if "ok" in result)
+    print(f"Запросов: {count}, успешных: {ok}, соединений: {len(StubHandler.connections)}")
+    print(f"Время: {elapsed:.2f} с, последовательно было бы не меньше {count * delay:.2f} с")
+    print("Запросы перекрываются" if elapsed < count * delay / 2 else "Запросы НЕ перекрываются")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    asyncio.run(main(count, delay))
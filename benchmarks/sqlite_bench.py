@@ -0,0 +1,87 @@
+"""Микробенчмарк слоя SQLite: соединение на каждый вызов против долгоживущего соединения.
+
+Запуск: python -m benchmarks.sqlite_bench [количество операций]
+"""
+import sys
+import time
+import asyncio
+import sqlite3
+import tempfile
+import os
+from loguru import logger
+from app.db_wrappers.init_sqlite_db import init_sqlite_db
+from app.db_wrappers import sqlitedb, logstore
+
+def dict_factory(cursor, row):
+    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+def legacy_connection(db_path: str) -> sqlite3.Connection:
+    """Прежний способ: новое соединение и словари на каждый вызов."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = dict_factory
+    return conn
+
+def legacy_get_thread_id(db_path: str, chat_id: str):
+    with legacy_connection(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT thread_id FROM tgbot_chats WHERE chat_id = ?', (chat_id,))
+        result = cursor.fetchone()
+    return result['thread_id'] if result else None
+
+def legacy_create_log(db_path: str, chat_id: str, text: str):
+    with legacy_connection(db_path) as conn:
+        conn.execute(
+            'INSERT INTO tgbot_logs (chat_id, user_nickname, message_text, message_time) VALUES (?, ?, ?, ?)',
+            (chat_id, 'bench', text, '2024-01-01T00:00:00')
+        )
+
+def report(name: str, count: int, elapsed: float):
+    print(f"{name:<40} {count / elapsed:>12,.0f} оп/с")
+
+async def main(count: int):
+    logger.remove()
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        pooled_path = os.path.join(tmp, 'pooled.db')
+        logstore.LOG_DB_PATH = os.path.join(tmp, 'logs.db')
+        for path in (legacy_path, pooled_path):
+            init_sqlite_db(path)
+            with sqlite3.connect(path) as conn:
+                conn.execute('PRAGMA journal_mode=DELETE')
+                conn.executemany(
+                    'INSERT INTO tgbot_chats (chat_id, thread_id) VALUES (?, ?)',
+                    [(str(i), f'thread-{i}') for i in range(1000)]
+                )
+        # Прежняя схема: логи в основной базе, время текстом
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute(
+                'CREATE TABLE tgbot_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, '
+                'user_nickname TEXT, message_text TEXT, message_time TEXT)'
+            )
+
+        start = time.perf_counter()
+        for i in range(count):
+            legacy_get_thread_id(legacy_path, str(i % 1000))
+        report("get_thread_id, соединение на вызов", count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(count):
+            legacy_create_log(legacy_path, str(i % 1000), 'text')
+        report("create_log, соединение на вызов", count, time.perf_counter() - start)
+
+        sqlitedb.DB_PATH = pooled_path
+        start = time.perf_counter()
+        for i in range(count):
+            await sqlitedb.get_thread_id(str(i % 1000))
+        report("get_thread_id, общее соединение", count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(count):
+            await sqlitedb.create_log(str(i % 1000), 'bench', 'text', '2024-01-01T00:00:00')
+        report("create_log, общее соединение", count, time.perf_counter() - start)
+
+        await sqlitedb.close_db()
+        await logstore.close_log_store()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
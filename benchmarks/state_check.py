@@ -0,0 +1,189 @@
+"""Проверка хранилища состояния: параллельный get-or-create потока не должен давать дубликатов.
+
+Имитирует несколько реплик, одновременно получающих поток для одних и тех же чатов.
+Запуск:
+    python -m benchmarks.state_check sqlite
+    python -m benchmarks.state_check pocketbase          # PocketBase по адресу POCKETBASE_URL
+    python -m benchmarks.state_check pocketbase --stub   # локальная заглушка REST API PocketBase
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHATS = 20
+REPLICAS = 8
+# Больше размера пакета PocketBase, чтобы логи ушли несколькими пакетами
+LOGS = 120
+
+# Поля с уникальным индексом в коллекциях PocketBase
+UNIQUE_FIELDS = {'tgbot_chats': 'chat_id', 'tgbot_answer_cache': 'cache_key'}
+
+class PocketBaseStub(BaseHTTPRequestHandler):
+    """Заглушка REST API записей PocketBase: список с фильтром по chat_id, создание, изменение с "+"
+    и пакетный запрос /api/batch."""
+    collections = {}
+    lock = threading.Lock()
+    # Как и PocketBase, отклоняет пакеты больше этого размера с кодом 400
+    batch_limit = 50
+
+    def _send(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, path: str = None):
+        match = re.match(r'/api/collections/(\w+)/records(?:/(\w+))?', urlparse(path or self.path).path)
+        return match.group(1), match.group(2)
+
+    def _body(self) -> dict:
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+    def do_GET(self):
+        name, _ = self._route()
+        query = parse_qs(urlparse(self.path).query)
+        records = list(self.collections.get(name, {}).values())
+        # Из фильтра учитываются только условия равенства строковых полей
+        for key, value in re.findall(r'(\w+) = "(.*?)"', query.get('filter', [''])[0]):
+            records = [record for record in records if record.get(key) == value]
+        for key in reversed(query.get('sort', [''])[0].split(',')):
+            if key:
+                records.sort(key=lambda record: record.get(key.lstrip('-'), 0), reverse=key.startswith('-'))
+        page, per_page = int(query.get('page', ['1'])[0]), int(query.get('perPage', ['30'])[0])
+        items = records[(page - 1) * per_page:page * per_page]
+        self._send(200, {'page': page, 'perPage': per_page, 'totalItems': len(records),
+                         'totalPages': -(-len(records) // per_page), 'items': items})
+
+    def _create(self, name: str, data: dict) -> tuple:
+        records = self.collections.setdefault(name, {})
+        unique = UNIQUE_FIELDS.get(name)
+        if unique and any(r[unique] == data[unique] for r in records.values()):
+            return 400, {'message': 'Failed to create record.'}
+        record = {'message_count': 0, 'context_tokens': 0, 'compactions': 0, 'tokens_saved': 0}
+        record.update(data, id=uuid.uuid4().hex[:15])
+        records[record['id']] = record
+        return 200, record
+
+    def do_POST(self):
+        data = self._body()
+        if urlparse(self.path).path == '/api/batch':
+            self._batch(data.get('requests', []))
+            return
+        name, _ = self._route()
+        with self.lock:
+            status, record = self._create(name, data)
+        self._send(status, record)
+
+    def _batch(self, requests: list):
+        # Пакет применяется целиком за один проход под блокировкой, как транзакция PocketBase
+        if len(requests) > self.batch_limit:
+            self._send(400, {'message': f'The allowed max number of batch requests is {self.batch_limit}.'})
+            return
+        with self.lock:
+            if any(request['method'] != 'POST' for request in requests):
+                self._send(400, {'message': 'Only create requests are supported by the stub.'})
+                return
+            snapshot = {name: dict(records) for name, records in self.collections.items()}
+            results = []
+            for request in requests:
+                name, _ = self._route(request['url'])
+                status, record = self._create(name, request.get('body', {}))
+                if status != 200:
+                    self.collections.clear()
+                    self.collections.update(snapshot)
+                    self._send(400, {'message': 'Batch transaction failed.', 'data': {'requests': results}})
+                    return
+                results.append({'status': status, 'body': record})
+        self._send(200, results)
+
+    def do_PATCH(self):
+        name, record_id = self._route()
+        data = self._body()
+        with self.lock:
+            record = self.collections[name][record_id]
+            for key, value in data.items():
+                if key.endswith('+'):
+                    record[key[:-1]] = record.get(key[:-1], 0) + value
+                else:
+                    record[key] = value
+        self._send(200, record)
+
+    def log_message(self, *args):
+        pass
+
+async def main(backend_name: str, stub: bool):
+    os.environ['STATE_BACKEND'] = backend_name
+    if stub:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), PocketBaseStub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ['POCKETBASE_URL'] = f"http://127.0.0.1:{server.server_port}"
+        os.environ.pop('POCKETBASE_EMAIL', None)
+    if backend_name == 'sqlite':
+        from app.db_wrappers.init_sqlite_db import init_sqlite_db
+        from app.db_wrappers import sqlitedb, logstore
+        sqlitedb.DB_PATH = os.path.join(tempfile.mkdtemp(), 'state.db')
+        logstore.LOG_DB_PATH = os.path.join(os.path.dirname(sqlitedb.DB_PATH), 'logs.db')
+        init_sqlite_db(sqlitedb.DB_PATH)
+
+    from app.db_wrappers import state
+
+    created = []
+    discarded = []
+
+    async def create_thread():
+        # Создание потока в Yandex Cloud занимает заметное время, за которое успевают прийти другие реплики
+        await asyncio.sleep(random.uniform(0.01, 0.05))
+        thread_id = f"thread-{uuid.uuid4().hex[:8]}"
+        created.append(thread_id)
+        return thread_id
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        state.get_or_create_thread_id(f"chat-{chat}", create_thread, discarded.append)
+        for chat in range(CHATS) for _ in range(REPLICAS)
+    ))
+    elapsed = time.perf_counter() - started
+
+    by_chat = {}
+    for index, thread_id in enumerate(results):
+        by_chat.setdefault(index // REPLICAS, set()).add(thread_id)
+    stored = {chat: await state.get_thread_id(f"chat-{chat}") for chat in range(CHATS)}
+    consistent = all(threads == {stored[chat]} for chat, threads in by_chat.items())
+
+    await state.create_logs([(f"chat-{i % CHATS}", 'bench', 'text', 1704067200) for i in range(LOGS)])
+    logged = sum(row['messages'] for row in await state.get_period_stats(period='day'))
+    usage = await state.add_context_usage("chat-0", stored[0], 2, 100)
+
+    # История потока и кэш ответов должны быть видны любой реплике через общее хранилище
+    now = time.time()
+    await state.add_thread_messages([(stored[0], role, text, 1, now) for role, text in
+                                     (('user', 'вопрос'), ('assistant', 'ответ'), ('user', 'еще вопрос'))])
+    history = await state.get_thread_messages(stored[0], 2)
+    await state.save_cached_answer('assistant:вопрос', 'ответ', 'fp', now, 1.0)
+    await state.save_cached_answer('assistant:вопрос', 'новый ответ', 'fp', now, 1.0)
+    cached = await state.get_cached_answer('assistant:вопрос', 'fp', 0.0)
+    await state.close_state()
+
+    print(f"Хранилище: {backend_name}{' (заглушка)' if stub else ''}")
+    print(f"Вызовов: {len(results)}, создано потоков: {len(created)}, чатов: {CHATS}")
+    print(f"Потоков осталось после удаления лишних: {len(created) - len(discarded)}")
+    print(f"Каждый чат получил один поток: {'да' if consistent else 'НЕТ'}")
+    print(f"Записано логов: {logged} из {LOGS}")
+    print(f"Счетчики после приращения: {usage}")
+    print(f"Последние сообщения потока: {[text for _, text, _ in history]}")
+    print(f"Ответ из кэша: {cached}")
+    print(f"Время: {elapsed:.2f} с")
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else 'sqlite', '--stub' in sys.argv))
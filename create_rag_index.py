@@ -1,42 +1,51 @@
 import os
+import sys
 import json
+import time
+import zlib
+import asyncio
+import hashlib
+from importlib.metadata import version
 from dotenv import load_dotenv
 from loguru import logger
-from yandex_cloud_ml_sdk import YCloudML
+from yandex_cloud_ml_sdk import AsyncYCloudML
+from app.ai.sdk import get_sdk
+from app.ai.ai_assistants import INDEX_ID_PATH
+from app.inventory.store import STORE_SUFFIX, IDENTITY_FIELDS, InventoryStore
 from yandex_cloud_ml_sdk.search_indexes import VectorSearchIndexType, StaticIndexChunkingStrategy
-import time
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Получение идентификатора папки и API ключа из переменных окружения
+# Получение идентификатора папки из переменных окружения
 FOLDER_ID = os.getenv("YC_FOLDER_ID")
-YANDEX_API_KEY = os.getenv("YC_API_KEY")
 DATA_DIR = os.getenv("DATA_DIR")
 
-# Инициализация SDK с авторизацией
-sdk = YCloudML(folder_id=FOLDER_ID, auth=YANDEX_API_KEY)
+# Манифест загруженных файлов лежит в data/ рядом с index_id.json: без него все файлы загружаются заново
+MANIFEST_PATH = os.getenv("RAG_MANIFEST_PATH", "data/index_manifest.json")
+# Прежнее расположение манифеста в рабочем каталоге, читается, пока нового еще нет
+LEGACY_MANIFEST_PATH = "index_manifest.json"
+# Количество одновременных загрузок и ограничение частоты загрузок в секунду
+UPLOAD_CONCURRENCY = int(os.getenv("RAG_UPLOAD_CONCURRENCY", "4"))
+UPLOADS_PER_SECOND = float(os.getenv("RAG_UPLOADS_PER_SECOND", "2"))
+# Большие JSON со складом режутся на части по записям, чтобы правка одной позиции меняла одну часть
+SHARD_MIN_BYTES = int(os.getenv("RAG_SHARD_MIN_BYTES", "32768"))
+SHARD_COUNT = int(os.getenv("RAG_SHARD_COUNT", "16"))
+# Файлы живут 30 дней, поэтому перезагружаем их заранее
+FILE_TTL_DAYS = 30
+FILE_REFRESH_DAYS = int(os.getenv("RAG_FILE_REFRESH_DAYS", "25"))
+# Убрать файл из индекса нельзя. Поэтому при изменении или удалении любого файла индекс всегда
+# собирается заново только из актуальных файлов (без повторной загрузки неизмененных), и бот через
+# index_manager переключается на него: иначе ассистент цитировал бы прежние остатки склада.
+# Цена - повторная векторизация всего индекса при каждой правке склада.
+# Файлы, перезагруженные только из-за срока жизни, совпадают с прежними по содержимому: их копии
+# в индексе лишь дублируют выдачу, и индекс пересобирается, когда их больше этой доли от актуальных
+STALE_FILES_RATIO = float(os.getenv("RAG_STALE_FILES_RATIO", "0.25"))
 
 # Путь к директории с данными
 data_directory = f"knowledge/{DATA_DIR}"
 
-# Список для хранения ссылок на загруженные файлы
-uploaded_files = []
-
-# Загрузка всех файлов из директории данных
-for filename in os.listdir(data_directory):
-    file_path = os.path.join(data_directory, filename)
-    if os.path.isfile(file_path):
-        uploaded_file = sdk.files.upload(
-            file_path,
-            name=filename,
-            description=f"Данные базы знаний из {data_directory}",
-            ttl_days=30,
-            expiration_policy="SINCE_LAST_ACTIVE"
-        )
-        time.sleep(1)
-        uploaded_files.append(uploaded_file)
-
-# Создание типа векторного поискового индекса
+# Тип векторного поискового индекса
 index_type = VectorSearchIndexType(
     chunking_strategy=StaticIndexChunkingStrategy(
         max_chunk_size_tokens=500,#1000,
@@ -45,21 +54,228 @@ index_type = VectorSearchIndexType(
     doc_embedder_uri=f"emb://{FOLDER_ID}/text-search-doc/rc",
     query_embedder_uri=f"emb://{FOLDER_ID}/text-search-query/rc"
 )
-time.sleep(2)
-# Создание поискового индекса с загруженными файлами
-operation = sdk.search_indexes.create_deferred(
-    files=uploaded_files,
-    index_type=index_type,
-    name="rag_search_index",
-    description=f"Данные базы знаний из {data_directory}",
-    ttl_days=30,
-    expiration_policy="SINCE_LAST_ACTIVE"
-)
 
-# Ожидание завершения создания поискового индекса
-index = operation.wait()
+def record_shard(record: dict, shard_count: int) -> int:
+    """Возвращает номер части для записи склада.
+
+    Номер зависит только от полей, определяющих позицию, поэтому добавление
+    или удаление других записей не перемешивает части.
+    """
+    identity = [' '.join(str(record.get(key) or '').split()).lower() for key in IDENTITY_FIELDS]
+    return zlib.crc32(json.dumps(identity, ensure_ascii=False).encode('utf-8')) % shard_count
+
+def collect_sources(directory: str) -> dict:
+    """Собирает файлы для индекса: имя -> содержимое. Большие JSON со складом режутся на части.
+
+    Хранилище склада (.inv) превращается в такие же части JSON; storage.json рядом с ним пропускается.
+    """
+    sources = {}
+    filenames = sorted(os.listdir(directory))
+    for filename in filenames:
+        file_path = os.path.join(directory, filename)
+        if not os.path.isfile(file_path):
+            continue
+        stem, extension = os.path.splitext(filename)
+        if extension == '.json' and stem + STORE_SUFFIX in filenames:
+            continue
+        if extension == STORE_SUFFIX:
+            records = InventoryStore.load(file_path).records()
+            content = b''
+        else:
+            with open(file_path, 'rb') as file:
+                content = file.read()
+            records = None
+
+        if filename.endswith('.json') and len(content) >= SHARD_MIN_BYTES:
+            try:
+                records = json.loads(content).get('storage')
+            except (ValueError, AttributeError):
+                records = None
+
+        if not isinstance(records, list):
+            sources[filename] = content
+            continue
+
+        shards = [[] for _ in range(SHARD_COUNT)]
+        for record in records:
+            shards[record_shard(record, SHARD_COUNT)].append(record)
+        for number, shard in enumerate(shards):
+            if shard:
+                data = json.dumps({"storage": shard}, ensure_ascii=False, indent=2)
+                sources[f"{stem}.part-{number:02d}.json"] = data.encode('utf-8')
+        logger.info(f"{filename}: {len(records)} записей разбито на {sum(1 for s in shards if s)} частей")
+    return sources
+
+def load_manifest() -> dict:
+    """Загружает манифест ранее загруженных файлов.
+
+    files - актуальные файлы: имя -> хеш, идентификатор, время загрузки;
+    stale - идентификаторы прежних версий файлов, которые еще остаются в индексе.
+    """
+    for path in (MANIFEST_PATH, LEGACY_MANIFEST_PATH):
+        try:
+            with open(path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            continue
+    return {"index_id": None, "files": {}, "stale": []}
+
+def save_manifest(manifest: dict):
+    """Сохраняет манифест и идентификатор индекса."""
+    for path in (MANIFEST_PATH, INDEX_ID_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(MANIFEST_PATH, 'w') as file:
+        json.dump(manifest, file, indent=4, ensure_ascii=False)
+    with open(INDEX_ID_PATH, 'w') as json_file:
+        json.dump({"index_id": manifest["index_id"]}, json_file, indent=4)
+
+class RateLimiter:
+    """Ограничивает частоту запусков операций."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = max(self._next, loop.time()) + self.interval
+
+async def upload_files(sdk: AsyncYCloudML, sources: dict, names: list) -> dict:
+    """Параллельно загружает файлы с ограничением частоты. Возвращает имя -> идентификатор файла."""
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    limiter = RateLimiter(UPLOADS_PER_SECOND)
+
+    async def upload(name: str):
+        async with semaphore:
+            await limiter.wait()
+            uploaded_file = await sdk.files.upload_bytes(
+                sources[name],
+                name=name,
+                description=f"Данные базы знаний из {data_directory}",
+                mime_type="application/json" if name.endswith(".json") else "text/plain",
+                ttl_days=FILE_TTL_DAYS,
+                expiration_policy="SINCE_LAST_ACTIVE"
+            )
+            logger.info(f"Загружен файл {name}: {uploaded_file.id}")
+            return name, uploaded_file.id
+
+    return dict(await asyncio.gather(*(upload(name) for name in names)))
+
+# --- Адаптер к внутренним модулям SDK ---------------------------------------------------------
+# В публичном API yandex-cloud-ml-sdk 0.2.0 нет добавления файлов в существующий индекс
+# (SearchIndexFileService.BatchCreate). Вызов идет через внутренний клиент SDK, поэтому он собран
+# здесь и включен только для проверенных версий SDK; с другой версией индекс собирается заново.
+PRIVATE_SDK_VERSIONS = ("0.2.",)
+
+def can_add_files() -> bool:
+    """Можно ли добавить файлы в существующий индекс с установленной версией SDK."""
+    return version("yandex-cloud-ml-sdk").startswith(PRIVATE_SDK_VERSIONS)
+
+async def _batch_create_files(sdk: AsyncYCloudML, index_id: str, file_ids: list):
+    from yandex_cloud_ml_sdk._types.operation import AsyncOperation
+    from yandex.cloud.ai.assistants.v1.searchindex.search_index_file_service_pb2 import BatchCreateSearchIndexFileRequest
+    from yandex.cloud.ai.assistants.v1.searchindex.search_index_file_service_pb2_grpc import SearchIndexFileServiceStub
+    from yandex.cloud.operation.operation_pb2 import Operation as ProtoOperation
+
+    request = BatchCreateSearchIndexFileRequest(search_index_id=index_id, file_ids=file_ids)
+    async with sdk._client.get_service_stub(SearchIndexFileServiceStub, timeout=60) as stub:
+        response = await sdk._client.call_service(
+            stub.BatchCreate,
+            request,
+            timeout=60,
+            expected_type=ProtoOperation,
+        )
+
+    operation = AsyncOperation(sdk=sdk, id=response.id, result_type=None)
+    while True:
+        status = await operation.get_status()
+        if status.is_failed:
+            raise RuntimeError(f"Не удалось добавить файлы в индекс {index_id}: {status.error}")
+        if status.done:
+            return
+        await asyncio.sleep(2)
+# --- Конец адаптера ------------------------------------------------------------------------------
+
+async def add_files_to_index(sdk: AsyncYCloudML, index_id: str, file_ids: list):
+    """Добавляет файлы в существующий индекс; перед вызовом нужно проверить can_add_files()."""
+    await _batch_create_files(sdk, index_id, file_ids)
+
+async def create_index(sdk: AsyncYCloudML, file_ids: list) -> str:
+    """Создает поисковый индекс по загруженным файлам."""
+    operation = await sdk.search_indexes.create_deferred(
+        files=file_ids,
+        index_type=index_type,
+        name="rag_search_index",
+        description=f"Данные базы знаний из {data_directory}",
+        ttl_days=30,
+        expiration_policy="SINCE_LAST_ACTIVE"
+    )
+    # Ожидание завершения создания поискового индекса
+    index = await operation.wait(poll_interval=2)
+    return index.id
+
+async def main(full_rebuild: bool = False):
+    """Обновляет поисковый индекс, загружая и добавляя в него только новые и измененные файлы."""
+    started = time.monotonic()
+    sdk = get_sdk()
+
+    sources = collect_sources(data_directory)
+    manifest = load_manifest()
+    known = {} if full_rebuild else manifest.get("files", {})
+    refresh_before = time.time() - FILE_REFRESH_DAYS * 86400
+
+    hashes = {name: hashlib.sha256(content).hexdigest() for name, content in sources.items()}
+    added = [name for name in sources if name not in known]
+    changed = [
+        name for name in sources
+        if name in known and (known[name]["sha256"] != hashes[name] or known[name]["uploaded_at"] < refresh_before)
+    ]
+    removed = [name for name in known if name not in sources]
+    # Файлы, прежнее содержимое которых больше не соответствует базе знаний
+    outdated = [name for name in changed if known[name]["sha256"] != hashes[name]] + removed
+    logger.info(f"Файлов: {len(sources)}, новых: {len(added)}, измененных: {len(changed)}, удаленных: {len(removed)}")
+
+    uploaded = await upload_files(sdk, sources, added + changed)
+
+    files = {name: known[name] for name in sources if name in known}
+    for name, file_id in uploaded.items():
+        files[name] = {"sha256": hashes[name], "file_id": file_id, "uploaded_at": time.time()}
+
+    index_id = manifest.get("index_id")
+    stale = [] if full_rebuild else list(manifest.get("stale", []))
+    stale.extend(known[name]["file_id"] for name in changed + removed)
+
+    if uploaded and not can_add_files():
+        logger.warning(f"SDK {version('yandex-cloud-ml-sdk')} не проверен для добавления файлов в индекс, "
+                       f"индекс собирается заново")
+        full_rebuild = True
+
+    if full_rebuild or not index_id or outdated or len(stale) > STALE_FILES_RATIO * len(files):
+        # Новый индекс из актуальных файлов: неизмененные файлы повторно не загружаются,
+        # но весь индекс заново векторизуется
+        index_id = await create_index(sdk, [files[name]["file_id"] for name in sources])
+        stale = []
+        logger.info(f"Создан поисковый индекс: {index_id}")
+    elif uploaded:
+        # Векторизуются только новые файлы и перезагруженные по сроку жизни
+        await add_files_to_index(sdk, index_id, [uploaded[name] for name in added + changed])
+        logger.info(f"В индекс {index_id} добавлено файлов: {len(uploaded)}, повторов в нем: {len(stale)}")
+    else:
+        logger.info(f"Индекс {index_id} актуален")
+
+    # Сохранение идентификатора индекса и манифеста
+    save_manifest({"index_id": index_id, "files": files, "stale": stale})
+    logger.info(f"Обновление индекса заняло {time.monotonic() - started:.1f} с")
 
-# Сохранение идентификатора индекса в JSON файл
-index_id = {"index_id": index.id}
-with open("index_id.json", "w") as json_file:
-    json.dump(index_id, json_file, indent=4)
\ No newline at end of file
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(full_rebuild="--full" in sys.argv))
+    except Exception as e:
+        # Бот запускается и без обновления: он продолжит работать с прежним индексом
+        logger.error(f"Не удалось обновить поисковый индекс, остается прежний: {e!r}")
+        sys.exit(1)
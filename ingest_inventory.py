@@ -0,0 +1,214 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
+import zipfile
+import argparse
+import posixpath
+from typing import Iterator, List, Optional
+from xml.etree.ElementTree import iterparse
+from dotenv import load_dotenv
+from loguru import logger
+from app.inventory.store import FIELDS, STORE_SUFFIX, StoreWriter, InventoryStore, diff_records
+from app.inventory.units import expand_unit_words
+from app.inventory.search import INVENTORY_STORE_PATH, clean
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Сколько проблемных строк выводить в лог
+MAX_REPORTED_PROBLEMS = 20
+
+# Названия колонок таблицы -> поля позиции
+HEADER_ALIASES = {
+    'equipment_group': ('группа', 'группа оборудования', 'оборудование'),
+    'manufacturer': ('наименование', 'производитель', 'модель', 'бренд'),
+    'specs': ('параметры', 'характеристики', 'описание'),
+    'nominal': ('номенклатура', 'номенклатурный номер', 'номенклатурный код', 'код sap', 'sap'),
+    'qty': ('количество', 'кол-во', 'кол.', 'шт', 'штук'),
+    'storage_location': ('склад', 'место хранения'),
+    'placement': ('место', 'полка', 'ячейка'),
+    'used_placement': ('текущее место', 'место сейчас', 'используемое место'),
+    'new_placement': ('новое место',),
+    'installation': ('применение', 'установка', 'для чего', 'оборудование установки'),
+    'notes': ('примечание', 'примечания', 'комментарий'),
+}
+COLUMN_FIELDS = {' '.join(alias.split()): field for field, aliases in HEADER_ALIASES.items() for alias in (field,) + aliases}
+
+QTY_RE = re.compile(r'^(\d+(?:[.,]\d+)?)\s*(?:шт\.?|pcs|компл\.?)?$', re.IGNORECASE)
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOC_RELS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+def _column_index(reference: str) -> int:
+    """Номер колонки по адресу ячейки: "C12" -> 2."""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+def _text(element) -> str:
+    return ''.join(node.text or '' for node in element.iter(f'{XLSX_NS}t'))
+
+def _first_sheet(archive: zipfile.ZipFile, sheet: Optional[str]) -> str:
+    """Путь к листу книги внутри архива: указанного по имени или первого."""
+    workbook = iterparse(archive.open('xl/workbook.xml'))
+    target_id = None
+    for _, element in workbook:
+        if element.tag == f'{XLSX_NS}sheet' and (sheet is None or element.get('name') == sheet):
+            target_id = element.get(f'{DOC_RELS_NS}id')
+            break
+    if target_id is None:
+        raise ValueError(f"Лист {sheet} не найден")
+    for _, element in iterparse(archive.open('xl/_rels/workbook.xml.rels')):
+        if element.tag == f'{RELS_NS}Relationship' and element.get('Id') == target_id:
+            target = element.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    raise ValueError(f"Лист {sheet or 'по умолчанию'} не найден в описании книги")
+
+def read_xlsx(path: str, sheet: Optional[str] = None) -> Iterator[List[Optional[str]]]:
+    """Построчно читает лист xlsx, не загружая его целиком в память."""
+    with zipfile.ZipFile(path) as archive:
+        shared = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            for _, element in iterparse(archive.open('xl/sharedStrings.xml')):
+                if element.tag == f'{XLSX_NS}si':
+                    shared.append(_text(element))
+                    element.clear()
+
+        for _, element in iterparse(archive.open(_first_sheet(archive, sheet))):
+            if element.tag != f'{XLSX_NS}row':
+                continue
+            row = []
+            for cell in element.iter(f'{XLSX_NS}c'):
+                index = _column_index(cell.get('r', '')) if cell.get('r') else len(row)
+                kind = cell.get('t')
+                value_node = cell.find(f'{XLSX_NS}v')
+                if kind == 'inlineStr':
+                    value = _text(cell)
+                elif value_node is None:
+                    value = None
+                elif kind == 's':
+                    value = shared[int(value_node.text)]
+                else:
+                    value = value_node.text
+                row.extend([None] * (index - len(row)))
+                row.append(value)
+            # Обработанные строки удаляются, чтобы лист не копился в памяти
+            element.clear()
+            yield row
+
+def read_csv(path: str) -> Iterator[List[Optional[str]]]:
+    """Построчно читает CSV; разделитель (запятая, точка с запятой, табуляция) определяется автоматически."""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        sample = file.read(8192)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(file, dialect)
+
+def read_json(path: str) -> Iterator[dict]:
+    """Читает прежний storage.json вида {"storage": [...]}."""
+    with open(path, 'r', encoding='utf-8') as file:
+        yield from json.load(file).get('storage', [])
+
+def read_rows(path: str, sheet: Optional[str] = None) -> Iterator[dict]:
+    """Построчно читает таблицу склада и отдает строки как словари поле -> значение."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        yield from read_json(path)
+        return
+    rows = read_xlsx(path, sheet) if extension == '.xlsx' else read_csv(path)
+
+    columns = None
+    for row in rows:
+        if columns is None:
+            # Первая непустая строка - заголовок
+            if not any(cell and str(cell).strip() for cell in row):
+                continue
+            columns = [COLUMN_FIELDS.get(' '.join(str(cell or '').lower().split())) for cell in row]
+            unknown = [cell for cell, field in zip(row, columns) if cell and field is None]
+            if unknown:
+                logger.warning(f"Колонки без соответствия полям склада пропущены: {unknown}")
+            if not any(columns):
+                raise ValueError("В заголовке таблицы не найдено ни одной известной колонки")
+            continue
+        yield {field: value for field, value in zip(columns, row) if field}
+
+def normalize_record(row: dict) -> tuple:
+    """Приводит строку таблицы к позиции склада. Возвращает позицию (или None для пустой строки) и список проблем."""
+    record = {name: clean(row.get(name)) or None for name, kind in FIELDS if kind == 's'}
+    problems = []
+    if not record['equipment_group'] and not record['manufacturer']:
+        return None, problems
+
+    if record['specs']:
+        record['specs'] = expand_unit_words(record['specs'])
+
+    # Номенклатурный код из Excel может прийти числом: "65185506.0"
+    nominal = record['nominal']
+    if nominal and re.fullmatch(r'\d+\.0+|\d+(?:\.\d+)?[eE]\+?\d+', nominal):
+        record['nominal'] = str(int(float(nominal)))
+
+    qty = clean(row.get('qty')) or None
+    record['qty'] = None
+    if qty is not None:
+        match = QTY_RE.match(qty)
+        number = float(match.group(1).replace(',', '.')) if match else None
+        if number is None or not number.is_integer():
+            problems.append(f"количество {qty!r} не целое число")
+        else:
+            record['qty'] = int(number)
+    return {name: record[name] for name, _ in FIELDS}, problems
+
+def ingest(source: str, store_path: str = INVENTORY_STORE_PATH, sheet: Optional[str] = None) -> dict:
+    """Загружает таблицу склада в хранилище и сообщает, сколько позиций изменилось относительно прежней версии.
+
+    По умолчанию хранилище пишется рядом с INVENTORY_PATH: бот и create_rag_index.py берут склад из него.
+    """
+    started = time.monotonic()
+    writer = StoreWriter()
+    records, problems, skipped = [], [], 0
+    for number, row in enumerate(read_rows(source, sheet), start=2):
+        record, row_problems = normalize_record(row)
+        if record is None:
+            skipped += 1
+            continue
+        problems.extend(f"строка {number}: {problem}" for problem in row_problems)
+        writer.add(record)
+        records.append(record)
+
+    previous = InventoryStore.load(store_path).records() if os.path.exists(store_path) else []
+    changes = diff_records(previous, records)
+    writer.write(store_path)
+
+    for problem in problems[:MAX_REPORTED_PROBLEMS]:
+        logger.warning(problem)
+    counts = {op: sum(1 for change in changes if change['op'] == op) for op in ('added', 'changed', 'removed')}
+    summary = {
+        'records': len(records),
+        'skipped_rows': skipped,
+        'problems': len(problems),
+        'size_bytes': os.path.getsize(store_path),
+        **counts,
+    }
+    logger.info(f"Склад загружен за {time.monotonic() - started:.2f} с: {summary}")
+    return summary
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Загрузка таблицы склада (xlsx, CSV или storage.json) в хранилище склада")
+    parser.add_argument('source', help="файл storage.xlsx, CSV или прежний storage.json")
+    parser.add_argument('--out', default=INVENTORY_STORE_PATH, help=f"файл хранилища ({STORE_SUFFIX})")
+    parser.add_argument('--sheet', default=None, help="имя листа xlsx, по умолчанию первый")
+    args = parser.parse_args(argv)
+    ingest(args.source, args.out, args.sheet)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
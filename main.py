@@ -1,10 +1,31 @@
+import os
 import asyncio
 import signal
+import dotenv
 from telegram import Update
 from telegram.ext import Application
 from loguru import logger
 from app.bot import bot_init
 from app.db_wrappers.init_sqlite_db import init_sqlite_db
+from app.db_wrappers.sqlitedb import close_db
+from app.db_wrappers.state import STATE_BACKEND, close_state
+from app.db_wrappers.log_writer import start_log_writer, stop_log_writer
+from app.db_wrappers.logstore import log_maintenance, close_log_store
+from app.ai.answer_cache import answer_cache
+from app.ai.single_flight import single_flight
+from app.ai.index_manager import index_manager
+from app.ai.http_client import close_http_client
+from app.ai.thread_history import thread_history
+from app.ai.call_policy import policy_stats
+from app.scheduler import chat_scheduler
+from app.webhook import TelegramWebhook, create_http_server
+from app.metrics import registry, monitor_loop_lag, COMPONENT_STATS
+
+# Загрузка переменных окружения
+dotenv.load_dotenv()
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
 # Настройка логирования
 logger.add("logs/app.log", rotation="5 MB", retention="100 days", level="DEBUG")
@@ -17,6 +38,9 @@ async def bot_runner():
     try:
         logger.info("Инициализация базы данных...")
         init_sqlite_db()
+        start_log_writer()
+        # Старые логи уходят в помесячные архивы, базы обслуживаются в фоне
+        log_maintenance.start()
         
         # Инициализация бота и приложения
         application: Application = await bot_init()
@@ -29,7 +53,22 @@ async def bot_runner():
         # Запуск бота
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        webhook = None
+        if BOT_MODE == "webhook":
+            # Обновления приходят на порт 5000, несколько реплик можно держать за балансировщиком
+            webhook = TelegramWebhook(application)
+        # /health и /metrics доступны на том же порту и в режиме polling
+        http_server = create_http_server(application, webhook)
+        await http_server.start()
+        if webhook is not None:
+            await webhook.register()
+        else:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        registry.add_collector(collect_component_stats)
+        lag_task = asyncio.create_task(monitor_loop_lag())
+        
+        # Ассистент готовится в фоне, бот уже принимает сообщения; дальше менеджер следит за индексом
+        index_manager.start()
 
         logger.info("Бот запущен. Нажмите Ctrl+C для остановки.")
 
@@ -37,8 +76,23 @@ async def bot_runner():
         await stop_event.wait()
 
         # Корректная остановка бота
+        await index_manager.stop()
+        await log_maintenance.stop()
+        lag_task.cancel()
+        await http_server.stop()
         await application.stop()
         await application.shutdown()
+        await thread_history.flush()
+        # Обработчики остановлены, дописываем накопленные ими логи до закрытия баз
+        await stop_log_writer()
+        await close_http_client()
+        if STATE_BACKEND != "sqlite":
+            await close_state()
+        await close_log_store()
+        await close_db()
+        logger.info(f"Статистика кэша ответов: {answer_cache.stats()}")
+        logger.info(f"Статистика объединения запросов: {single_flight.stats()}")
+        logger.info(f"Статистика планировщика: {chat_scheduler.stats()}")
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
@@ -46,6 +100,19 @@ async def bot_runner():
     finally:
         logger.info("Работа бота завершена.")
 
+def collect_component_stats():
+    """Переносит статистику кэша, объединения запросов, планировщика и вызовов Yandex Cloud в метрики."""
+    components = [("answer_cache", answer_cache.stats()), ("single_flight", single_flight.stats()),
+                  ("scheduler", chat_scheduler.stats()),
+                  ("index_manager", index_manager.stats()),
+                  ("log_maintenance", log_maintenance.stats())]
+    # Правила вызова Yandex Cloud и предохранители
+    components.extend(policy_stats().items())
+    for component, stats in components:
+        for name, value in stats.items():
+            if isinstance(value, (int, float)):
+                COMPONENT_STATS.set(value, component=component, stat=name)
+
 async def shutdown(application: Application):
     """Корректное завершение работы приложения."""
     logger.info("Получен сигнал остановки, завершение работы...")